@@ -0,0 +1,212 @@
+# almacen.py
+# Almacén persistente del proyecto (SQLite en modo WAL).
+# Sustituye a estado_proyecto.json: cada alta de canción o de pista es una
+# escritura pequeña en su propia transacción, en lugar de reescribir todo el
+# estado, y varios procesos (workers de gunicorn, hilos de trabajos) pueden
+# leer y escribir a la vez sin pisarse.
+#
+# Solo guarda y devuelve diccionarios; clases.py los convierte en Cancion / Pista.
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+PROJECT_DB = os.getenv("PROJECT_DB", "proyecto.db")
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS proyectos (
+    id          INTEGER PRIMARY KEY,
+    nombre      TEXT NOT NULL UNIQUE,
+    creado      TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS canciones (
+    id            INTEGER PRIMARY KEY,
+    proyecto_id   INTEGER NOT NULL REFERENCES proyectos(id) ON DELETE CASCADE,
+    titulo        TEXT NOT NULL,
+    archivo       TEXT NOT NULL,          -- basename, lo que usan las rutas web
+    archivo_ruta  TEXT NOT NULL,
+    formato       TEXT,
+    tamanio_bytes INTEGER NOT NULL DEFAULT 0,
+    hora_subida   TEXT NOT NULL,
+    sha256        TEXT,
+    metadatos     TEXT NOT NULL DEFAULT '{}'
+);
+CREATE INDEX IF NOT EXISTS idx_canciones_archivo ON canciones (proyecto_id, archivo);
+CREATE INDEX IF NOT EXISTS idx_canciones_sha256 ON canciones (proyecto_id, sha256);
+CREATE TABLE IF NOT EXISTS pistas (
+    id            INTEGER PRIMARY KEY,
+    cancion_id    INTEGER NOT NULL REFERENCES canciones(id) ON DELETE CASCADE,
+    nombre        TEXT NOT NULL,
+    archivo_ruta  TEXT NOT NULL,
+    duracion_seg  REAL,
+    samplerate    INTEGER,
+    metadatos     TEXT NOT NULL DEFAULT '{}',
+    UNIQUE (cancion_id, nombre)
+);
+"""
+
+# Columnas añadidas después de la primera versión del esquema: (tabla, columna, tipo)
+MIGRACIONES = (
+    ("pistas", "samplerate", "INTEGER"),
+)
+
+
+class AlmacenProyecto:
+    """
+    Acceso a la base de datos del proyecto.
+
+    Cada hilo (y cada proceso) abre su propia conexión. Las escrituras usan
+    BEGIN IMMEDIATE, que toma el bloqueo de escritura al empezar: dos workers
+    que registran a la vez se serializan (hasta busy_timeout) en lugar de
+    fallar a mitad de transacción. En WAL los lectores no bloquean al escritor.
+    """
+
+    def __init__(self, ruta=PROJECT_DB, timeout=30.0):
+        self.ruta = ruta
+        self.timeout = timeout
+        self._local = threading.local()
+        self._conexion().executescript(ESQUEMA)
+        self._migrar()
+
+    def _migrar(self):
+        """Añade a una base de datos antigua las columnas que le falten."""
+        with self.transaccion() as db:
+            for tabla, columna, tipo in MIGRACIONES:
+                columnas = {fila["name"] for fila in db.execute(f"PRAGMA table_info({tabla})")}
+                if columna not in columnas:
+                    db.execute(f"ALTER TABLE {tabla} ADD COLUMN {columna} {tipo}")
+
+    def _conexion(self):
+        conexion = getattr(self._local, "conexion", None)
+        if conexion is None or self._local.pid != os.getpid():
+            conexion = sqlite3.connect(self.ruta, timeout=self.timeout, isolation_level=None)
+            conexion.row_factory = sqlite3.Row
+            conexion.execute("PRAGMA journal_mode=WAL")
+            conexion.execute("PRAGMA synchronous=NORMAL")
+            conexion.execute("PRAGMA foreign_keys=ON")
+            conexion.execute(f"PRAGMA busy_timeout={int(self.timeout * 1000)}")
+            self._local.conexion = conexion
+            self._local.pid = os.getpid()
+        return conexion
+
+    @contextmanager
+    def transaccion(self):
+        """Transacción de escritura atómica (commit al salir, rollback si hay excepción)."""
+        db = self._conexion()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    # =========================
+    # PROYECTOS
+    # =========================
+    def proyecto_id(self, nombre):
+        """Id del proyecto `nombre` (se crea si no existe)."""
+        with self.transaccion() as db:
+            db.execute("INSERT OR IGNORE INTO proyectos (nombre, creado) VALUES (?, ?)",
+                       (nombre, time.strftime("%Y-%m-%dT%H:%M:%S")))
+            return db.execute("SELECT id FROM proyectos WHERE nombre = ?", (nombre,)).fetchone()["id"]
+
+    # =========================
+    # CANCIONES
+    # =========================
+    def guardar_cancion(self, proyecto_id, datos, unica=False):
+        """
+        Inserta (o actualiza si trae "id") una canción y devuelve (id, creada).
+        Con unica=True, si ya hay una canción con el mismo sha256 cuyo archivo
+        sigue en disco se devuelve esa sin insertar nada; la comprobación y la
+        inserción van en la misma transacción, así que dos subidas simultáneas
+        del mismo contenido no crean dos canciones aunque lleguen a procesos distintos.
+        """
+        fila = dict(datos, proyecto_id=proyecto_id, archivo=os.path.basename(datos["archivo_ruta"]),
+                    metadatos=json.dumps(datos.get("metadatos") or {}, ensure_ascii=False))
+        fila.setdefault("sha256", (datos.get("metadatos") or {}).get("sha256"))
+        columnas = ("proyecto_id", "titulo", "archivo", "archivo_ruta", "formato",
+                    "tamanio_bytes", "hora_subida", "sha256", "metadatos")
+        valores = [fila.get(c) for c in columnas]
+        with self.transaccion() as db:
+            if fila.get("id") is not None:
+                db.execute(f"UPDATE canciones SET {', '.join(c + ' = ?' for c in columnas)} WHERE id = ?",
+                           (*valores, fila["id"]))
+                return fila["id"], False
+            if unica and fila["sha256"]:
+                for existente in db.execute(
+                        "SELECT id, archivo_ruta FROM canciones WHERE proyecto_id = ? AND sha256 = ? ORDER BY id",
+                        (proyecto_id, fila["sha256"])):
+                    if os.path.exists(existente["archivo_ruta"]):
+                        return existente["id"], False
+            cursor = db.execute(
+                f"INSERT INTO canciones ({', '.join(columnas)}) VALUES ({', '.join('?' * len(columnas))})",
+                valores)
+            return cursor.lastrowid, True
+
+    def cancion(self, cancion_id):
+        fila = self._conexion().execute("SELECT * FROM canciones WHERE id = ?", (cancion_id,)).fetchone()
+        return self._con_pistas(fila) if fila else None
+
+    def canciones(self, proyecto_id):
+        filas = self._conexion().execute(
+            "SELECT * FROM canciones WHERE proyecto_id = ? ORDER BY id", (proyecto_id,)).fetchall()
+        return [self._con_pistas(f) for f in filas]
+
+    def contar_canciones(self, proyecto_id):
+        return self._conexion().execute(
+            "SELECT COUNT(*) FROM canciones WHERE proyecto_id = ?", (proyecto_id,)).fetchone()[0]
+
+    def cancion_por_archivo(self, proyecto_id, archivo):
+        """La canción más reciente con ese nombre de archivo (índice por basename)."""
+        fila = self._conexion().execute(
+            "SELECT * FROM canciones WHERE proyecto_id = ? AND archivo = ? ORDER BY id DESC LIMIT 1",
+            (proyecto_id, archivo)).fetchone()
+        return self._con_pistas(fila) if fila else None
+
+    def cancion_por_hash(self, proyecto_id, sha256):
+        fila = self._conexion().execute(
+            "SELECT * FROM canciones WHERE proyecto_id = ? AND sha256 = ? ORDER BY id LIMIT 1",
+            (proyecto_id, sha256)).fetchone()
+        return self._con_pistas(fila) if fila else None
+
+    def _con_pistas(self, fila):
+        datos = dict(fila)
+        datos["metadatos"] = json.loads(datos["metadatos"] or "{}")
+        pistas = self._conexion().execute(
+            "SELECT * FROM pistas WHERE cancion_id = ? ORDER BY id", (datos["id"],)).fetchall()
+        datos["pistas"] = [dict(p, metadatos=json.loads(p["metadatos"] or "{}")) for p in pistas]
+        return datos
+
+    # =========================
+    # PISTAS
+    # =========================
+    def guardar_pistas(self, cancion_id, pistas, reemplazar=False):
+        """
+        Registra las pistas de una canción en una sola transacción. Una pista con
+        el mismo nombre (p. ej. al volver a separar con otro perfil) se sustituye.
+        Con reemplazar=True las pistas pasan a ser exactamente estas: se borran
+        las que no vienen (stems que la nueva separación ya no escribe).
+        Devuelve los ids en el mismo orden.
+        """
+        ids = []
+        with self.transaccion() as db:
+            if reemplazar:
+                nombres = [p["nombre"] for p in pistas]
+                db.execute(f"DELETE FROM pistas WHERE cancion_id = ? AND nombre NOT IN "
+                           f"({', '.join('?' * len(nombres))})", (cancion_id, *nombres))
+            for p in pistas:
+                db.execute(
+                    "INSERT INTO pistas (cancion_id, nombre, archivo_ruta, duracion_seg, samplerate, metadatos) "
+                    "VALUES (?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (cancion_id, nombre) DO UPDATE SET "
+                    "archivo_ruta = excluded.archivo_ruta, duracion_seg = excluded.duracion_seg, "
+                    "samplerate = excluded.samplerate, metadatos = excluded.metadatos",
+                    (cancion_id, p["nombre"], p["archivo_ruta"], p.get("duracion_seg"), p.get("samplerate"),
+                     json.dumps(p.get("metadatos") or {}, ensure_ascii=False)))
+                ids.append(db.execute("SELECT id FROM pistas WHERE cancion_id = ? AND nombre = ?",
+                                      (cancion_id, p["nombre"])).fetchone()["id"])
+        return ids
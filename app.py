@@ -1,9 +1,24 @@
 import os
-from flask import Flask, request, jsonify, render_template, send_from_directory, flash, redirect, url_for
+import threading
+from flask import (
+    Flask, Response, request, jsonify, render_template, flash, redirect, url_for,
+    stream_with_context
+)
 from werkzeug.utils import secure_filename
 from os.path import basename
 from clases import ProyectoAudio, Cancion, Pista
-from procesamiento_audio import separate_stems, mix_tracks
+from procesamiento_audio import (
+    separate_stems, mix_stems, generate_accompaniment, audio_duration, stem_cache, musicgen_cache,
+    MusicGenGenerator, wav_stream_header, pcm16_bytes, accompaniment_duration,
+    DEMUCS_PROFILE, DEMUCS_PROFILES, STEM_MODES, STEM_FORMAT, STEM_FORMATS, MUSICGEN_SEED, MUSICGEN_WINDOW, MUSICGEN_MAX_DURATION,
+    SAMPLE_RATE
+)
+from trabajos import GestorTrabajos, ColaLlenaError, ProgresoEtapa, eventos_sse, ESTADOS_FINALES, ERROR
+from metricas import metricas, prometheus_gauges
+import medios
+from subidas import GestorSubidas, SubidaError, validar_audio, sha256_archivo
+from modelos import precargar_en_segundo_plano, estado_modelos, modelos_listos
+from pool_modelos import crear_pool_desde_entorno, es_proceso_principal
 
 # -------------------------------------------------------
 # Configuración general del servidor Flask
@@ -20,10 +35,41 @@ app.config["OUTPUT_FOLDER"] = OUTPUT_FOLDER
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 
+# Pool de procesos con modelos calientes (POOL_DEMUCS_WORKERS / POOL_MUSICGEN_WORKERS).
+# Sin workers configurados, los modelos se usan dentro de este mismo proceso.
+pool_modelos = crear_pool_desde_entorno()
+
+# Cola de trabajos: separaciones y mezclas corren fuera del hilo de la petición.
+# Con pool, hace falta al menos un hilo por worker para mantenerlos ocupados.
+MAX_TRABAJOS_SIMULTANEOS = int(os.getenv(
+    "MAX_TRABAJOS_SIMULTANEOS",
+    str(max(2, sum(pool_modelos.workers.values()) + 1) if pool_modelos else 2)
+))
+MAX_TRABAJOS_EN_COLA = int(os.getenv("MAX_TRABAJOS_EN_COLA", "16"))
+trabajos = GestorTrabajos(max_workers=MAX_TRABAJOS_SIMULTANEOS, max_pendientes=MAX_TRABAJOS_EN_COLA)
+
+# Generaciones en streaming simultáneas (cada una ocupa un hilo del servidor y el modelo)
+MAX_STREAMS_MUSICGEN = int(os.getenv("MAX_STREAMS_MUSICGEN", "2"))
+streams_musicgen = threading.BoundedSemaphore(MAX_STREAMS_MUSICGEN)
+
+# Los modelos se cargan bajo demanda. Con PRECARGAR_MODELOS=1 (por defecto) se
+# calientan en segundo plano y el servidor arranca sin esperarlos; los
+# workers que solo sirven subidas pueden usar PRECARGAR_MODELOS=0.
+# El pool se calienta siempre: sus modelos se cargan en otros procesos (no
+# retrasan el arranque) y /ready depende de que cada tipo haya respondido.
+# (Los procesos del pool re-importan este módulo: ahí no se precarga nada.)
+if pool_modelos is not None:
+    pool_modelos.calentar()
+elif os.getenv("PRECARGAR_MODELOS", "1") == "1" and es_proceso_principal():
+    precargar_en_segundo_plano()
+
 # Proyecto principal de audio
 proyecto = ProyectoAudio("Proyecto de Audio")
 proyecto.cargar_estado()
 
+# Sesiones de subida por trozos (reanudables, en uploads/.sesiones)
+subidas = GestorSubidas(UPLOAD_FOLDER)
+
 print("Servidor Flask iniciado correctamente")
 
 
@@ -55,21 +101,23 @@ def upload_file():
 
         filename = secure_filename(file.filename)
         filepath = os.path.join(app.config["UPLOAD_FOLDER"], filename)
-        file.save(filepath)
-
-        print(f"📁 Archivo guardado: {filepath}")
 
-        # Crear objeto Cancion
-        nueva_cancion = Cancion(filename, filepath, "audio")
-
-        # Añadir al proyecto
-        proyecto.agregar_cancion(nueva_cancion)
-        proyecto.guardar_estado()
+        # Se guarda con otro nombre y se sondea antes de sustituir nada en uploads/
+        tmp = os.path.join(subidas.raiz, f"form-{os.getpid()}-{threading.get_ident()}.part")
+        file.save(tmp)
+        try:
+            info = validar_audio(tmp)
+        except ValueError as e:
+            os.remove(tmp)
+            flash(f"{filename} no parece un archivo de audio válido: {e}")
+            return redirect(url_for("upload_file"))
+        os.replace(tmp, filepath)
 
-        print(f"Canción registrada: {filename}")
+        print(f"📁 Archivo guardado: {filepath}")
+        cancion, _ = _registrar_subida(filename, filepath, sha256_archivo(filepath), info)
 
         # Redirigir al HTML de proyectos
-        return redirect(url_for("proyecto_view", archivo=filename))
+        return redirect(url_for("proyecto_view", archivo=basename(cancion.archivo_ruta)))
 
     except Exception as e:
         print(f"Error al subir archivo: {str(e)}")
@@ -77,10 +125,118 @@ def upload_file():
         return redirect(url_for("upload_file"))
 
 
+def _registrar_subida(filename, filepath, sha256, info):
+    """
+    Registra un archivo recién subido como Cancion y devuelve (cancion, duplicado).
+    Si ya hay una canción con el mismo contenido se reutiliza (y se descarta la copia nueva).
+    """
+    nueva_cancion = Cancion(filename, filepath, "audio")
+    nueva_cancion.metadatos.update(sha256=sha256, **info)
+    cancion, es_nueva = proyecto.agregar_cancion_unica(nueva_cancion)
+    if not es_nueva:
+        if os.path.abspath(cancion.archivo_ruta) != os.path.abspath(filepath):
+            os.remove(filepath)
+        print(f"Canción ya registrada con el mismo contenido: {cancion.titulo}")
+        return cancion, True
+
+    print(f"Canción registrada: {filename}")
+    return cancion, False
+
+
+def _error_subida(e: SubidaError):
+    return jsonify({"error": str(e), **e.extra}), e.status
+
+
+@app.route("/upload/sesiones", methods=["POST"])
+def crear_sesion_subida():
+    """Abre una subida por trozos: {"filename", "size"} → {id, offset, chunk_size}"""
+    datos = request.get_json(silent=True) or {}
+    filename = secure_filename(datos.get("filename") or "")
+    if not filename:
+        return jsonify({"error": "Nombre de archivo inválido"}), 400
+    try:
+        size = int(datos["size"]) if datos.get("size") is not None else None
+        sesion = subidas.crear(filename, size)
+    except (TypeError, ValueError):
+        return jsonify({"error": "'size' debe ser un número de bytes"}), 400
+    except SubidaError as e:
+        return _error_subida(e)
+    return jsonify(sesion.to_dict()), 201
+
+
+@app.route("/upload/sesiones/<sesion_id>", methods=["GET", "PUT", "DELETE"])
+def sesion_subida(sesion_id):
+    """
+    GET: estado (offset confirmado, para reanudar tras un corte).
+    PUT ?offset=N: añade el cuerpo de la petición en esa posición.
+    DELETE: cancela la subida.
+    """
+    try:
+        if request.method == "GET":
+            return jsonify(subidas.obtener(sesion_id).to_dict())
+        if request.method == "DELETE":
+            subidas.obtener(sesion_id)
+            subidas.cancelar(sesion_id)
+            return "", 204
+
+        try:
+            offset = int(request.args.get("offset", ""))
+        except ValueError:
+            return jsonify({"error": "Falta ?offset=<bytes ya subidos>"}), 400
+        sesion = subidas.escribir(sesion_id, offset, request.stream, request.content_length)
+        return jsonify(sesion.to_dict())
+    except SubidaError as e:
+        return _error_subida(e)
+
+
+@app.route("/upload/sesiones/<sesion_id>/finalizar", methods=["POST"])
+def finalizar_subida(sesion_id):
+    """Cierra la subida, valida el audio completo y registra la canción."""
+    try:
+        sesion = subidas.obtener(sesion_id)
+        filename = sesion.datos["filename"]
+        filepath = os.path.join(app.config["UPLOAD_FOLDER"], filename)
+        sha256, info = subidas.finalizar(sesion_id, filepath)
+    except SubidaError as e:
+        return _error_subida(e)
+
+    cancion, duplicado = _registrar_subida(filename, filepath, sha256, info)
+    archivo = basename(cancion.archivo_ruta)
+    return jsonify({
+        "archivo": archivo,
+        "sha256": sha256,
+        "duplicado": duplicado,
+        "audio": info,
+        "url": url_for("proyecto_view", archivo=archivo),
+    }), 201
+
+
 @app.route("/uploads/<path:filename>")
 def uploaded_file(filename):
-    """Sirve archivos subidos"""
-    return send_from_directory(app.config["UPLOAD_FOLDER"], filename)
+    """Sirve archivos subidos (Range, ETag; ?preview=opus|mp3 para la versión comprimida)"""
+    return medios.servir(app.config["UPLOAD_FOLDER"], filename, request.args.get("preview"))
+
+
+@app.route("/outputs_remix/<path:filename>")
+def resultados(filename):
+    """Sirve los archivos generados (stems o mezclas), igual que /uploads."""
+    return medios.servir(app.config["OUTPUT_FOLDER"], filename, request.args.get("preview"))
+
+
+@app.route("/peaks/<carpeta>/<path:filename>")
+def picos_audio(carpeta, filename):
+    """Picos min/max de la forma de onda (?n=800 tramos) para dibujarla sin bajar el audio."""
+    directorios = {"uploads": app.config["UPLOAD_FOLDER"], "outputs_remix": app.config["OUTPUT_FOLDER"]}
+    if carpeta not in directorios:
+        return jsonify({"error": "Carpeta desconocida"}), 404
+    try:
+        n = min(int(request.args.get("n", medios.PEAKS_DEFAULT)), medios.PEAKS_MAX)
+    except ValueError:
+        return jsonify({"error": "n debe ser un entero"}), 400
+    ruta = medios.resolver(directorios[carpeta], filename)
+    respuesta = jsonify(medios.picos(ruta, max(1, n)))
+    respuesta.cache_control.max_age = medios.MEDIA_MAX_AGE
+    return respuesta
 
 
 @app.route("/proyecto")
@@ -109,6 +265,10 @@ def proyecto_view():
 def separar():
     """
     Separa una canción en stems usando Demucs.
+    JSON: {"nombre": ..., "perfil": "fast" | "balanced" | "best", "stems": "all" | "vocals" | "two",
+           "formato": "pcm16" | "pcm24" | "float32" | "flac" | "opus", "esperar": "primera"}
+    Con "esperar": "primera" la respuesta llega en cuanto el primer stem está
+    escrito (en "parcial"); el resto sigue en el trabajo.
     """
     print("Endpoint /separar llamado")
 
@@ -120,6 +280,16 @@ def separar():
     if not nombre_archivo:
         return jsonify({"error": "Falta el nombre del archivo"}), 400
 
+    perfil = data.get("perfil") or DEMUCS_PROFILE
+    modo_stems = data.get("stems") or "all"
+    formato = data.get("formato") or STEM_FORMAT
+    if perfil not in DEMUCS_PROFILES:
+        return jsonify({"error": f"Perfil desconocido: {perfil} (opciones: {', '.join(DEMUCS_PROFILES)})"}), 400
+    if modo_stems not in STEM_MODES:
+        return jsonify({"error": f"Modo de stems desconocido: {modo_stems} (opciones: {', '.join(STEM_MODES)})"}), 400
+    if formato not in STEM_FORMATS:
+        return jsonify({"error": f"Formato desconocido: {formato} (opciones: {', '.join(STEM_FORMATS)})"}), 400
+
     ruta_archivo = os.path.join(app.config["UPLOAD_FOLDER"], nombre_archivo)
 
     # Verificar que el archivo existe
@@ -141,61 +311,155 @@ def separar():
         return jsonify({"error": "Canción no registrada en el proyecto"}), 404
 
     try:
-        print(f"Iniciando separación de stems...")
-        print(f"Archivo: {ruta_archivo}")
-        print(f"Output: {app.config['OUTPUT_FOLDER']}")
-
-        # FORZAMOS EJECUCIÓN SÍNCRONA Y BLOQUEANTE
-        stems = separate_stems(ruta_archivo, app.config["OUTPUT_FOLDER"])
-
-        # VALIDACIÓN CLAVE: asegurarse de que los stems existen y NO están vacíos
-        stems_validos = {}
-        for name, path in stems.items():
-            if os.path.exists(path) and os.path.getsize(path) > 1000:
-                stems_validos[name] = path
-                print(f"Pista válida: {name} ({os.path.getsize(path)} bytes)")
-            else:
-                print(f" Pista inválida o vacía: {name} ({os.path.getsize(path) if os.path.exists(path) else 0} bytes)")
-
-        if not stems_validos:
-            return jsonify({
-                "error": "La separación se ejecutó pero todos los stems están vacíos",
-                "detalle": "Revisa separate_stems(): no está esperando a que Demucs escriba."
-            }), 500
-
-        # Añadir cada pista válida al proyecto
-        for name, path in stems_validos.items():
-            pista = Pista(name, path)
-            cancion.agregar_pista(pista)
-            print(f"Pista añadida al proyecto: {name}")
-
-        proyecto.guardar_estado()
-
-        # Convertimos las rutas REALES a rutas PÚBLICAS correctas
-        pistas_publicas = {
-            name: f"outputs_remix/{name}.wav"
-            for name in stems_validos
-        }
-
-        return jsonify({
-            "mensaje": "Separación completada exitosamente",
-            "pistas": pistas_publicas
-        })
+        trabajo = trabajos.enviar("separar", _tarea_separar, ruta_archivo, cancion, app.config["OUTPUT_FOLDER"],
+                                  perfil, modo_stems, formato)
+    except ColaLlenaError as e:
+        return jsonify({"error": str(e)}), 503
+
+    if data.get("esperar") == "primera":
+        return _respuesta_primer_stem(trabajo)
+    return _respuesta_trabajo(trabajo)
+
+
+def _respuesta_primer_stem(trabajo):
+    """Espera a que el trabajo publique su primer stem (o termine) y responde con lo que haya."""
+    while not trabajo.parcial and trabajo.estado not in ESTADOS_FINALES:
+        trabajo.esperar_cambio(trabajo.version)
+    if trabajo.estado == ERROR:
+        return jsonify({"error": trabajo.error, "job_id": trabajo.id}), 500
+    return _respuesta_trabajo(trabajo, estado=trabajo.estado, parcial=trabajo.parcial)
+
+
+def _tarea_separar(trabajo, ruta_archivo, cancion, output_folder, perfil="balanced", modo_stems="all",
+                   formato=STEM_FORMAT):
+    """Trabajo en segundo plano: ejecuta Demucs y registra las pistas válidas."""
+    print(f"Iniciando separación de stems (perfil {perfil}, stems {modo_stems}, formato {formato})...")
+    print(f"Archivo: {ruta_archivo}")
+    print(f"Output: {output_folder}")
+
+    trabajo.actualizar(0.05, "Separando stems con Demucs")
+    if pool_modelos is not None and pool_modelos.tiene("demucs"):
+        # Los workers no pueden informar por segmento: solo inicio y fin
+        stems = pool_modelos.separar(ruta_archivo, output_folder, profile=perfil, stems=modo_stems,
+                                     stem_format=formato)
+    else:
+        # Progreso por segmento de Demucs; ETA a partir del RTF medido en separaciones anteriores
+        progreso = ProgresoEtapa(trabajo, 0.05, 0.9, audio_seg=audio_duration(ruta_archivo),
+                                 rtf=metricas.rtf_medio("separation"))
+        progreso(0, 1, "Separando stems con Demucs")
+        # Cada stem se publica en el trabajo en cuanto está escrito (se pueden escuchar ya)
+        stems = separate_stems(ruta_archivo, output_folder, profile=perfil, stems=modo_stems, progress=progreso,
+                               stem_format=formato,
+                               on_stem=lambda name, path: trabajo.publicar(name, _ruta_publica(path)))
+
+    # VALIDACIÓN CLAVE: asegurarse de que los stems existen y NO están vacíos
+    trabajo.actualizar(0.9, "Validando pistas")
+    stems_validos = {}
+    for name, path in stems.items():
+        if os.path.exists(path) and os.path.getsize(path) > 1000:
+            stems_validos[name] = path
+            print(f"Pista válida: {name} ({os.path.getsize(path)} bytes)")
+        else:
+            print(f" Pista inválida o vacía: {name} ({os.path.getsize(path) if os.path.exists(path) else 0} bytes)")
+
+    if not stems_validos:
+        raise RuntimeError("La separación se ejecutó pero todos los stems están vacíos")
+
+    # Las pistas de la canción pasan a ser las válidas (una sola transacción); las de
+    # una separación anterior que esta ya no escribe (otro modo de stems, silencio) se borran
+    proyecto.reemplazar_pistas(cancion, [Pista.desde_archivo(name, path) for name, path in stems_validos.items()])
+    print(f"Pistas añadidas al proyecto: {', '.join(stems_validos)}")
+
+    # Los picos de forma de onda se calculan ya, para que la página cargue al instante
+    trabajo.actualizar(0.95, "Calculando formas de onda")
+    medios.precalcular_picos(stems_validos.values())
+
+    # Convertimos las rutas REALES a rutas PÚBLICAS correctas
+    # (outputs_remix/<modelo>/<cancion>/<stem>.wav, que es también lo que recibe /mezclar)
+    pistas_publicas = {name: _ruta_publica(path) for name, path in stems_validos.items()}
+
+    return {
+        "mensaje": "Separación completada exitosamente",
+        "pistas": pistas_publicas
+    }
+
+
+def _ruta_publica(ruta):
+    return os.path.relpath(ruta).replace(os.sep, "/")
+
+
+def _respuesta_trabajo(trabajo, **extra):
+    """Respuesta 202 común a las rutas que encolan trabajos."""
+    return jsonify({
+        "mensaje": "Trabajo encolado",
+        "job_id": trabajo.id,
+        "estado_url": url_for("estado_trabajo", trabajo_id=trabajo.id),
+        "stream_url": url_for("stream_trabajo", trabajo_id=trabajo.id),
+        **extra
+    }), 202
+
+
+@app.route("/jobs/<trabajo_id>")
+def estado_trabajo(trabajo_id):
+    """Devuelve el estado, el progreso y (si terminó) el resultado de un trabajo."""
+    trabajo = trabajos.obtener(trabajo_id)
+    if not trabajo:
+        return jsonify({"error": "Trabajo no encontrado"}), 404
+    return jsonify(trabajo.to_dict())
+
+
+@app.route("/jobs/<trabajo_id>/stream")
+def stream_trabajo(trabajo_id):
+    """Emite el progreso del trabajo como Server-Sent Events hasta que termine."""
+    trabajo = trabajos.obtener(trabajo_id)
+    if not trabajo:
+        return jsonify({"error": "Trabajo no encontrado"}), 404
+    return Response(
+        eventos_sse(trabajo),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
-    except Exception as e:
-        import traceback
-        print(f"ERROR DURANTE LA SEPARACIÓN:")
-        print(traceback.format_exc())
-        return jsonify({
-            "error": f"Error durante la separación: {str(e)}",
-            "detalle": traceback.format_exc()
-        }), 500
-
-@app.route('/outputs_remix/<path:filename>')
-def serve_stems(filename):
-    directorio = os.path.join(os.path.dirname(os.path.abspath(__file__)), "outputs_remix")
-    print("Sirviendo desde:", directorio)
-    return send_from_directory(directorio, filename)
+@app.route("/cache/stats")
+def cache_stats():
+    """Aciertos, fallos y tamaño de las cachés de stems, MusicGen y previsualizaciones."""
+    return jsonify({
+        "stems": stem_cache.stats() if stem_cache is not None else None,
+        "musicgen": musicgen_cache.stats(),
+        "previews": medios.preview_cache.stats()
+    })
+
+@app.route("/health")
+def health():
+    """Liveness: el proceso responde (no implica que los modelos estén cargados)."""
+    return jsonify({"ok": True})
+
+
+@app.route("/ready")
+def ready():
+    """Readiness: 200 cuando los modelos están en memoria, 503 mientras no."""
+    if pool_modelos is not None:
+        estado = pool_modelos.estado()
+    else:
+        estado = estado_modelos()
+        estado["listo"] = modelos_listos()
+    return jsonify(estado), (200 if estado["listo"] else 503)
+
+
+@app.route("/metrics")
+def metrics():
+    """Métricas por etapa, cachés y cola de trabajos en formato de texto de Prometheus."""
+    texto = metricas.prometheus()
+    caches = [({"cache": "musicgen"}, musicgen_cache.stats()), ({"cache": "previews"}, medios.preview_cache.stats())]
+    if stem_cache is not None:
+        caches.insert(0, ({"cache": "stems"}, stem_cache.stats()))
+    texto += prometheus_gauges("remix_cache", caches, "Estado de la caché")
+    estados = {}
+    for t in trabajos.listar():
+        estados[t["estado"]] = estados.get(t["estado"], 0) + 1
+    texto += prometheus_gauges("remix", [({"estado": e}, {"jobs": n}) for e, n in estados.items()],
+                               "Trabajos por estado")
+    return Response(texto, mimetype="text/plain; version=0.0.4")
 
 @app.route("/mezclar", methods=["POST"])
 def mezclar():
@@ -213,53 +477,146 @@ def mezclar():
     if len(pistas) < 2:
         return jsonify({"error": "Se requieren al menos 2 pistas"}), 400
 
-    rutas_pistas = pistas
-    print(f"Pistas recibidas: {pistas}")
+    # Ganancia y paneo opcionales, uno por pista
+    ganancias = data.get("ganancias")
+    paneos = data.get("paneos")
+    for nombre, valores in (("ganancias", ganancias), ("paneos", paneos)):
+        if valores is not None and (not isinstance(valores, list) or len(valores) != len(pistas)):
+            return jsonify({"error": f"'{nombre}' debe ser una lista con un valor por pista"}), 400
 
-    vocal_path = rutas_pistas[0]
-    accomp_path = rutas_pistas[1]
+    print(f"Pistas recibidas: {pistas}")
 
-    # Verificar que ambos archivos existen
-    if not os.path.exists(vocal_path):
-        return jsonify({"error": f"Pista vocal no encontrada: {pistas[0]}"}), 404
-    if not os.path.exists(accomp_path):
-        return jsonify({"error": f"Pista acompañamiento no encontrada: {pistas[1]}"}), 404
+    # Verificar que todos los archivos existen
+    for ruta in pistas:
+        if not os.path.exists(ruta):
+            return jsonify({"error": f"Pista no encontrada: {ruta}"}), 404
 
     ruta_salida = os.path.join(app.config["OUTPUT_FOLDER"], "mezcla_final.wav")
 
     try:
-        print(f"   Iniciando mezcla...")
-        print(f"   Vocal: {vocal_path}")
-        print(f"   Accomp: {accomp_path}")
-        print(f"   Output: {ruta_salida}")
+        trabajo = trabajos.enviar("mezclar", _tarea_mezclar, pistas, ruta_salida, ganancias, paneos)
+    except ColaLlenaError as e:
+        return jsonify({"error": str(e)}), 503
 
-        # Llamada SÍNCRONA (sin asyncio)
-        mix_tracks(vocal_path, accomp_path, ruta_salida)
+    return _respuesta_trabajo(trabajo)
 
-        print(f"Mezcla completada: {ruta_salida}")
 
-        return jsonify({
-            "mensaje": "Mezcla completada exitosamente",
-            "archivo_resultante": basename(ruta_salida)
-        })
+def _tarea_mezclar(trabajo, pistas, ruta_salida, ganancias=None, paneos=None):
+    """Trabajo en segundo plano: mezcla las pistas y devuelve el archivo resultante."""
+    print(f"   Iniciando mezcla de {len(pistas)} pistas...")
+    for ruta in pistas:
+        print(f"   Pista: {ruta}")
+    print(f"   Output: {ruta_salida}")
 
-    except Exception as e:
-        import traceback
-        print(f"ERROR DURANTE LA MEZCLA:")
-        print(traceback.format_exc())
-        return jsonify({
-            "error": f"Error durante la mezcla: {str(e)}",
-            "detalle": traceback.format_exc()
-        }), 500
+    trabajo.actualizar(0.1, "Mezclando pistas")
+    mix_stems(pistas, ruta_salida, gains=ganancias, pans=paneos)
 
+    print(f"Mezcla completada: {ruta_salida}")
+
+    return {
+        "mensaje": "Mezcla completada exitosamente",
+        "archivo_resultante": basename(ruta_salida)
+    }
+
+
+@app.route("/generar", methods=["POST"])
+def generar():
+    """
+    Genera un acompañamiento con MusicGen en segundo plano.
+    JSON: {"estilo": "lo-fi", "duracion": 30, "semilla": 123 (opcional)}
+    """
+    estilo, duracion, semilla, error = _parametros_generacion(request.get_json() or {}, MUSICGEN_MAX_DURATION)
+    if error:
+        return jsonify({"error": error}), 400
 
-@app.route("/outputs_remix/<path:filename>")
-def resultados(filename):
-    """Sirve los archivos generados (stems o mezclas)."""
     try:
-        return send_from_directory(app.config["OUTPUT_FOLDER"], filename)
-    except FileNotFoundError:
-        return jsonify({"error": "Archivo no encontrado"}), 404
+        trabajo = trabajos.enviar("generar", _tarea_generar, estilo, duracion, semilla, app.config["OUTPUT_FOLDER"])
+    except ColaLlenaError as e:
+        return jsonify({"error": str(e)}), 503
+
+    return _respuesta_trabajo(trabajo)
+
+
+@app.route("/generar/stream")
+def generar_stream():
+    """
+    Genera un acompañamiento y lo envía mientras se genera, como WAV PCM de
+    16 bits por HTTP chunked: el navegador empieza a reproducir con el primer
+    bloque (MUSICGEN_STREAM_CHUNK segundos de tokens) en lugar de esperar al final.
+    Parámetros: ?estilo=lo-fi&duracion=30&semilla=123
+    Usa siempre el modelo del proceso del servidor (no el pool de workers).
+    """
+    estilo, duracion, semilla, error = _parametros_generacion(request.args, MUSICGEN_WINDOW)
+    if error:
+        return jsonify({"error": error}), 400
+    if not streams_musicgen.acquire(blocking=False):
+        return jsonify({"error": "Demasiadas generaciones en curso, inténtalo más tarde"}), 503
+
+    nombre = f"acompanamiento_{os.urandom(4).hex()}.wav"
+    ruta_salida = os.path.join(app.config["OUTPUT_FOLDER"], nombre)
+
+    def enviar():
+        yield wav_stream_header(SAMPLE_RATE, channels=1)
+        for bloque in MusicGenGenerator().stream(estilo, duracion, seed=semilla, out_path=ruta_salida):
+            yield pcm16_bytes(bloque)
+
+    respuesta = Response(
+        stream_with_context(enviar()),
+        mimetype="audio/wav",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",          # que nginx no acumule la respuesta
+            "X-Archivo-Resultante": nombre,      # el audio completo queda en outputs_remix/
+        },
+    )
+    # Se libera al cerrar la respuesta, aunque el cliente se vaya antes del primer bloque
+    respuesta.call_on_close(streams_musicgen.release)
+    return respuesta
+
+
+def _parametros_generacion(datos, maximo):
+    """
+    Valida estilo, duración y semilla (JSON o query string). Devuelve (estilo, duracion, semilla, error).
+    Con "pista" (un stem de outputs_remix/, normalmente la voz) y sin "duracion"
+    se genera exactamente lo que dura esa pista.
+    """
+    estilo = (datos.get("estilo") or "").strip()
+    if not estilo:
+        return None, None, None, "Falta el estilo"
+    try:
+        if datos.get("pista") and datos.get("duracion") in (None, ""):
+            pista = medios.resolver(app.config["OUTPUT_FOLDER"],
+                                    os.path.relpath(datos["pista"], app.config["OUTPUT_FOLDER"]))
+            duracion = accompaniment_duration(pista)
+        else:
+            duracion = float(datos.get("duracion", 30))
+        semilla = int(datos["semilla"]) if datos.get("semilla") not in (None, "") else MUSICGEN_SEED
+    except (TypeError, ValueError):
+        return None, None, None, "duracion y semilla deben ser números"
+    if not 0 < duracion <= maximo:
+        return None, None, None, f"La duración debe estar entre 0 y {maximo:.0f} segundos"
+    return estilo, duracion, semilla, None
+
+
+def _tarea_generar(trabajo, estilo, duracion, semilla, output_folder):
+    """Trabajo en segundo plano: genera el acompañamiento informando tokens generados y ETA."""
+    nombre = f"acompanamiento_{trabajo.id[:8]}.wav"
+    ruta_salida = os.path.join(output_folder, nombre)
+
+    if pool_modelos is not None and pool_modelos.tiene("musicgen"):
+        trabajo.actualizar(0.05, "Generando acompañamiento con MusicGen")
+        pool_modelos.generar(estilo, ruta_salida, duracion, seed=semilla)
+    else:
+        progreso = ProgresoEtapa(trabajo, 0.05, 0.95, audio_seg=duracion, rtf=metricas.rtf_medio("generation"))
+        progreso(0, 1, "Generando acompañamiento con MusicGen")
+        generate_accompaniment(estilo, ruta_salida, duracion, seed=semilla, progress=progreso)
+
+    return {
+        "mensaje": "Acompañamiento generado",
+        "archivo_resultante": nombre,
+        "url": f"outputs_remix/{nombre}"
+    }
+
 
 
 # -------------------------------------------------------
@@ -271,7 +628,7 @@ if __name__ == "__main__":
     print("=" * 60)
     print(f"Upload folder: {UPLOAD_FOLDER}")
     print(f"Output folder: {OUTPUT_FOLDER}")
-    print(f"Canciones en proyecto: {len(proyecto.canciones)}")
+    print(f"Canciones en proyecto: {proyecto.numero_canciones()}")
     print("=" * 60)
 
     # Ejecutar servidor
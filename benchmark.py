@@ -0,0 +1,270 @@
+# benchmark.py
+# Benchmarks de separación (Demucs), generación (MusicGen), mezcla y pipeline completo.
+# Se ejecuta con:  python procesamiento_audio.py benchmark --lengths 10 30 --out bench.json
+# El audio de prueba es sintético y determinista (misma semilla = mismos datos),
+# así dos ejecuciones sobre la misma máquina son comparables.
+
+import argparse
+import json
+import os
+import platform
+import tempfile
+import time
+
+import numpy as np
+import soundfile as sf
+
+from metricas import muestreador_rss, rss_bytes
+
+
+# =========================
+# AUDIO SINTÉTICO
+# =========================
+def synth_song(seconds, sr=44100, seed=0):
+    """
+    Genera una "canción" estéreo determinista: voz (armónicos con vibrato),
+    bajo, batería (ruido con envolvente) y un pad. Devuelve (2, muestras) float32.
+    """
+    rng = np.random.default_rng(seed)
+    n = int(seconds * sr)
+    t = np.arange(n, dtype=np.float64) / sr
+
+    # Voz: fundamental que cambia cada segundo, con vibrato y 4 armónicos
+    notes = 220.0 * 2 ** (rng.integers(0, 12, size=int(np.ceil(seconds)) + 1) / 12)
+    f0 = notes[(t).astype(int)] * (1 + 0.01 * np.sin(2 * np.pi * 5 * t))
+    phase = 2 * np.pi * np.cumsum(f0) / sr
+    vocal = sum(np.sin(k * phase) / k for k in range(1, 5)) * 0.3
+
+    # Bajo: una octava y media por debajo
+    bass = 0.4 * np.sin(phase / 3)
+
+    # Batería: golpes de ruido cada 0.5 s con caída exponencial
+    beat = (t % 0.5)
+    drums = rng.standard_normal(n) * np.exp(-beat * 30) * 0.5
+
+    # Pad: acorde estático
+    pad = 0.1 * (np.sin(2 * np.pi * 261.6 * t) + np.sin(2 * np.pi * 329.6 * t))
+
+    left = vocal + bass + drums + 0.5 * pad
+    right = vocal + bass + 0.8 * drums + pad
+    song = np.stack([left, right]).astype(np.float32)
+    return song / (np.max(np.abs(song)) + 1e-9) * 0.9
+
+
+def write_synth(path, seconds, sr=44100, seed=0):
+    sf.write(path, synth_song(seconds, sr, seed).T, sr, subtype="PCM_16")
+    return path
+
+
+# =========================
+# ESTADÍSTICAS
+# =========================
+def summarize(latencies, audio_seconds):
+    """Resumen de una serie de latencias (segundos)."""
+    lat = np.asarray(latencies, dtype=np.float64)
+    p50, p90, p99 = np.percentile(lat, [50, 90, 99])
+    return {
+        "runs": len(lat),
+        "audio_seg": audio_seconds,
+        "mean_seg": float(lat.mean()),
+        "p50_seg": float(p50),
+        "p90_seg": float(p90),
+        "p99_seg": float(p99),
+        "min_seg": float(lat.min()),
+        "rtf_p50": float(p50 / audio_seconds) if audio_seconds else None,
+    }
+
+
+def timed(fn, repeats, warmup=0):
+    """Ejecuta fn() `warmup` veces sin medir y `repeats` veces midiendo. Devuelve latencias."""
+    for _ in range(warmup):
+        fn()
+    latencies = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - t0)
+    return latencies
+
+
+def compare(results, baseline, tolerance=0.10):
+    """
+    Compara p50 de cada caso contra un baseline guardado.
+    Devuelve una lista de (caso, base, actual, ratio, regresión).
+    """
+    rows = []
+    base_cases = baseline.get("cases", {})
+    for case, data in results["cases"].items():
+        if case not in base_cases:
+            continue
+        old, new = base_cases[case]["p50_seg"], data["p50_seg"]
+        ratio = new / old if old else float("inf")
+        rows.append((case, old, new, ratio, ratio > 1 + tolerance))
+    return rows
+
+
+# =========================
+# EJECUCIÓN
+# =========================
+def run(lengths, repeats, stages, workdir, gen_seconds=None, cold=False, profiles=None):
+    """
+    Ejecuta los benchmarks pedidos y devuelve el informe como dict.
+    Con varios perfiles la separación se mide con cada uno ("separation[fast]/10s");
+    el resto de casos usa el primero.
+    """
+    import procesamiento_audio as pa
+    import modelos
+    from etapas import GrafoEtapas
+
+    report = {
+        "fecha": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "maquina": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+            "device": pa.get_device(),
+        },
+        "config": {"lengths": lengths, "repeats": repeats, "stages": stages, "profiles": profiles},
+        "cases": {},
+        "cold": {},
+    }
+
+    # Frío: se descartan los modelos que usa el caso, se cargan de nuevo (midiendo
+    # la carga) y la primera pasada se mide con el modelo recién cargado
+    cold_models = {"separation": ("demucs",), "generation": ("musicgen",), "mix": (),
+                   "pipeline": ("demucs", "musicgen")}
+
+    def fresh_load(models, profile):
+        loaded = {}
+        for model in models:
+            if model == "demucs":
+                modelos._demucs_models = {}
+                loader = lambda: modelos.get_demucs_model(pa.get_profile(profile)["model"])
+            else:
+                modelos._musicgen_processor = modelos._musicgen_model = None
+                loader = modelos.get_musicgen
+            t0 = time.perf_counter()
+            loader()
+            loaded[f"{model}_load_seg"] = time.perf_counter() - t0
+        return loaded
+
+    separator, generator, mixer = pa.DemucsSeparator(), pa.MusicGenGenerator(), pa.Mixer()
+    sr = pa.get_demucs_model().samplerate
+
+    for seconds in lengths:
+        song = write_synth(os.path.join(workdir, f"synth_{seconds}s.wav"), seconds, sr=sr, seed=seconds)
+        stems_dir = os.path.join(workdir, f"stems_{seconds}s")
+        accomp = os.path.join(workdir, f"accomp_{seconds}s.wav")
+        mix_out = os.path.join(workdir, f"mix_{seconds}s.wav")
+        gen_len = min(seconds, gen_seconds) if gen_seconds else seconds
+
+        def separation(profile=profiles[0] if profiles else None):
+            return separator.process(song, stems_dir, sr=sr, profile=profile)
+
+        def generation():
+            import torch
+            # Semilla fija sin pasar por la caché de MusicGen (seed=None)
+            with pa._musicgen_rng_lock:
+                torch.manual_seed(0)
+                return generator.process("electronic", accomp, duration=gen_len, seed=None)
+
+        def mixing():
+            # Los stems sin energía no se escriben
+            stems = [pa.stem_path(stems_dir, name) for name in pa.get_demucs_model().sources]
+            stems = [path for path in stems if os.path.exists(path)]
+            return mixer.mix(stems + [accomp], mix_out)
+
+        def pipeline():
+            # Igual que remix_file: separación y generación a la vez, mezcla al final
+            grafo = GrafoEtapas(log=pa.log)
+            grafo.etapa("separation", separation)
+            grafo.etapa("generation", generation)
+            grafo.etapa("mix", lambda separation, generation: mixing(), depende=("separation", "generation"))
+            grafo.ejecutar()
+
+        cases = {
+            "separation": (separation, seconds),
+            "generation": (generation, gen_len),
+            "mix": (mixing, seconds),
+            "pipeline": (pipeline, seconds),
+        }
+        # La mezcla necesita stems y acompañamiento ya generados
+        if "mix" in stages and not ("separation" in stages and "generation" in stages):
+            separation()
+            generation()
+
+        runs = []
+        for stage in stages:
+            if stage == "separation" and profiles and len(profiles) > 1:
+                runs += [(f"separation[{p}]", lambda p=p: separation(p), seconds, p) for p in profiles]
+            else:
+                runs.append((stage, *cases[stage], profiles[0] if profiles else None))
+
+        for name, fn, audio_seconds, profile in runs:
+            pa.log(f"⏱ Benchmark {name} ({seconds}s)...")
+            stage = name.split("[")[0]
+            cold_result = None
+            if cold and seconds == lengths[0] and cold_models[stage]:
+                cold_result = fresh_load(cold_models[stage], profile)
+                cold_result["first_seg"] = timed(fn, 1)[0]
+                report["cold"][name] = cold_result
+            # Pico de memoria del propio caso (muestreado mientras corre) y RSS al empezar
+            rss_start = rss_bytes()
+            with muestreador_rss.midiendo(name) as rss:
+                # La primera ejecución (modelo recién usado) se mide aparte como "first"
+                first = timed(fn, 1)[0]
+                latencies = timed(fn, repeats)
+            result = summarize(latencies, audio_seconds)
+            result["first_seg"] = first
+            result["peak_rss_bytes"] = rss.peak_rss
+            result["rss_start_bytes"] = rss_start
+            if cold_result is not None:
+                result["cold_first_seg"] = cold_result["first_seg"]
+            if name.startswith("separation"):
+                profile = pa.get_profile(profile)
+                result["forward_por_seg"] = round(pa.demucs_forward_seconds(
+                    pa.get_demucs_model(profile["model"]), int(seconds * sr), profile), 3)
+            report["cases"][f"{name}/{seconds}s"] = result
+
+    return report
+
+
+def benchmark_main(argv=None):
+    parser = argparse.ArgumentParser(description="⏱ Benchmarks del pipeline de remix")
+    parser.add_argument("--lengths", type=float, nargs="+", default=[10, 30], help="Duraciones de audio sintético (s)")
+    parser.add_argument("--repeats", type=int, default=3, help="Repeticiones medidas por caso")
+    parser.add_argument("--stages", nargs="+", default=["separation", "generation", "mix", "pipeline"],
+                        choices=["separation", "generation", "mix", "pipeline"])
+    parser.add_argument("--gen-seconds", type=float, default=10, help="Duración máxima a generar con MusicGen")
+    parser.add_argument("--cold", action="store_true", help="Medir también la carga de modelos en frío")
+    parser.add_argument("--profiles", nargs="+", default=None, help="Perfiles de separación a comparar (fast balanced best)")
+    parser.add_argument("--out", default="bench_output.json", help="Archivo JSON de resultados")
+    parser.add_argument("--baseline", help="JSON de una ejecución anterior para comparar")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Margen antes de marcar regresión (0.10 = 10%%)")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="remix_bench_") as workdir:
+        report = run(args.lengths, args.repeats, args.stages, workdir,
+                     gen_seconds=args.gen_seconds, cold=args.cold, profiles=args.profiles)
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Resultados guardados en {args.out}")
+
+    print(f"{'caso':<24}{'p50 (s)':>10}{'p90 (s)':>10}{'RTF':>8}")
+    for case, data in report["cases"].items():
+        rtf = f"{data['rtf_p50']:.3f}" if data["rtf_p50"] is not None else "-"
+        print(f"{case:<24}{data['p50_seg']:>10.3f}{data['p90_seg']:>10.3f}{rtf:>8}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        rows = compare(report, baseline, args.tolerance)
+        regressions = 0
+        print(f"\nComparación con {args.baseline}:")
+        for case, old, new, ratio, regression in rows:
+            flag = "⚠️ REGRESIÓN" if regression else ""
+            regressions += regression
+            print(f"{case:<24}{old:>10.3f} → {new:<10.3f}x{ratio:.2f} {flag}")
+        return 1 if regressions else 0
+    return 0
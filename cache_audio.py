@@ -0,0 +1,177 @@
+# cache_audio.py
+# Caché en disco direccionada por contenido para resultados de audio
+# (stems de Demucs, acompañamientos de MusicGen...).
+# Cada entrada es una carpeta raiz/<clave>/ con sus archivos y un meta.json.
+# Cuando el total supera max_bytes se borran las entradas menos usadas (LRU).
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from typing import Dict, Optional
+
+META = "meta.json"
+
+
+def clave_cache(*partes) -> str:
+    """
+    Construye una clave estable (sha256) a partir de varias partes.
+    Acepta bytes, arrays de numpy (se usa su buffer) o cualquier valor con str().
+    """
+    h = hashlib.sha256()
+    for parte in partes:
+        if isinstance(parte, (bytes, bytearray, memoryview)):
+            h.update(parte)
+        elif hasattr(parte, "tobytes"):
+            h.update(str(getattr(parte, "shape", "")).encode())
+            h.update(str(getattr(parte, "dtype", "")).encode())
+            h.update(parte.tobytes())
+        else:
+            h.update(repr(parte).encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+def _tamanio_carpeta(ruta: str) -> int:
+    total = 0
+    for nombre in os.listdir(ruta):
+        try:
+            total += os.path.getsize(os.path.join(ruta, nombre))
+        except OSError:
+            pass
+    return total
+
+
+def enlazar_o_copiar(origen: str, destino: str):
+    """Hace un hard link si se puede (instantáneo, sin ocupar espacio extra); si no, copia."""
+    if os.path.exists(destino):
+        os.remove(destino)
+    try:
+        os.link(origen, destino)
+    except OSError:
+        shutil.copy2(origen, destino)
+
+
+class CacheAudio:
+    """
+    Caché LRU en disco, segura entre hilos.
+
+    - raiz: carpeta donde se guardan las entradas.
+    - max_bytes: tamaño máximo total antes de desalojar entradas antiguas.
+    - nombre: etiqueta para logs y estadísticas.
+    """
+    def __init__(self, raiz: str, max_bytes: int, nombre: str = "cache"):
+        self.raiz = raiz
+        self.max_bytes = max_bytes
+        self.nombre = nombre
+        self.hits = 0
+        self.misses = 0
+        self.desalojos = 0
+        self._lock = threading.Lock()
+        self._indice: Dict[str, list] = {}  # clave -> [bytes, ultimo_acceso]
+        os.makedirs(raiz, exist_ok=True)
+        self._cargar_indice()
+
+    def _cargar_indice(self):
+        """Reconstruye el índice en memoria a partir de lo que ya hay en disco."""
+        for clave in os.listdir(self.raiz):
+            carpeta = os.path.join(self.raiz, clave)
+            if not os.path.isfile(os.path.join(carpeta, META)):
+                # Restos de una escritura interrumpida
+                if os.path.isdir(carpeta) and clave.startswith(".tmp"):
+                    shutil.rmtree(carpeta, ignore_errors=True)
+                continue
+            self._indice[clave] = [_tamanio_carpeta(carpeta), os.path.getmtime(os.path.join(carpeta, META))]
+
+    def obtener(self, clave: str) -> Optional[Dict[str, str]]:
+        """Devuelve {nombre: ruta} de la entrada si existe (y la marca como usada), o None."""
+        with self._lock:
+            carpeta = os.path.join(self.raiz, clave)
+            if not os.path.isfile(os.path.join(carpeta, META)):
+                self._indice.pop(clave, None)
+                self.misses += 1
+                return None
+            # Puede haberla escrito otro proceso (pool de workers) que comparte la carpeta
+            entrada = self._indice.setdefault(clave, [_tamanio_carpeta(carpeta), time.time()])
+
+            with open(os.path.join(carpeta, META), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            archivos = {nombre: os.path.join(carpeta, archivo) for nombre, archivo in meta["archivos"].items()}
+            if not all(os.path.exists(ruta) for ruta in archivos.values()):
+                self._indice.pop(clave, None)
+                shutil.rmtree(carpeta, ignore_errors=True)
+                self.misses += 1
+                return None
+
+            ahora = time.time()
+            entrada[1] = ahora
+            os.utime(os.path.join(carpeta, META), (ahora, ahora))
+            self.hits += 1
+            return archivos
+
+    def guardar(self, clave: str, archivos: Dict[str, str], extra: Optional[dict] = None) -> Dict[str, str]:
+        """
+        Copia (o enlaza) los archivos {nombre: ruta} en la caché bajo `clave`.
+        Devuelve las rutas dentro de la caché.
+        """
+        tmp = os.path.join(self.raiz, f".tmp-{uuid.uuid4().hex}")
+        os.makedirs(tmp)
+        nombres = {}
+        for nombre, ruta in archivos.items():
+            archivo = os.path.basename(ruta)
+            enlazar_o_copiar(ruta, os.path.join(tmp, archivo))
+            nombres[nombre] = archivo
+        with open(os.path.join(tmp, META), "w", encoding="utf-8") as f:
+            json.dump({"archivos": nombres, "creado": time.time(), "extra": extra or {}}, f, ensure_ascii=False)
+
+        carpeta = os.path.join(self.raiz, clave)
+        with self._lock:
+            if os.path.isdir(carpeta):
+                # Otro hilo ya guardó la misma entrada
+                shutil.rmtree(tmp, ignore_errors=True)
+            else:
+                os.replace(tmp, carpeta)
+            self._indice[clave] = [_tamanio_carpeta(carpeta), time.time()]
+            self._desalojar()
+
+        return {nombre: os.path.join(carpeta, archivo) for nombre, archivo in nombres.items()}
+
+    def _desalojar(self):
+        """Borra las entradas menos recientes hasta quedar bajo max_bytes (con el lock tomado)."""
+        total = sum(tam for tam, _ in self._indice.values())
+        if total <= self.max_bytes:
+            return
+        for clave, (tam, _) in sorted(self._indice.items(), key=lambda kv: kv[1][1]):
+            if total <= self.max_bytes or len(self._indice) <= 1:
+                break
+            shutil.rmtree(os.path.join(self.raiz, clave), ignore_errors=True)
+            del self._indice[clave]
+            total -= tam
+            self.desalojos += 1
+            print(f"🧹 {self.nombre}: entrada desalojada {clave[:12]} ({tam} bytes)")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "nombre": self.nombre,
+                "hits": self.hits,
+                "misses": self.misses,
+                "desalojos": self.desalojos,
+                "entradas": len(self._indice),
+                "bytes": sum(tam for tam, _ in self._indice.values()),
+                "max_bytes": self.max_bytes,
+            }
+
+
+def restaurar(archivos: Dict[str, str], destino: str) -> Dict[str, str]:
+    """Coloca los archivos de una entrada de caché en `destino` (hard link o copia)."""
+    os.makedirs(destino, exist_ok=True)
+    rutas = {}
+    for nombre, ruta in archivos.items():
+        salida = os.path.join(destino, os.path.basename(ruta))
+        enlazar_o_copiar(ruta, salida)
+        rutas[nombre] = salida
+    return rutas
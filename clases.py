@@ -3,24 +3,36 @@
 # Objetivo: separar la lógica de datos (modelo) del servidor (app.py)
 
 import os
+import soundfile as sf
 from procesamiento_audio import separate_stems, generate_accompaniment, mix_tracks
 from datetime import datetime
 from typing import List, Optional
 from gestor_archivos import GestorArchivos
+from almacen import AlmacenProyecto
+from subidas import sha256_archivo
 
 class Pista:
     """
     Representa una pista (stem) individual de audio.
     Por ejemplo: voz, guitarra, bajo, batería...
     """
-    def __init__(self, nombre: str, archivo_ruta: str, duracion_seg: Optional[float] = None):
+    def __init__(self, nombre: str, archivo_ruta: str, duracion_seg: Optional[float] = None,
+                 samplerate: Optional[int] = None):
+        self.id: Optional[int] = None     # id en el almacén (None hasta que se guarda)
         self.nombre = nombre
         self.archivo_ruta = archivo_ruta  # ruta al archivo físico en disco
         self.duracion_seg = duracion_seg  # duración en segundos (si se conoce)
+        self.samplerate = samplerate      # frecuencia de muestreo (Demucs: 44100, MusicGen: 32000)
         self.metadatos = {}               # diccionario libre para tags adicionales
 
+    @classmethod
+    def desde_archivo(cls, nombre: str, archivo_ruta: str) -> "Pista":
+        """Crea la pista leyendo duración y frecuencia de la cabecera del archivo."""
+        info = sf.info(archivo_ruta)
+        return cls(nombre, archivo_ruta, info.duration, info.samplerate)
+
     def __repr__(self):
-        return f"Pista(nombre={self.nombre}, archivo={os.path.basename(self.archivo_ruta)})"
+        return f"Pista(nombre={self.nombre}, archivo={os.path.basename(self.archivo_ruta)}, sr={self.samplerate})"
 
 
 class Cancion:
@@ -29,6 +41,7 @@ class Cancion:
     Mantiene metadatos básicos y referencia a pistas (si se separó en stems).
     """
     def __init__(self, titulo: str, archivo_ruta: str, formato: Optional[str] = None):
+        self.id: Optional[int] = None  # id en el almacén (None hasta que se guarda)
         self.titulo = titulo
         self.archivo_ruta = archivo_ruta
         self.formato = formato or self._infer_format()
@@ -53,6 +66,34 @@ class Cancion:
         """Añade una pista a la canción (por ejemplo tras separar stems)."""
         self.pistas.append(pista)
 
+    def to_dict(self) -> dict:
+        """Campos que se guardan en el almacén."""
+        return {
+            "id": self.id,
+            "titulo": self.titulo,
+            "archivo_ruta": self.archivo_ruta,
+            "formato": self.formato,
+            "tamanio_bytes": self.tamanio_bytes,
+            "hora_subida": self.hora_subida.isoformat(),
+            "metadatos": self.metadatos,
+        }
+
+    @classmethod
+    def desde_dict(cls, datos: dict) -> "Cancion":
+        """Reconstruye una Cancion (con sus pistas) a partir de una fila del almacén."""
+        cancion = cls(datos["titulo"], datos["archivo_ruta"], datos.get("formato"))
+        cancion.id = datos.get("id")
+        cancion.tamanio_bytes = datos.get("tamanio_bytes") or cancion.tamanio_bytes
+        if datos.get("hora_subida"):
+            cancion.hora_subida = datetime.fromisoformat(datos["hora_subida"])
+        cancion.metadatos = dict(datos.get("metadatos") or {})
+        for p in datos.get("pistas", []):
+            pista = Pista(p["nombre"], p["archivo_ruta"], p.get("duracion_seg"), p.get("samplerate"))
+            pista.id = p.get("id")
+            pista.metadatos = dict(p.get("metadatos") or {})
+            cancion.pistas.append(pista)
+        return cancion
+
     def reproducir(self):
         raise NotImplementedError("Este método debe ser implementado por las subclases")
 
@@ -83,14 +124,27 @@ class ProyectoAudio:
     """
     Representa un proyecto que puede contener varias canciones y el estado del
     procesamiento (separación, mezcla, exportación).
+
+    Las canciones y pistas viven en el almacén SQLite (almacen.py): cada alta se
+    escribe al momento y las búsquedas van a la base de datos, así que varios
+    procesos que comparten el archivo ven siempre el mismo proyecto.
     """
-    def __init__(self, nombre_proyecto: str):
+    def __init__(self, nombre_proyecto: str, almacen: Optional[AlmacenProyecto] = None):
         self.nombre = nombre_proyecto
-        self.canciones: List[Cancion] = []
+        self.almacen = almacen or AlmacenProyecto()
+        self.id = self.almacen.proyecto_id(nombre_proyecto)
         self.created_at = datetime.now()
         self.outputs_dir = "outputs_remix"  # carpeta por defecto para resultados
         os.makedirs(self.outputs_dir, exist_ok=True)
 
+    @property
+    def canciones(self) -> List[Cancion]:
+        """Canciones del proyecto, leídas del almacén."""
+        return [Cancion.desde_dict(d) for d in self.almacen.canciones(self.id)]
+
+    def numero_canciones(self) -> int:
+        return self.almacen.contar_canciones(self.id)
+
     def agregar_cancion(self, cancion):
         """
         Añade una Cancion al proyecto.
@@ -99,15 +153,51 @@ class ProyectoAudio:
         if not isinstance(cancion, Cancion):
             raise TypeError(f"Se esperaba un objeto Cancion, pero se recibió {type(cancion).__name__}")
 
-        self.canciones.append(cancion)
+        cancion.id, _ = self.almacen.guardar_cancion(self.id, cancion.to_dict())
+        if cancion.pistas:
+            self._guardar_pistas(cancion, cancion.pistas)
         return cancion
 
+    def agregar_cancion_unica(self, cancion: Cancion):
+        """
+        Como agregar_cancion, pero si ya existe una canción con el mismo sha256
+        (cancion.metadatos["sha256"]) devuelve esa. Devuelve (cancion, es_nueva).
+        """
+        cancion_id, nueva = self.almacen.guardar_cancion(self.id, cancion.to_dict(), unica=True)
+        if not nueva:
+            return Cancion.desde_dict(self.almacen.cancion(cancion_id)), False
+        cancion.id = cancion_id
+        return cancion, True
+
+    def agregar_pistas(self, cancion: Cancion, pistas: List[Pista]):
+        """Añade pistas a una canción ya registrada (una sola escritura para todas)."""
+        for pista in pistas:
+            cancion.agregar_pista(pista)
+        self._guardar_pistas(cancion, pistas)
+
+    def reemplazar_pistas(self, cancion: Cancion, pistas: List[Pista]):
+        """
+        Deja a la canción exactamente con estas pistas (p. ej. tras volver a
+        separarla): las que no vienen se borran en la misma transacción.
+        """
+        cancion.pistas = list(pistas)
+        self._guardar_pistas(cancion, pistas, reemplazar=True)
+
+    def _guardar_pistas(self, cancion: Cancion, pistas: List[Pista], reemplazar: bool = False):
+        datos = [{"nombre": p.nombre, "archivo_ruta": p.archivo_ruta, "duracion_seg": p.duracion_seg,
+                  "samplerate": p.samplerate, "metadatos": p.metadatos} for p in pistas]
+        for pista, pista_id in zip(pistas, self.almacen.guardar_pistas(cancion.id, datos, reemplazar)):
+            pista.id = pista_id
+
     def encontrar_cancion_por_archivo(self, filename: str) -> Optional[Cancion]:
-        """Busca una canción por nombre de archivo (basename)."""
-        for c in self.canciones:
-            if os.path.basename(c.archivo_ruta) == filename:
-                return c
-        return None
+        """Busca una canción por nombre de archivo (basename, consulta indexada)."""
+        datos = self.almacen.cancion_por_archivo(self.id, filename)
+        return Cancion.desde_dict(datos) if datos else None
+
+    def encontrar_cancion_por_hash(self, sha256: str) -> Optional[Cancion]:
+        """Busca una canción con el mismo contenido (sha256 de los bytes subidos)."""
+        datos = self.almacen.cancion_por_hash(self.id, sha256)
+        return Cancion.desde_dict(datos) if datos else None
 
     def listar_canciones(self) -> List[dict]:
         """Devuelve una lista con información simple de las canciones del proyecto."""
@@ -125,20 +215,39 @@ class ProyectoAudio:
         out_path = os.path.join(self.output_dir, "final_mix.wav")
         return mix_tracks(vocal_wav, accomp_wav, out_path)
 
-    def guardar_estado(self):
-        """Guarda la información básica del proyecto en JSON (opcional)."""
-        gestor = GestorArchivos("estado_proyecto.json")
-        data = [c.info_simple() for c in self.canciones]
-        gestor.guardar_json(data)
-
-    def cargar_estado(self):
-        """Carga canciones previamente guardadas (si existe el JSON)."""
-        gestor = GestorArchivos("estado_proyecto.json")
-        data = gestor.leer_json()
-        if not data:
-            raise "No se han encontrado canciones registradas"
-        for c in data:
-            print(f"Canción registrada en JSON: {c['titulo']}")
+    def guardar_estado(self, canciones: Optional[List[Cancion]] = None):
+        """
+        Guarda en el almacén canciones modificadas en memoria (con sus pistas).
+        Las altas con agregar_cancion / agregar_pistas ya se guardan solas.
+        """
+        for cancion in canciones or []:
+            self.agregar_cancion(cancion)
+
+    def cargar_estado(self, ruta_json: str = "estado_proyecto.json", carpeta_subidas: str = "uploads"):
+        """
+        Carga el proyecto desde el almacén. La primera vez, si el almacén está
+        vacío, importa las canciones del antiguo estado_proyecto.json cuyos
+        archivos sigan en `carpeta_subidas`.
+        """
+        if self.numero_canciones() == 0 and os.path.exists(ruta_json):
+            for c in GestorArchivos(ruta_json).leer_json() or []:
+                ruta = os.path.join(carpeta_subidas, c.get("archivo") or c.get("titulo", ""))
+                if not os.path.isfile(ruta):
+                    print(f"⚠️ No se importa {c.get('titulo')}: no existe {ruta}")
+                    continue
+                cancion = Cancion(c.get("titulo") or os.path.basename(ruta), ruta, c.get("formato"))
+                if c.get("hora_subida"):
+                    cancion.hora_subida = datetime.fromisoformat(c["hora_subida"])
+                cancion.metadatos["sha256"] = sha256_archivo(ruta)
+                self.agregar_cancion(cancion)
+                print(f"Canción importada de {ruta_json}: {cancion.titulo}")
+
+        total = self.numero_canciones()
+        if not total:
+            print("No se han encontrado canciones registradas")
+        else:
+            print(f"Canciones registradas en el proyecto: {total}")
+        return total
 
 
 '''
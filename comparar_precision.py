@@ -0,0 +1,160 @@
+# comparar_precision.py
+# Compara la inferencia en precisión reducida (int8 / bf16) contra fp32.
+# Se ejecuta con:  python procesamiento_audio.py compare --precision int8 --input referencia.wav
+# Para la separación se mide el SDR de cada stem tomando la salida fp32 como
+# referencia, además de la distancia espectral y la velocidad (RTF) de ambas.
+# Para MusicGen (muestreo) solo es comparable la distancia espectral con la
+# misma semilla: los tokens pueden divergir, así que es orientativa.
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from benchmark import summarize, timed, write_synth
+
+
+# =========================
+# MÉTRICAS DE CALIDAD
+# =========================
+def sdr(reference, estimate):
+    """Signal-to-distortion ratio (dB) de estimate respecto a reference."""
+    reference = np.asarray(reference, dtype=np.float64)
+    estimate = np.asarray(estimate, dtype=np.float64)
+    noise = np.sum((reference - estimate) ** 2)
+    signal = np.sum(reference ** 2)
+    if noise == 0:
+        return float("inf")
+    return float(10 * np.log10((signal + 1e-12) / (noise + 1e-12)))
+
+
+def spectral_distance(reference, estimate, n_fft=2048, hop=512):
+    """
+    Distancia media (dB) entre los espectros de magnitud logarítmicos
+    de dos señales (canales, muestras) o (muestras,).
+    """
+    def log_spec(x):
+        x = np.atleast_2d(np.asarray(x, dtype=np.float32))
+        if x.shape[-1] < n_fft:
+            x = np.pad(x, ((0, 0), (0, n_fft - x.shape[-1])))
+        frames = np.lib.stride_tricks.sliding_window_view(x, n_fft, axis=-1)[..., ::hop, :]
+        mag = np.abs(np.fft.rfft(frames * np.hanning(n_fft).astype(np.float32), axis=-1))
+        return 20 * np.log10(mag + 1e-6)
+
+    a, b = log_spec(reference), log_spec(estimate)
+    n = min(a.shape[-2], b.shape[-2])
+    return float(np.mean(np.abs(a[..., :n, :] - b[..., :n, :])))
+
+
+# =========================
+# COMPARACIONES
+# =========================
+def compare_separation(path, precision, seconds, repeats=1):
+    """Separa el mismo fragmento con Demucs fp32 y con la precisión reducida."""
+    import procesamiento_audio as pa
+    from modelos import cargar_demucs, reducir_precision
+
+    fp32 = cargar_demucs("fp32")
+    reduced = reducir_precision(fp32, precision)
+    wav, sr = pa.load_audio(path, sr=fp32.samplerate, mono=False)
+    wav = wav[:, :int(seconds * sr)]
+    audio_seconds = wav.shape[-1] / sr
+    separator = pa.DemucsSeparator()
+    # Sin shifts: apply_model desplaza la señal al azar en cada llamada y el SDR
+    # mediría ese desplazamiento además de la precisión
+    profile = {**pa.get_profile(), "shifts": 0}
+
+    outputs, speed = {}, {}
+    for name, model, prec in (("fp32", fp32, "fp32"), (precision, reduced, precision)):
+        def separate():
+            return separator.separate(wav, model=model, precision=prec, profile=profile)
+        pa.log(f"Separando {audio_seconds:.1f}s con Demucs {name}...")
+        outputs[name] = separate()
+        speed[name] = summarize(timed(separate, repeats), audio_seconds)
+
+    stems = {}
+    for i, stem in enumerate(fp32.sources):
+        ref, est = outputs["fp32"][i], outputs[precision][i]
+        stems[stem] = {"sdr_db": sdr(ref, est), "spectral_distance_db": spectral_distance(ref, est)}
+    return {"audio_seg": audio_seconds, "stems": stems, "speed": speed}
+
+
+def compare_generation(prompt, precision, seconds, seed=0, repeats=1):
+    """Genera el mismo prompt con la misma semilla con MusicGen fp32 y reducido."""
+    import torch
+    import procesamiento_audio as pa
+    from modelos import cargar_musicgen, get_device, reducir_precision
+
+    processor, fp32 = cargar_musicgen("fp32")
+    reduced = reducir_precision(fp32, precision)
+    inputs = processor(text=f"background music in {prompt} style",
+                       return_tensors="pt", padding=True).to(get_device())
+    generator = pa.MusicGenGenerator()
+
+    outputs, speed = {}, {}
+    for name, model, prec in (("fp32", fp32, "fp32"), (precision, reduced, precision)):
+        def generate():
+            with pa._musicgen_rng_lock, torch.no_grad():
+                torch.manual_seed(seed)
+                return generator._generate(inputs, seconds, model=model, precision=prec)
+        pa.log(f"Generando {seconds:.1f}s con MusicGen {name}...")
+        outputs[name] = generate()[0, 0].float().cpu().numpy()
+        speed[name] = summarize(timed(generate, repeats), seconds)
+
+    return {
+        "audio_seg": seconds,
+        "spectral_distance_db": spectral_distance(outputs["fp32"], outputs[precision]),
+        "speed": speed,
+    }
+
+
+def compare_main(argv=None):
+    parser = argparse.ArgumentParser(description="🔬 Calidad y velocidad de int8/bf16 frente a fp32")
+    parser.add_argument("--precision", choices=["int8", "bf16"], default="int8")
+    parser.add_argument("--input", help="Clip de referencia (por defecto, audio sintético)")
+    parser.add_argument("--seconds", type=float, default=10, help="Segundos a separar / generar")
+    parser.add_argument("--stages", nargs="+", default=["separation", "generation"],
+                        choices=["separation", "generation"])
+    parser.add_argument("--style", default="electronic", help="Estilo para la comparación de MusicGen")
+    parser.add_argument("--repeats", type=int, default=1, help="Repeticiones medidas por precisión")
+    parser.add_argument("--min-sdr", type=float, default=None,
+                        help="SDR mínimo (dB) por stem; código de salida 1 si alguno queda por debajo")
+    parser.add_argument("--out", default="precision_output.json", help="Archivo JSON de resultados")
+    args = parser.parse_args(argv)
+
+    report = {"fecha": time.strftime("%Y-%m-%dT%H:%M:%S"), "precision": args.precision,
+              "cpus": os.cpu_count()}
+
+    if "separation" in args.stages:
+        with tempfile.TemporaryDirectory(prefix="remix_precision_") as workdir:
+            path = args.input or write_synth(os.path.join(workdir, "synth.wav"), args.seconds)
+            report["separation"] = compare_separation(path, args.precision, args.seconds, args.repeats)
+    if "generation" in args.stages:
+        report["generation"] = compare_generation(args.style, args.precision, args.seconds,
+                                                  repeats=args.repeats)
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Resultados guardados en {args.out}")
+
+    failed = False
+    for stage in ("separation", "generation"):
+        if stage not in report:
+            continue
+        speed = report[stage]["speed"]
+        base, new = speed["fp32"]["p50_seg"], speed[args.precision]["p50_seg"]
+        print(f"\n{stage}: fp32 RTF {speed['fp32']['rtf_p50']:.3f} → {args.precision} "
+              f"RTF {speed[args.precision]['rtf_p50']:.3f} (x{base / new:.2f} más rápido)")
+        if stage == "separation":
+            print(f"{'stem':<10}{'SDR (dB)':>10}{'dist. espectral (dB)':>24}")
+            for stem, data in report[stage]["stems"].items():
+                low = args.min_sdr is not None and data["sdr_db"] < args.min_sdr
+                failed |= low
+                flag = "⚠️ por debajo de --min-sdr" if low else ""
+                print(f"{stem:<10}{data['sdr_db']:>10.2f}{data['spectral_distance_db']:>24.2f} {flag}")
+        else:
+            print(f"distancia espectral: {report[stage]['spectral_distance_db']:.2f} dB (orientativa)")
+    return 1 if failed else 0
@@ -0,0 +1,130 @@
+# etapas.py
+# Ejecución de un pipeline como grafo de etapas (DAG).
+# Cada etapa declara de qué otras depende; las que no dependen entre sí se
+# ejecutan a la vez en hilos distintos (p. ej. separar con Demucs y generar con
+# MusicGen) y cada una arranca en cuanto terminan sus dependencias, así la
+# latencia total es la del camino más largo y no la suma de todas.
+#
+# Los hilos comparten los modelos ya cargados. Para que dos etapas de torch
+# no se peleen por los núcleos, cada una fija su propio presupuesto de hilos
+# intra-op (torch.set_num_threads con OpenMP se aplica al hilo que lo llama).
+
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, Optional
+
+
+class Etapa:
+    """Una etapa del grafo: funcion(**resultados de sus dependencias)."""
+
+    def __init__(self, nombre: str, funcion: Callable, depende: Iterable[str] = (), hilos: Optional[int] = None):
+        self.nombre = nombre
+        self.funcion = funcion
+        self.depende = tuple(depende)
+        self.hilos = hilos
+
+
+class GrafoEtapas:
+    """
+    Grafo de etapas con dependencias.
+
+    - etapa(nombre, funcion, depende=(...), hilos=None) añade una etapa; la
+      función recibe como argumentos con nombre los resultados de las etapas
+      de las que depende.
+    - ejecutar() lanza todo y devuelve {nombre: resultado}. Si una etapa falla
+      no se lanzan las que faltan, se espera a las que ya estaban en marcha y
+      se relanza el primer error.
+    - hilos_torch: núcleos a repartir entre las etapas que corren a la vez
+      (por defecto todos). Una etapa con `hilos` usa ese número.
+    """
+
+    def __init__(self, hilos_torch: Optional[int] = None, log: Callable[[str], None] = print):
+        self.hilos_torch = hilos_torch or os.cpu_count() or 1
+        self.log = log
+        self._etapas: Dict[str, Etapa] = {}
+        self.tiempos: Dict[str, dict] = {}
+
+    def etapa(self, nombre, funcion, depende=(), hilos=None):
+        if nombre in self._etapas:
+            raise ValueError(f"Etapa repetida: {nombre}")
+        self._etapas[nombre] = Etapa(nombre, funcion, depende, hilos)
+
+    # =========================
+    # ORDEN
+    # =========================
+    def niveles(self):
+        """
+        Etapas agrupadas por profundidad (las de un nivel solo dependen de
+        niveles anteriores). Lanza ValueError con dependencias desconocidas o ciclos.
+        """
+        for etapa in self._etapas.values():
+            desconocidas = [d for d in etapa.depende if d not in self._etapas]
+            if desconocidas:
+                raise ValueError(f"La etapa {etapa.nombre} depende de etapas inexistentes: {desconocidas}")
+
+        hechas, niveles = set(), []
+        while len(hechas) < len(self._etapas):
+            nivel = [n for n, e in self._etapas.items() if n not in hechas and set(e.depende) <= hechas]
+            if not nivel:
+                raise ValueError(f"Ciclo entre las etapas: {sorted(set(self._etapas) - hechas)}")
+            niveles.append(nivel)
+            hechas.update(nivel)
+        return niveles
+
+    def _presupuestos(self, niveles):
+        """Hilos de torch por etapa: los núcleos repartidos entre las etapas de su nivel."""
+        presupuestos = {}
+        for nivel in niveles:
+            fijos = sum(self._etapas[n].hilos for n in nivel if self._etapas[n].hilos)
+            libres = [n for n in nivel if not self._etapas[n].hilos]
+            por_etapa = max(1, (self.hilos_torch - fijos) // len(libres)) if libres else 0
+            for n in nivel:
+                presupuestos[n] = self._etapas[n].hilos or por_etapa
+        return presupuestos
+
+    # =========================
+    # EJECUCIÓN
+    # =========================
+    def _correr(self, etapa, hilos, resultados):
+        import torch
+        torch.set_num_threads(hilos)
+
+        t0 = time.perf_counter()
+        self.log(f"▶️ Etapa {etapa.nombre} ({hilos} hilos de torch)")
+        resultado = etapa.funcion(**{d: resultados[d] for d in etapa.depende})
+        fin = time.perf_counter()
+        self.tiempos[etapa.nombre] = {"inicio": t0, "fin": fin, "seg": round(fin - t0, 3)}
+        self.log(f"⏹ Etapa {etapa.nombre}: {fin - t0:.1f}s")
+        return resultado
+
+    def ejecutar(self):
+        niveles = self.niveles()
+        presupuestos = self._presupuestos(niveles)
+
+        resultados, pendientes, en_marcha = {}, dict(self._etapas), {}
+        error = None
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(1, len(self._etapas)), thread_name_prefix="etapa") as pool:
+            while pendientes or en_marcha:
+                if error is None:
+                    for nombre, etapa in list(pendientes.items()):
+                        if all(d in resultados for d in etapa.depende):
+                            del pendientes[nombre]
+                            en_marcha[pool.submit(self._correr, etapa, presupuestos[nombre], resultados)] = nombre
+                if not en_marcha:
+                    break
+
+                hechos, _ = wait(en_marcha, return_when=FIRST_COMPLETED)
+                for futuro in hechos:
+                    nombre = en_marcha.pop(futuro)
+                    try:
+                        resultados[nombre] = futuro.result()
+                    except Exception as e:
+                        self.log(f"❌ Etapa {nombre} falló: {e}")
+                        error = error or e
+
+        if error is not None:
+            raise error
+        self.tiempos["total"] = {"seg": round(time.perf_counter() - t0, 3)}
+        return resultados
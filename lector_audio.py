@@ -0,0 +1,145 @@
+# lector_audio.py
+# Lectura rápida de audio ya decodificado (stems WAV de Demucs, mezclas...).
+# Los WAV PCM/float se mapean en memoria con np.memmap: solo se leen del disco
+# las muestras que se usan y no se copia el archivo entero a RAM.
+# Solo se remuestrea cuando la frecuencia no coincide, con un filtro polifásico.
+
+import math
+import struct
+from math import gcd
+
+import numpy as np
+import soundfile as sf
+
+# Subtipos de WAV que se pueden mapear directamente (dtype little-endian, escala)
+_MAPPABLE = {
+    "PCM_16": ("<i2", 32768.0),
+    "PCM_32": ("<i4", 2147483648.0),
+    "FLOAT": ("<f4", 1.0),
+    "DOUBLE": ("<f8", 1.0),
+}
+
+
+def mappable(info):
+    """True si un archivo (según su sf.info) se puede leer con np.memmap sin decodificar."""
+    return info.format == "WAV" and info.subtype in _MAPPABLE
+
+
+def _wav_data_offset(path):
+    """Busca el chunk 'data' de un WAV RIFF y devuelve su offset en bytes (o None)."""
+    with open(path, "rb") as f:
+        header = f.read(12)
+        if len(header) < 12 or header[:4] != b"RIFF" or header[8:12] != b"WAVE":
+            return None
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                return None
+            chunk_id, size = chunk[:4], struct.unpack("<I", chunk[4:])[0]
+            if chunk_id == b"data":
+                return f.tell()
+            f.seek(size + (size & 1), 1)
+
+
+class MappedAudio:
+    """
+    Acceso por bloques a un archivo de audio.
+
+    Si es un WAV con un subtipo mapeable se usa np.memmap (sin decodificar);
+    en otro caso se lee con soundfile desde la posición pedida.
+    """
+
+    def __init__(self, path):
+        info = sf.info(path)
+        self.path = str(path)
+        self.samplerate = info.samplerate
+        self.channels = info.channels
+        self.frames = info.frames
+        self._memmap = None
+        self._scale = 1.0
+
+        if mappable(info):
+            offset = _wav_data_offset(self.path)
+            if offset is not None:
+                dtype, self._scale = _MAPPABLE[info.subtype]
+                self._memmap = np.memmap(self.path, dtype=dtype, mode="r", offset=offset,
+                                         shape=(self.frames, self.channels))
+
+    @property
+    def mapped(self):
+        return self._memmap is not None
+
+    @property
+    def duration(self):
+        return self.frames / self.samplerate
+
+    def read(self, start=0, stop=None):
+        """Devuelve las muestras [start, stop) como float32 (canales, muestras)."""
+        stop = self.frames if stop is None else min(stop, self.frames)
+        start = min(start, stop)
+        if self._memmap is not None:
+            block = self._memmap[start:stop].T.astype(np.float32)
+            if self._scale != 1.0:
+                block *= 1.0 / self._scale
+            return block
+        with sf.SoundFile(self.path) as f:
+            f.seek(start)
+            return f.read(stop - start, dtype="float32", always_2d=True).T
+
+
+def resample(audio, orig_sr, target_sr):
+    """
+    Remuestreo polifásico (vectorizado sobre canales) de (canales, muestras):
+    un solo filtro FIR anti-aliasing para todos los canales, sin FFT de la señal entera.
+    """
+    if orig_sr == target_sr:
+        return audio
+    from scipy.signal import resample_poly  # solo se importa si hace falta remuestrear
+
+    g = gcd(int(orig_sr), int(target_sr))
+    return resample_poly(audio, int(target_sr) // g, int(orig_sr) // g, axis=-1).astype(np.float32)
+
+
+def resample_blocks(reader, target_sr, block=1 << 18):
+    """
+    Recorre un MappedAudio por bloques y los devuelve remuestreados a target_sr
+    (canales, muestras). Cada bloque se filtra con un margen de contexto a cada
+    lado que luego se recorta, así el resultado es el mismo que resample() del
+    archivo entero pero la memoria no depende de la duración.
+    """
+    total, orig_sr = reader.frames, reader.samplerate
+    if orig_sr == target_sr:
+        for start in range(0, total, block):
+            yield reader.read(start, start + block)
+        return
+    from scipy.signal import resample_poly
+
+    g = gcd(int(orig_sr), int(target_sr))
+    up, down = int(target_sr) // g, int(orig_sr) // g
+    # Bloques y margen múltiplos de `down`: cada uno empieza en una fase entera de la salida
+    block = max(down, block // down * down)
+    half_filter = 10 * max(up, down) // up + 1   # semilongitud del FIR de resample_poly, en muestras de entrada
+    margin = down * math.ceil(half_filter / down)
+    for start in range(0, total, block):
+        stop = min(start + block, total)
+        a, b = max(0, start - margin), min(total, stop + margin)
+        out = resample_poly(reader.read(a, b), up, down, axis=-1)
+        lead = (start - a) * up // down
+        size = (stop - start) * up // down if stop < total else math.ceil((stop - start) * up / down)
+        yield out[:, lead:lead + size].astype(np.float32)
+
+
+def read_audio(path, sr=None, mono=False):
+    """
+    Lee un archivo completo como float32 (canales, muestras).
+    Con sr=None (o igual a la del archivo) no se remuestrea.
+    """
+    reader = MappedAudio(path)
+    audio = reader.read()
+    if sr is not None and sr != reader.samplerate:
+        audio = resample(audio, reader.samplerate, sr)
+    else:
+        sr = reader.samplerate
+    if mono and audio.shape[0] > 1:
+        audio = audio.mean(axis=0, keepdims=True)
+    return audio, sr
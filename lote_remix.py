@@ -0,0 +1,239 @@
+# lote_remix.py
+# Remix por lotes: procesa todas las canciones de un directorio o de un manifiesto
+# (JSON o CSV) con varios trabajos en paralelo, reutilizando los modelos cargados.
+# Se ejecuta con:  python procesamiento_audio.py batch --input canciones/ --style lo-fi --jobs 2
+#
+# El progreso se guarda en <output_dir>/batch_state.json después de cada canción:
+# si el proceso se corta, al relanzarlo se saltan las que ya están al día.
+
+import argparse
+import csv
+import json
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+AUDIO_EXTENSIONS = (".wav", ".mp3", ".flac", ".ogg", ".m4a", ".aiff")
+STATE_FILE = "batch_state.json"
+REPORT_FILE = "batch_report.json"
+
+
+# =========================
+# ENTRADAS
+# =========================
+def load_entries(source, style=None, duration=None, seed=None, profile=None, stems="all"):
+    """
+    Devuelve la lista de canciones a procesar: [{input, style, duration, seed, profile, stems}].
+
+    source puede ser:
+      - un directorio: todos los archivos de audio (mismo estilo para todos)
+      - un .json: lista de rutas o de objetos {"input", "style", "duration", "seed"}
+      - un .csv: columnas input, style (opcional), duration, seed, profile, stems (opcionales)
+    Las rutas relativas de un manifiesto se resuelven respecto a su carpeta.
+    """
+    defaults = {"style": style, "duration": duration, "seed": seed, "profile": profile, "stems": stems}
+
+    if os.path.isdir(source):
+        rows = [{"input": os.path.join(source, name)} for name in sorted(os.listdir(source))
+                if name.lower().endswith(AUDIO_EXTENSIONS)]
+        base = None
+    elif source.lower().endswith(".json"):
+        with open(source, "r", encoding="utf-8") as f:
+            rows = [r if isinstance(r, dict) else {"input": r} for r in json.load(f)]
+        base = os.path.dirname(os.path.abspath(source))
+    elif source.lower().endswith(".csv"):
+        with open(source, "r", encoding="utf-8", newline="") as f:
+            rows = [{k: v for k, v in r.items() if v not in (None, "")} for r in csv.DictReader(f)]
+        base = os.path.dirname(os.path.abspath(source))
+    else:
+        raise ValueError(f"Origen no soportado (directorio, .json o .csv): {source}")
+
+    entries = []
+    for row in rows:
+        entry = {**defaults, **row}
+        if base and not os.path.isabs(entry["input"]):
+            entry["input"] = os.path.join(base, entry["input"])
+        if not entry.get("style"):
+            raise ValueError(f"Falta el estilo para {entry['input']} (usa --style o la columna 'style')")
+        entry["duration"] = float(entry["duration"]) if entry.get("duration") not in (None, "") else None
+        entry["seed"] = int(entry["seed"]) if entry.get("seed") not in (None, "") else None
+        entries.append(entry)
+
+    # Nombre de carpeta de salida por canción (estable entre ejecuciones)
+    used = {}
+    for entry in entries:
+        name = os.path.splitext(os.path.basename(entry["input"]))[0]
+        used[name] = used.get(name, 0) + 1
+        entry["name"] = name if used[name] == 1 else f"{name}_{used[name]}"
+    return entries
+
+
+def signature(entry):
+    """Lo que determina si una salida sigue siendo válida: archivo de entrada y parámetros."""
+    st = os.stat(entry["input"])
+    return {
+        "size": st.st_size,
+        "mtime": st.st_mtime,
+        "style": entry["style"],
+        "duration": entry["duration"],
+        "seed": entry["seed"],
+        "profile": entry["profile"],
+        "stems": entry["stems"],
+    }
+
+
+# =========================
+# ESTADO (reanudable)
+# =========================
+class BatchState:
+    """Estado del lote en disco, escrito de forma atómica tras cada canción."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.records = {}
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self.records = json.load(f)
+            except (json.JSONDecodeError, OSError) as e:
+                print(f"⚠️ Estado del lote ilegible ({e}), se empieza de cero")
+
+    def up_to_date(self, entry, output):
+        record = self.records.get(entry["name"])
+        if record is None or record.get("status") != "ok":
+            return False
+        try:
+            firma = signature(entry)
+        except OSError:
+            return False  # la entrada ya no está: run_batch lo registra como error
+        return record.get("signature") == firma and os.path.exists(output)
+
+    def save(self, name, record):
+        with self._lock:
+            self.records[name] = record
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.records, f, indent=2, ensure_ascii=False)
+            os.replace(tmp, self.path)
+
+
+# =========================
+# EJECUCIÓN
+# =========================
+def process_entry(entry, output_dir, hilos_torch=None):
+    from procesamiento_audio import remix_file, audio_duration
+
+    song_dir = os.path.join(output_dir, entry["name"])
+    t0 = time.perf_counter()
+    final_mix = remix_file(entry["input"], entry["style"], song_dir, duration=entry["duration"],
+                           seed=entry["seed"], profile=entry["profile"], stems=entry["stems"],
+                           hilos_torch=hilos_torch)
+    elapsed = time.perf_counter() - t0
+    seconds = audio_duration(entry["input"])
+    return {
+        "status": "ok",
+        "input": entry["input"],
+        "output": final_mix,
+        "signature": signature(entry),
+        "elapsed_seg": round(elapsed, 3),
+        "audio_seg": round(seconds, 3),
+        "rtf": round(elapsed / seconds, 4) if seconds else None,
+    }
+
+
+def run_batch(entries, output_dir, jobs=1, force=False):
+    """Procesa las entradas y devuelve el informe del lote."""
+    import torch
+    from modelos import get_demucs_model, get_musicgen
+    from procesamiento_audio import log
+
+    os.makedirs(output_dir, exist_ok=True)
+    state = BatchState(os.path.join(output_dir, STATE_FILE))
+
+    pending, skipped, results = [], [], {}
+    for entry in entries:
+        output = os.path.join(output_dir, entry["name"], "final_remix.wav")
+        if not os.path.isfile(entry["input"]):
+            # Movida o borrada desde la última ejecución: error de esa canción, no del lote
+            record = {"status": "error", "input": entry["input"],
+                      "error": f"Archivo de entrada no encontrado: {entry['input']}"}
+            log(f"❌ {entry['name']}: {record['error']}")
+            state.save(entry["name"], record)
+            results[entry["name"]] = record
+        elif not force and state.up_to_date(entry, output):
+            skipped.append(entry["name"])
+        else:
+            pending.append(entry)
+    log(f"📦 Lote: {len(entries)} canciones, {len(skipped)} al día, {len(pending)} por procesar ({jobs} en paralelo)")
+
+    t0 = time.perf_counter()
+    if pending:
+        # Los modelos se cargan una sola vez y los comparten todos los hilos;
+        # cada canción usa su parte de los núcleos para las operaciones de torch
+        # (que remix_file reparte entre separación y generación)
+        get_demucs_model()
+        get_musicgen()
+        hilos = max(1, (os.cpu_count() or 1) // jobs)
+        torch.set_num_threads(hilos)
+
+        with ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="lote") as pool:
+            futures = {pool.submit(process_entry, entry, output_dir, hilos): entry for entry in pending}
+            for n, future in enumerate(as_completed(futures), start=1):
+                entry = futures[future]
+                try:
+                    record = future.result()
+                    log(f"✅ [{n}/{len(pending)}] {entry['name']} ({record['elapsed_seg']:.1f}s)")
+                except Exception as e:
+                    record = {"status": "error", "input": entry["input"], "error": str(e),
+                              "detalle": traceback.format_exc()}
+                    log(f"❌ [{n}/{len(pending)}] {entry['name']}: {e}")
+                state.save(entry["name"], record)
+                results[entry["name"]] = record
+
+    ok = [name for name, r in results.items() if r["status"] == "ok"]
+    errors = {name: r["error"] for name, r in results.items() if r["status"] == "error"}
+    return {
+        "fecha": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "total": len(entries),
+        "procesadas": len(ok),
+        "saltadas": len(skipped),
+        "errores": len(errors),
+        "tiempo_total_seg": round(time.perf_counter() - t0, 3),
+        "detalle_errores": errors,
+        "canciones": {name: state.records.get(name) for name in (e["name"] for e in entries)},
+    }
+
+
+def batch_main(argv=None):
+    parser = argparse.ArgumentParser(description="📦 AI Remix por lotes")
+    parser.add_argument("--input", required=True, help="Directorio de audios o manifiesto .json/.csv")
+    parser.add_argument("--style", help="Estilo para las canciones que no lo indiquen en el manifiesto")
+    parser.add_argument("--duration", type=float, default=None,
+                        help="Duración del acompañamiento (s); por defecto, la de la voz de cada canción")
+    parser.add_argument("--seed", type=int, default=None, help="Semilla de MusicGen")
+    parser.add_argument("--profile", default=None, help="Perfil de separación: fast, balanced o best")
+    parser.add_argument("--stems", default="all", choices=["all", "vocals", "two"], help="Stems a escribir")
+    parser.add_argument("--output_dir", default="output_batch", help="Carpeta de salida (una subcarpeta por canción)")
+    parser.add_argument("--jobs", type=int, default=1, help="Canciones procesadas en paralelo")
+    parser.add_argument("--force", action="store_true", help="Reprocesar aunque la salida esté al día")
+    parser.add_argument("--report", help=f"Ruta del informe JSON (por defecto <output_dir>/{REPORT_FILE})")
+    args = parser.parse_args(argv)
+
+    entries = load_entries(args.input, style=args.style, duration=args.duration, seed=args.seed,
+                           profile=args.profile, stems=args.stems)
+    report = run_batch(entries, args.output_dir, jobs=max(1, args.jobs), force=args.force)
+
+    report_path = args.report or os.path.join(args.output_dir, REPORT_FILE)
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    print("=" * 50)
+    print(f"Total: {report['total']} | procesadas: {report['procesadas']} | "
+          f"saltadas: {report['saltadas']} | errores: {report['errores']}")
+    print(f"Tiempo total: {report['tiempo_total_seg']:.1f}s")
+    print(f"Informe: {report_path}")
+    print("=" * 50)
+    return 1 if report["errores"] else 0
@@ -0,0 +1,201 @@
+# medios.py
+# Servir audio al navegador sin mandar WAVs de decenas de MB:
+#  - respuestas con Range (206), ETag / Last-Modified (304) y Cache-Control
+#  - previsualizaciones Opus/MP3 transcodificadas con ffmpeg bajo demanda y
+#    guardadas en caché (se regeneran solas si el WAV original cambia)
+#  - picos de forma de onda (min/max por tramo) para dibujar sin descargar el audio
+
+import json
+import os
+import subprocess
+import tempfile
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+from flask import abort, jsonify, send_file
+
+from cache_audio import CacheAudio, clave_cache
+from lector_audio import MappedAudio
+
+PREVIEW_CACHE_DIR = os.getenv("PREVIEW_CACHE_DIR", os.path.join("cache", "previews"))
+PREVIEW_CACHE_MAX_BYTES = int(os.getenv("PREVIEW_CACHE_MAX_BYTES", str(1024 ** 3)))
+MEDIA_MAX_AGE = int(os.getenv("MEDIA_MAX_AGE", "3600"))  # segundos de caché en el navegador
+
+# formato -> (extensión, mimetype, argumentos de ffmpeg)
+PREVIEW_FORMATS = {
+    "opus": (".ogg", "audio/ogg", ["-c:a", "libopus", "-b:a", "64k", "-vbr", "on"]),
+    "mp3": (".mp3", "audio/mpeg", ["-c:a", "libmp3lame", "-b:a", "128k"]),
+}
+PEAKS_DEFAULT = 800
+PEAKS_MAX = 10000
+
+preview_cache = CacheAudio(PREVIEW_CACHE_DIR, PREVIEW_CACHE_MAX_BYTES, nombre="previews")
+
+# Una transcodificación por archivo a la vez (dos peticiones iguales no lanzan dos ffmpeg).
+# Cada lock cuenta quién lo tiene o lo espera y solo se quita del dict con el último.
+_locks = {}   # clave -> [lock, usuarios]
+_locks_lock = threading.Lock()
+
+
+@contextmanager
+def _bloqueo(clave):
+    with _locks_lock:
+        entrada = _locks.setdefault(clave, [threading.Lock(), 0])
+        entrada[1] += 1
+    try:
+        with entrada[0]:
+            yield
+    finally:
+        with _locks_lock:
+            entrada[1] -= 1
+            if entrada[1] == 0:
+                del _locks[clave]
+
+
+def _version(ruta):
+    """Lo que identifica el contenido actual de un archivo (cambia si se reescribe)."""
+    st = os.stat(ruta)
+    return os.path.abspath(ruta), st.st_size, st.st_mtime_ns, st.st_ino
+
+
+def resolver(directorio, filename):
+    """Ruta absoluta de filename dentro de directorio (404 si se sale de él o no existe)."""
+    base = os.path.abspath(directorio)
+    ruta = os.path.abspath(os.path.join(base, filename))
+    if os.path.commonpath([base, ruta]) != base or not os.path.isfile(ruta):
+        abort(404)
+    return ruta
+
+
+def enviar(ruta, mimetype=None):
+    """
+    send_file con respuestas condicionales: Range → 206, If-None-Match /
+    If-Modified-Since → 304. La ETag sale de tamaño + mtime, así que cambia
+    si el archivo se reescribe (save_audio borra y crea uno nuevo).
+    """
+    respuesta = send_file(ruta, mimetype=mimetype, conditional=True, etag=True,
+                          last_modified=os.path.getmtime(ruta), max_age=MEDIA_MAX_AGE)
+    respuesta.headers["Accept-Ranges"] = "bytes"
+    return respuesta
+
+
+# =========================
+# PREVISUALIZACIONES
+# =========================
+def preview(ruta, formato="opus"):
+    """Devuelve la ruta de la versión comprimida de `ruta`, transcodificándola si hace falta."""
+    extension, _, argumentos = PREVIEW_FORMATS[formato]
+    clave = clave_cache("preview", *_version(ruta), formato, argumentos)
+
+    en_cache = preview_cache.obtener(clave)
+    if en_cache is not None:
+        return en_cache["audio"]
+
+    with _bloqueo(clave):
+        en_cache = preview_cache.obtener(clave)
+        if en_cache is not None:
+            return en_cache["audio"]
+
+        # Carpeta temporal dentro de la caché (".tmp-*" se limpia al arrancar si quedó a medias)
+        with tempfile.TemporaryDirectory(prefix=".tmp-", dir=PREVIEW_CACHE_DIR) as carpeta:
+            tmp = os.path.join(carpeta, f"preview{extension}")
+            command = ["ffmpeg", "-y", "-loglevel", "error", "-i", ruta, "-vn", *argumentos, tmp]
+            result = subprocess.run(command, capture_output=True, text=True)
+            if result.returncode != 0:
+                raise RuntimeError(
+                    f"ffmpeg no pudo generar la previsualización {formato} de {ruta}:\n{result.stderr}")
+            entrada = preview_cache.guardar(clave, {"audio": tmp}, extra={"origen": os.path.basename(ruta)})
+        return entrada["audio"]
+
+
+def servir(directorio, filename, formato=None):
+    """Sirve un archivo de audio, o su previsualización si se pide ?preview=opus|mp3."""
+    ruta = resolver(directorio, filename)
+    if not formato:
+        return enviar(ruta)
+    if formato not in PREVIEW_FORMATS:
+        return jsonify({"error": f"Formato de previsualización desconocido: {formato}"}), 400
+    try:
+        return enviar(preview(ruta, formato), mimetype=PREVIEW_FORMATS[formato][1])
+    except (RuntimeError, FileNotFoundError) as e:
+        # Sin ffmpeg (o con un archivo que no sabe leer) se sirve el original
+        print(f"⚠️ {e}; se sirve el archivo original")
+        return enviar(ruta)
+
+
+# =========================
+# PICOS DE FORMA DE ONDA
+# =========================
+def calcular_picos(ruta, n=PEAKS_DEFAULT, bloque_tramos=256):
+    """
+    Divide el audio en n tramos y devuelve el mínimo y el máximo de cada uno
+    (de todos los canales). Se lee por bloques de tramos completos, así la
+    memoria no depende de la duración.
+    """
+    lector = MappedAudio(ruta)
+    n = max(1, min(n, lector.frames or 1))
+    tramo = -(-lector.frames // n)  # techo
+    minimos, maximos = [], []
+    for inicio in range(0, lector.frames, tramo * bloque_tramos):
+        audio = lector.read(inicio, inicio + tramo * bloque_tramos)
+        k = -(-audio.shape[-1] // tramo)
+        audio = np.pad(audio, ((0, 0), (0, k * tramo - audio.shape[-1])))
+        audio = audio.reshape(audio.shape[0], k, tramo)
+        minimos.append(audio.min(axis=(0, 2)))
+        maximos.append(audio.max(axis=(0, 2)))
+    minimos = np.concatenate(minimos) if minimos else np.zeros(0)
+    maximos = np.concatenate(maximos) if maximos else np.zeros(0)
+    return {
+        "duracion": lector.duration,
+        "samplerate": lector.samplerate,
+        "canales": lector.channels,
+        "picos": np.round(np.stack([minimos, maximos], axis=1), 4).tolist(),
+    }
+
+
+def _picos_completos(ruta):
+    """
+    Picos de `ruta` con PEAKS_MAX tramos, desde la caché (o calculados y
+    guardados si no están). Es el único conjunto que se guarda: cualquier otro
+    n se obtiene reduciéndolo (ver reducir_picos).
+    """
+    clave = clave_cache("peaks", *_version(ruta), PEAKS_MAX)
+    en_cache = preview_cache.obtener(clave)
+    if en_cache is not None:
+        with open(en_cache["picos"], "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    datos = calcular_picos(ruta, PEAKS_MAX)
+    with tempfile.TemporaryDirectory(prefix=".tmp-", dir=PREVIEW_CACHE_DIR) as carpeta:
+        tmp = os.path.join(carpeta, "picos.json")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(datos, f)
+        preview_cache.guardar(clave, {"picos": tmp}, extra={"origen": os.path.basename(ruta)})
+    return datos
+
+
+def reducir_picos(datos, n):
+    """Agrupa los tramos de `datos` en n (mínimo de los mínimos y máximo de los máximos de cada grupo)."""
+    completos = np.asarray(datos["picos"], dtype=np.float32).reshape(-1, 2)
+    m = len(completos)
+    if n >= m:
+        return datos
+    inicios = np.arange(n) * m // n
+    picos_n = np.stack([np.minimum.reduceat(completos[:, 0], inicios),
+                        np.maximum.reduceat(completos[:, 1], inicios)], axis=1)
+    return {**datos, "picos": np.round(picos_n, 4).tolist()}
+
+
+def picos(ruta, n=PEAKS_DEFAULT):
+    """Picos de `ruta` en n tramos, a partir del conjunto completo guardado en caché."""
+    return reducir_picos(_picos_completos(ruta), n)
+
+
+def precalcular_picos(rutas):
+    """Calcula los picos de varios archivos (p. ej. los stems recién separados)."""
+    for ruta in rutas:
+        try:
+            _picos_completos(ruta)
+        except Exception as e:
+            print(f"⚠️ No se pudieron calcular los picos de {ruta}: {e}")
@@ -0,0 +1,330 @@
+# metricas.py
+# Métricas por etapa del pipeline (carga, separación, generación, mezcla, guardado)
+# y escritura de logs en segundo plano.
+# Las métricas se exponen en formato de texto de Prometheus (/metrics) y cada
+# ejecución de una etapa se registra como una línea JSON.
+
+import atexit
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+try:
+    import resource  # no existe en Windows
+except ImportError:
+    resource = None
+
+METRICS_LOG = os.getenv("METRICS_LOG", "metricas.jsonl")
+METRICS_RSS_INTERVAL = float(os.getenv("METRICS_RSS_INTERVAL", "0.05"))   # segundos entre muestras de RSS
+
+_PAGINA = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+class EscritorAsincrono:
+    """
+    Escribe líneas en un archivo desde un hilo de fondo.
+    El archivo se abre una sola vez y se vacía cada `intervalo` segundos;
+    quien llama a escribir() nunca se bloquea (si la cola se llena, se descarta).
+    """
+    def __init__(self, ruta: str, intervalo: float = 1.0, max_cola: int = 10000):
+        self.ruta = ruta
+        self.intervalo = intervalo
+        self.descartadas = 0
+        self._cola = queue.Queue(maxsize=max_cola)
+        self._parar = threading.Event()
+        self._hilo = threading.Thread(target=self._bucle, name=f"log-{os.path.basename(ruta)}", daemon=True)
+        self._hilo.start()
+        atexit.register(self.cerrar)
+
+    def escribir(self, linea: str):
+        try:
+            self._cola.put_nowait(linea)
+        except queue.Full:
+            self.descartadas += 1
+
+    def _bucle(self):
+        try:
+            archivo = open(self.ruta, "a", encoding="utf-8")
+        except Exception as e:
+            print(f"No se pudo abrir el log {self.ruta}: {e}")
+            return
+        with archivo:
+            while not (self._parar.is_set() and self._cola.empty()):
+                try:
+                    lineas = [self._cola.get(timeout=self.intervalo)]
+                except queue.Empty:
+                    continue
+                while True:
+                    try:
+                        lineas.append(self._cola.get_nowait())
+                    except queue.Empty:
+                        break
+                archivo.write("\n".join(lineas) + "\n")
+                archivo.flush()
+
+    def cerrar(self, timeout: float = 5.0):
+        self._parar.set()
+        self._hilo.join(timeout)
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """
+    Máximo de memoria residente del proceso desde que arrancó (ru_maxrss), no el
+    de una etapa concreta: solo crece. None si la plataforma no lo ofrece.
+    """
+    if resource is None:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux lo da en KB, macOS en bytes
+    return pico if sys.platform == "darwin" else pico * 1024
+
+
+def rss_bytes() -> Optional[int]:
+    """Memoria residente actual del proceso (de /proc/self/statm; None fuera de Linux)."""
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * _PAGINA
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class MuestreadorRSS:
+    """
+    Pico de memoria residente de cada etapa: mientras haya etapas en marcha,
+    un hilo lee la RSS cada `intervalo` segundos y la anota en todas ellas
+    (además de una muestra al empezar y otra al terminar).
+    La RSS es la del proceso: si dos etapas se solapan, las dos ven la suma.
+    """
+    def __init__(self, intervalo: float = METRICS_RSS_INTERVAL):
+        self.intervalo = intervalo
+        self._lock = threading.Lock()
+        self._activas = set()
+        self._despertar = threading.Event()
+        self._hilo = None
+
+    @staticmethod
+    def _anotar(medicion, muestra):
+        if muestra is not None and (medicion.peak_rss is None or muestra > medicion.peak_rss):
+            medicion.peak_rss = muestra
+
+    def empezar(self, medicion):
+        muestra = rss_bytes()
+        with self._lock:
+            self._anotar(medicion, muestra)
+            if self._activas:
+                medicion.solapada = True
+                for otra in self._activas:
+                    otra.solapada = True
+            self._activas.add(medicion)
+            if self._hilo is None:
+                self._hilo = threading.Thread(target=self._bucle, name="metricas-rss", daemon=True)
+                self._hilo.start()
+        self._despertar.set()
+
+    def terminar(self, medicion):
+        muestra = rss_bytes()
+        with self._lock:
+            self._activas.discard(medicion)
+            self._anotar(medicion, muestra)
+
+    @contextmanager
+    def midiendo(self, nombre: str = "bloque"):
+        """Pico de RSS de un bloque cualquiera (p. ej. un caso del benchmark): `.peak_rss` al salir."""
+        medicion = MedicionEtapa(nombre)
+        self.empezar(medicion)
+        try:
+            yield medicion
+        finally:
+            self.terminar(medicion)
+
+    def _bucle(self):
+        while True:
+            self._despertar.wait()
+            time.sleep(self.intervalo)
+            muestra = rss_bytes()
+            with self._lock:
+                if not self._activas:
+                    self._despertar.clear()
+                    continue
+                for medicion in self._activas:
+                    self._anotar(medicion, muestra)
+
+
+class MedicionEtapa:
+    """Resultado de una ejecución de etapa. audio_seg puede fijarse dentro del bloque `with`."""
+    def __init__(self, etapa: str, audio_seg: Optional[float] = None):
+        self.etapa = etapa
+        self.audio_seg = audio_seg
+        self.wall_seg = 0.0
+        self.cpu_seg = 0.0
+        self.peak_rss = None        # pico de RSS durante la etapa (MuestreadorRSS)
+        self.process_max_rss = None  # máximo del proceso desde que arrancó, ver peak_rss_bytes()
+        self.solapada = False        # otra etapa corrió a la vez (cpu_seg y peak_rss la incluyen)
+        self.error = None
+
+    @property
+    def rtf(self) -> Optional[float]:
+        """Real-time factor: segundos de cómputo por segundo de audio (<1 = más rápido que tiempo real)."""
+        if not self.audio_seg:
+            return None
+        return self.wall_seg / self.audio_seg
+
+    def to_dict(self) -> dict:
+        return {
+            "ts": time.time(),
+            "etapa": self.etapa,
+            "wall_seg": round(self.wall_seg, 4),
+            "cpu_seg": round(self.cpu_seg, 4),
+            "audio_seg": round(self.audio_seg, 3) if self.audio_seg else None,
+            "rtf": round(self.rtf, 4) if self.rtf is not None else None,
+            "peak_rss_bytes": self.peak_rss,
+            "process_max_rss_bytes": self.process_max_rss,
+            "solapada": self.solapada,
+            "error": self.error,
+        }
+
+
+class Metricas:
+    """
+    Acumula métricas por etapa de forma segura entre hilos.
+    Etapas del pipeline: load, separation, generation, mix, save.
+    """
+
+    def __init__(self, log_json: Optional[EscritorAsincrono] = None):
+        self._lock = threading.Lock()
+        self._log_json = log_json
+        self._etapas: Dict[str, dict] = {}
+        self._rss = muestreador_rss
+
+    def _acumulado(self, etapa: str) -> dict:
+        if etapa not in self._etapas:
+            self._etapas[etapa] = {
+                "runs": 0, "errors": 0, "wall": 0.0, "cpu": 0.0, "audio": 0.0,
+                "last_wall": 0.0, "last_rtf": None, "last_peak_rss": None,
+            }
+        return self._etapas[etapa]
+
+    @contextmanager
+    def etapa(self, nombre: str, audio_seg: Optional[float] = None):
+        """
+        Mide un bloque de código como una etapa:
+
+            with metricas.etapa("mix") as m:
+                ...
+                m.audio_seg = duracion
+
+        El tiempo de CPU es el de todo el proceso durante la etapa: incluye los
+        hilos intra-op de torch (que time.thread_time() no vería), pero también
+        el de cualquier etapa simultánea (separación ∥ generación, los `save`
+        de stem_writer, lote con --jobs > 1); esas mediciones salen con solapada=True.
+        El pico de memoria se muestrea durante la etapa (ver MuestreadorRSS).
+        """
+        medicion = MedicionEtapa(nombre, audio_seg)
+        self._rss.empezar(medicion)
+        wall0, cpu0 = time.perf_counter(), time.process_time()
+        try:
+            yield medicion
+        except Exception as e:
+            medicion.error = str(e)
+            raise
+        finally:
+            medicion.wall_seg = time.perf_counter() - wall0
+            medicion.cpu_seg = time.process_time() - cpu0
+            self._rss.terminar(medicion)
+            medicion.process_max_rss = peak_rss_bytes()
+            self.registrar(medicion)
+
+    def registrar(self, medicion: MedicionEtapa):
+        with self._lock:
+            acc = self._acumulado(medicion.etapa)
+            acc["runs"] += 1
+            acc["errors"] += 1 if medicion.error else 0
+            acc["wall"] += medicion.wall_seg
+            acc["cpu"] += medicion.cpu_seg
+            acc["audio"] += medicion.audio_seg or 0.0
+            acc["last_wall"] = medicion.wall_seg
+            if medicion.peak_rss is not None:
+                acc["last_peak_rss"] = medicion.peak_rss
+            if medicion.rtf is not None:
+                acc["last_rtf"] = medicion.rtf
+        if self._log_json is not None:
+            self._log_json.escribir(json.dumps(medicion.to_dict(), ensure_ascii=False))
+
+    def rtf_medio(self, etapa: str) -> Optional[float]:
+        """RTF medio de la etapa (ponderado por segundos de audio) o None si aún no hay datos."""
+        with self._lock:
+            acc = self._etapas.get(etapa)
+            if not acc or not acc["audio"]:
+                return None
+            return acc["wall"] / acc["audio"]
+
+    def resumen(self) -> dict:
+        with self._lock:
+            return {etapa: dict(acc) for etapa, acc in self._etapas.items()}
+
+    def prometheus(self) -> str:
+        """Texto en formato de exposición de Prometheus."""
+        resumen = self.resumen()
+        series = [
+            ("remix_stage_runs_total", "counter", "Ejecuciones de la etapa", "runs"),
+            ("remix_stage_errors_total", "counter", "Ejecuciones fallidas de la etapa", "errors"),
+            ("remix_stage_wall_seconds_total", "counter", "Tiempo real acumulado", "wall"),
+            ("remix_stage_cpu_seconds_total", "counter",
+             "Tiempo de CPU de todo el proceso durante la etapa (incluye etapas simultáneas)", "cpu"),
+            ("remix_stage_audio_seconds_total", "counter", "Segundos de audio procesados", "audio"),
+            ("remix_stage_last_wall_seconds", "gauge", "Duración de la última ejecución", "last_wall"),
+            ("remix_stage_last_rtf", "gauge", "Real-time factor de la última ejecución", "last_rtf"),
+            ("remix_stage_last_peak_rss_bytes", "gauge", "Pico de memoria residente durante la última ejecución",
+             "last_peak_rss"),
+        ]
+        lineas = []
+        for nombre, tipo, ayuda, campo in series:
+            lineas.append(f"# HELP {nombre} {ayuda}")
+            lineas.append(f"# TYPE {nombre} {tipo}")
+            for etapa, acc in sorted(resumen.items()):
+                if acc[campo] is not None:
+                    lineas.append(f'{nombre}{{stage="{etapa}"}} {acc[campo]:.6g}')
+        pico = peak_rss_bytes()
+        if pico is not None:
+            lineas += [
+                "# HELP remix_process_max_rss_bytes Máximo de memoria residente desde que arrancó el proceso (ru_maxrss)",
+                "# TYPE remix_process_max_rss_bytes gauge",
+                f"remix_process_max_rss_bytes {pico}",
+            ]
+        return "\n".join(lineas) + "\n"
+
+
+def prometheus_gauges(prefijo: str, muestras: list, ayuda: str) -> str:
+    """
+    Gauges de Prometheus a partir de varias muestras etiquetadas (p. ej. stats de cada caché):
+
+        prometheus_gauges("remix_cache", [({"cache": "stems"}, stats_stems), ...], "Caché")
+
+    Cada campo numérico se emite una sola vez con su HELP/TYPE seguido de las
+    muestras de todas las etiquetas, como pide el formato de exposición.
+    """
+    series: Dict[str, list] = {}
+    for etiquetas, valores in muestras:
+        etiquetas_txt = ""
+        if etiquetas:
+            etiquetas_txt = "{" + ",".join(f'{k}="{v}"' for k, v in etiquetas.items()) + "}"
+        for clave, valor in valores.items():
+            if isinstance(valor, (int, float)) and not isinstance(valor, bool):
+                series.setdefault(clave, []).append(f"{prefijo}_{clave}{etiquetas_txt} {valor}")
+    lineas = []
+    for clave, valores in series.items():
+        nombre = f"{prefijo}_{clave}"
+        lineas.append(f"# HELP {nombre} {ayuda}: {clave}")
+        lineas.append(f"# TYPE {nombre} gauge")
+        lineas += valores
+    return "\n".join(lineas) + "\n" if lineas else ""
+
+
+# Instancias globales usadas por procesamiento_audio, app y benchmark
+muestreador_rss = MuestreadorRSS()
+metricas = Metricas(log_json=EscritorAsincrono(METRICS_LOG))
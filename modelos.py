@@ -1,44 +1,179 @@
 # modelos.py
-import torch
-from demucs.pretrained import get_model
-from transformers import AutoProcessor, MusicgenForConditionalGeneration
+import contextlib
+import os
+import threading
 
 MODEL_DEMUCS = "htdemucs"
 MODEL_MUSICGEN = "facebook/musicgen-small"
-DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+
+# Precisión de inferencia en CPU:
+#   fp32 (por defecto), int8 (cuantización dinámica de capas Linear/LSTM)
+#   o bf16 (autocast, solo si la CPU lo soporta de forma nativa)
+PRECISIONES = ("fp32", "int8", "bf16")
+MODEL_PRECISION = os.getenv("MODEL_PRECISION", "fp32")
+if MODEL_PRECISION not in PRECISIONES:
+    raise ValueError(f"MODEL_PRECISION debe ser uno de {PRECISIONES}: {MODEL_PRECISION}")
 
 # -------------------------------------------------------
 # CARGA DIFERIDA (lazy loading)
 # Solo se cargan cuando se piden por primera vez.
 # Después quedan en memoria.
+# torch, demucs y transformers tampoco se importan hasta entonces,
+# así importar este módulo (o app.py) es instantáneo.
 # -------------------------------------------------------
 
-_demucs_model = None
+_device = None
+_demucs_models = {}  # una instancia por variante (htdemucs, htdemucs_ft...)
 _musicgen_processor = None
 _musicgen_model = None
 
+# Un lock por modelo: dos peticiones simultáneas no cargan el mismo modelo dos veces
+_demucs_lock = threading.Lock()
+_musicgen_lock = threading.Lock()
+
+_precarga_hilo = None
+_precarga_error = None
+
+
+def get_device():
+    """Devuelve "cuda" o "cpu" (importa torch la primera vez)."""
+    global _device
+    if _device is None:
+        import torch
+        _device = "cuda" if torch.cuda.is_available() else "cpu"
+        torch.set_default_device(_device)
+    return _device
+
+
+def cargar_demucs(precision=None, nombre=MODEL_DEMUCS):
+    """Carga una instancia nueva de Demucs (sin caché) con la precisión pedida."""
+    from demucs.pretrained import get_model
+    model = get_model(nombre).to(get_device()).eval()
+    return reducir_precision(model, precision)
+
+
+def cargar_musicgen(precision=None):
+    """Carga una instancia nueva de MusicGen (sin caché): (processor, model)."""
+    from transformers import AutoProcessor, MusicgenForConditionalGeneration
+    processor = AutoProcessor.from_pretrained(
+        MODEL_MUSICGEN,
+        force_download=False,      #No fuerza descargas cada vez
+        local_files_only=False     # Usa primero cache local
+    )
+    model = MusicgenForConditionalGeneration.from_pretrained(
+        MODEL_MUSICGEN,
+        force_download=False,
+        local_files_only=False
+    ).to(get_device()).eval()
+    return processor, reducir_precision(model, precision)
 
-def get_demucs_model():
-    global _demucs_model
-    if _demucs_model is None:
-        print(" Cargando modelo Demucs (solo la primera vez)...")
-        _demucs_model = get_model(MODEL_DEMUCS).to(DEVICE).eval()
-    return _demucs_model
+
+def get_demucs_model(nombre=MODEL_DEMUCS):
+    model = _demucs_models.get(nombre)
+    if model is None:
+        with _demucs_lock:
+            model = _demucs_models.get(nombre)
+            if model is None:
+                print(f" Cargando modelo Demucs {nombre} (solo la primera vez)...")
+                model = _demucs_models[nombre] = cargar_demucs(nombre=nombre)
+    return model
 
 
 def get_musicgen():
     global _musicgen_processor, _musicgen_model
 
     if _musicgen_processor is None or _musicgen_model is None:
-        print("Cargando modelo MusicGen (solo la primera vez)...")
-        _musicgen_processor = AutoProcessor.from_pretrained(
-            MODEL_MUSICGEN,
-            force_download=False,      #No fuerza descargas cada vez
-            local_files_only=False     # Usa primero cache local
-        )
-        _musicgen_model = MusicgenForConditionalGeneration.from_pretrained(
-            MODEL_MUSICGEN,
-            force_download=False,
-            local_files_only=False
-        ).to(DEVICE)
-    return _musicgen_processor, _musicgen_model
\ No newline at end of file
+        with _musicgen_lock:
+            if _musicgen_processor is None or _musicgen_model is None:
+                print("Cargando modelo MusicGen (solo la primera vez)...")
+                processor, model = cargar_musicgen()
+                _musicgen_model = model
+                _musicgen_processor = processor
+    return _musicgen_processor, _musicgen_model
+
+
+# -------------------------------------------------------
+# PRECISIÓN REDUCIDA (solo CPU)
+# -------------------------------------------------------
+
+def precision_efectiva(precision=None) -> str:
+    """
+    La precisión que se usará de verdad: int8 y bf16 solo aplican en CPU,
+    y bf16 solo si la CPU tiene instrucciones bf16 (si no, sería más lento).
+    """
+    precision = precision or MODEL_PRECISION
+    if precision == "fp32" or get_device() != "cpu":
+        return "fp32"
+    if precision == "bf16":
+        import torch
+        if not getattr(torch.cpu, "_is_avx512_bf16_supported", lambda: False)():
+            return "fp32"
+    return precision
+
+
+def reducir_precision(model, precision=None):
+    """
+    Aplica la precisión pedida a un modelo ya cargado.
+    int8: devuelve una copia con las capas Linear/LSTM cuantizadas dinámicamente
+    (las convoluciones siguen en fp32: la cuantización dinámica no las cubre).
+    bf16: el modelo no cambia; se usa autocast en contexto_inferencia().
+    """
+    pedida, precision = precision or MODEL_PRECISION, precision_efectiva(precision)
+    if pedida != precision:
+        print(f"⚠️ Precisión {pedida} no disponible en {get_device()}, se usa {precision}")
+    if precision != "int8":
+        return model
+
+    import torch
+    from torch import nn
+    print("Cuantizando capas Linear/LSTM a int8...")
+    return torch.ao.quantization.quantize_dynamic(model, {nn.Linear, nn.LSTM}, dtype=torch.qint8)
+
+
+def contexto_inferencia(precision=None):
+    """Contexto para las llamadas al modelo: autocast a bf16 si corresponde."""
+    if precision_efectiva(precision) == "bf16":
+        import torch
+        return torch.autocast("cpu", dtype=torch.bfloat16)
+    return contextlib.nullcontext()
+
+
+# -------------------------------------------------------
+# PRECARGA EN SEGUNDO PLANO Y ESTADO (para /ready)
+# -------------------------------------------------------
+
+def precargar_en_segundo_plano():
+    """Carga ambos modelos en un hilo aparte para que la primera petición no espere."""
+    global _precarga_hilo
+    if _precarga_hilo is not None:
+        return _precarga_hilo
+
+    def _precargar():
+        global _precarga_error
+        try:
+            get_demucs_model()
+            get_musicgen()
+            print("Modelos precargados")
+        except Exception as e:
+            _precarga_error = str(e)
+            print(f"❌ Error al precargar modelos: {e}")
+
+    _precarga_hilo = threading.Thread(target=_precargar, name="precarga-modelos", daemon=True)
+    _precarga_hilo.start()
+    return _precarga_hilo
+
+
+def estado_modelos() -> dict:
+    """Qué modelos están ya en memoria y si hay una precarga en curso."""
+    return {
+        "demucs": MODEL_DEMUCS in _demucs_models,
+        "demucs_variantes": sorted(_demucs_models),
+        "musicgen": _musicgen_model is not None,
+        "precision": MODEL_PRECISION,
+        "precargando": _precarga_hilo is not None and _precarga_hilo.is_alive(),
+        "error": _precarga_error,
+    }
+
+
+def modelos_listos() -> bool:
+    return MODEL_DEMUCS in _demucs_models and _musicgen_model is not None
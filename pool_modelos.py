@@ -0,0 +1,155 @@
+# pool_modelos.py
+# Pool de procesos para servir los modelos.
+# Cada proceso carga sus propios modelos (de modelos.py) una sola vez y los
+# mantiene calientes; las peticiones de app.py se reparten entre ellos, así
+# una separación con Demucs no bloquea el intérprete del servidor y se usan
+# todos los núcleos de la máquina.
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional
+
+TIPOS = ("demucs", "musicgen")
+
+
+def es_proceso_principal() -> bool:
+    """False dentro de un worker (con spawn, los hijos re-importan el módulo principal)."""
+    return multiprocessing.parent_process() is None
+
+
+# -------------------------------------------------------
+# Código que corre DENTRO de cada worker
+# -------------------------------------------------------
+
+def _inicializar_worker(tipo: str, hilos_torch: int):
+    """Limita los hilos de torch del proceso y carga su modelo una sola vez."""
+    import torch
+    import modelos
+
+    torch.set_num_threads(hilos_torch)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # ya fijado en este proceso
+
+    print(f"[worker {os.getpid()}] {tipo}: {hilos_torch} hilos de torch, cargando modelo...")
+    if tipo == "demucs":
+        modelos.get_demucs_model()
+    else:
+        modelos.get_musicgen()
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+def _separar(input_audio, out_dir, kwargs):
+    from procesamiento_audio import separate_stems
+    return separate_stems(input_audio, out_dir, **kwargs)
+
+
+def _generar(style_prompt, out_path, duration, seed):
+    from procesamiento_audio import MusicGenGenerator
+    return MusicGenGenerator().process(style_prompt, out_path, duration, seed=seed)
+
+
+# -------------------------------------------------------
+# Lado del servidor
+# -------------------------------------------------------
+
+class PoolModelos:
+    """
+    Un ProcessPoolExecutor por tipo de modelo.
+
+    - workers: {"demucs": n, "musicgen": m}; un tipo con 0 workers no tiene pool.
+    - hilos_torch: hilos intra-op por worker (por defecto núcleos / total de workers).
+
+    Un tipo está listo en cuanto cualquier tarea suya (el ping de calentar() o
+    una separación/generación) termina bien: su worker ya cargó el modelo.
+    """
+    def __init__(self, workers: Dict[str, int], hilos_torch: Optional[int] = None):
+        total = sum(workers.values())
+        if total == 0:
+            raise ValueError("El pool necesita al menos un worker")
+        self.workers = {tipo: workers.get(tipo, 0) for tipo in TIPOS}
+        self.hilos_torch = hilos_torch or max(1, (os.cpu_count() or 1) // total)
+        self._lock = threading.Lock()
+        self._listos = set()
+        self._errores = []
+
+        ctx = multiprocessing.get_context("spawn")  # fork + torch/CUDA no es seguro
+        self._pools = {
+            tipo: ProcessPoolExecutor(
+                max_workers=n,
+                mp_context=ctx,
+                initializer=_inicializar_worker,
+                initargs=(tipo, self.hilos_torch),
+            )
+            for tipo, n in self.workers.items() if n > 0
+        }
+
+    def tiene(self, tipo: str) -> bool:
+        return tipo in self._pools
+
+    def _enviar(self, tipo, funcion, *args):
+        futuro = self._pools[tipo].submit(funcion, *args)
+        futuro.add_done_callback(lambda f: self._terminada(tipo, funcion, f))
+        return futuro
+
+    def _terminada(self, tipo, funcion, futuro):
+        error = futuro.exception()
+        with self._lock:
+            if error is None:
+                self._listos.add(tipo)
+            elif funcion is _ping:
+                # Un ping solo falla si el worker no pudo cargar el modelo
+                self._errores.append(f"{tipo}: {error}")
+
+    def calentar(self):
+        """Arranca todos los workers ya (cada uno carga su modelo en el initializer)."""
+        for tipo in self._pools:
+            for _ in range(self.workers[tipo]):
+                self._enviar(tipo, _ping)
+
+    def listo(self) -> bool:
+        with self._lock:
+            return self._listos >= set(self._pools)
+
+    def estado(self) -> dict:
+        return {
+            "workers": self.workers,
+            "hilos_torch": self.hilos_torch,
+            "listo": self.listo(),
+            "errores": list(self._errores),
+        }
+
+    def separar(self, input_audio, out_dir, **kwargs) -> dict:
+        """separate_stems() en un worker de Demucs (bloquea hasta que termine)."""
+        return self._enviar("demucs", _separar, input_audio, out_dir, kwargs).result()
+
+    def generar(self, style_prompt, out_path, duration=30, seed=None) -> str:
+        """MusicGenGenerator.process() en un worker de MusicGen (bloquea hasta que termine)."""
+        return self._enviar("musicgen", _generar, style_prompt, out_path, duration, seed).result()
+
+    def apagar(self, esperar: bool = True):
+        for pool in self._pools.values():
+            pool.shutdown(wait=esperar)
+
+
+def crear_pool_desde_entorno() -> Optional[PoolModelos]:
+    """
+    Crea el pool según POOL_DEMUCS_WORKERS / POOL_MUSICGEN_WORKERS / POOL_TORCH_THREADS.
+    Devuelve None si no se pidió ningún worker o si estamos dentro de un worker.
+    """
+    if not es_proceso_principal():
+        return None
+    workers = {
+        "demucs": int(os.getenv("POOL_DEMUCS_WORKERS", "0")),
+        "musicgen": int(os.getenv("POOL_MUSICGEN_WORKERS", "0")),
+    }
+    if sum(workers.values()) == 0:
+        return None
+    hilos = int(os.getenv("POOL_TORCH_THREADS", "0")) or None
+    return PoolModelos(workers, hilos_torch=hilos)
@@ -1,15 +1,30 @@
 import os
+import hashlib
+import math
+import queue
+import re
+import shutil
+import struct
 import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from contextlib import ExitStack, contextmanager
 import argparse
 from pathlib import Path
 import numpy as np
-import torch
-import librosa
 import soundfile as sf
 from abc import ABC, abstractmethod
 
-from demucs.apply import apply_model
-from modelos import get_demucs_model, get_musicgen
+# torch y demucs se importan dentro de las funciones que los usan:
+# importar este módulo no debe cargar nada pesado (ver modelos.py)
+from modelos import get_demucs_model, get_musicgen, get_device, contexto_inferencia, precision_efectiva
+from cache_audio import CacheAudio, clave_cache, enlazar_o_copiar, restaurar
+from lector_audio import MappedAudio, mappable, read_audio, resample, resample_blocks
+from metricas import EscritorAsincrono, metricas
 
 # =========================
 # GLOBAL SETTINGS
@@ -17,55 +32,558 @@ from modelos import get_demucs_model, get_musicgen
 SAMPLE_RATE = 32000
 VOCAL_GAIN = 0.85
 ACC_GAIN = 0.65
+MIX_BLOCK = 1 << 18  # muestras por bloque al mezclar (memoria acotada)
 MODEL_DEMUCS = "htdemucs"
+DEMUCS_SAMPLERATE = 44100  # frecuencia nativa de htdemucs (sin cargar el modelo)
 MODEL_MUSICGEN = "facebook/musicgen-small"
 
-DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
-torch.set_default_device(DEVICE)
-
-# CARGAR MODELOS UNA SOLA VEZ (al importar el módulo)
-print("Cargando modelos de IA...")
-demucs_model = get_demucs_model()
-musicgen_processor, musicgen_model = get_musicgen()
-print("Modelos cargados exitosamente")
+# Motor de separación para separate_stems():
+#   "inprocess" -> usa el modelo Demucs ya cargado (rápido, sin subprocess)
+#   "cli"       -> lanza el comando `demucs` (más lento, se mantiene como respaldo)
+DEMUCS_ENGINE = os.getenv("DEMUCS_ENGINE", "inprocess")
+DEMUCS_OVERLAP = 0.25
+DEMUCS_SHIFTS = 1
+
+# Perfiles de calidad de la separación: variante del modelo, longitud de
+# segmento (None = la del modelo), solapamiento entre segmentos y número de
+# desplazamientos aleatorios (shifts=0 es una sola pasada, sin desplazar).
+# htdemucs rellena cada segmento hasta su segmento de entrenamiento (7.8 s,
+# use_train_segment), así que un segmento más corto no ahorra nada: cuesta lo
+# mismo por trozo y hay más trozos. Lo que abarata es solapar menos.
+# shifts=0 y shifts=1 cuestan lo mismo (una pasada); cada shift extra, otra.
+#   fast     -> overlap 0.1: ~1.11 s de modelo por segundo de audio frente a ~1.33
+#               de balanced (ver demucs_forward_seconds y el benchmark --profiles)
+#   balanced -> lo que hace el CLI de Demucs por defecto
+#   best     -> htdemucs_ft (4 modelos afinados), ~4-8 veces más lento
+DEMUCS_PROFILES = {
+    "fast": {"model": "htdemucs", "segment": None, "overlap": 0.1, "shifts": 0},
+    "balanced": {"model": MODEL_DEMUCS, "segment": None, "overlap": DEMUCS_OVERLAP, "shifts": DEMUCS_SHIFTS},
+    "best": {"model": "htdemucs_ft", "segment": None, "overlap": 0.5, "shifts": 2},
+}
+DEMUCS_PROFILE = os.getenv("DEMUCS_PROFILE", "balanced")
+
+# Qué stems se escriben:
+#   "all"    -> los cuatro del modelo (drums, bass, other, vocals)
+#   "vocals" -> solo vocals
+#   "two"    -> vocals + no_vocals (suma del resto), como `demucs --two-stems vocals`
+STEM_MODES = ("all", "vocals", "two")
+
+# Separación por ventanas (streaming) para archivos largos: la memoria pico
+# depende del tamaño de ventana, no de la duración de la canción
+DEMUCS_STREAM_THRESHOLD = float(os.getenv("DEMUCS_STREAM_THRESHOLD", "600"))  # segundos
+DEMUCS_STREAM_WINDOW = float(os.getenv("DEMUCS_STREAM_WINDOW", "30"))        # segundos
+DEMUCS_STREAM_OVERLAP = 2.0                                                   # segundos (fundido)
+STREAM_BLOCK = 65536
+
+# Formato de los stems: nombre → (extensión, formato, subtipo de soundfile).
+# Se codifican en paralelo en un pool de STEM_WRITER_THREADS hilos.
+STEM_FORMATS = {
+    "pcm16": (".wav", "WAV", "PCM_16"),
+    "pcm24": (".wav", "WAV", "PCM_24"),
+    "float32": (".wav", "WAV", "FLOAT"),
+    "flac": (".flac", "FLAC", "PCM_24"),
+    "opus": (".ogg", "OGG", "OPUS"),
+}
+STEM_FORMAT = os.getenv("STEM_FORMAT", "pcm16")
+STEM_WRITER_THREADS = int(os.getenv("STEM_WRITER_THREADS", "4"))
+STEM_EXTENSIONS = tuple(sorted({ext for ext, _, _ in STEM_FORMATS.values()}))
+OPUS_SAMPLERATE = 48000  # libsndfile solo codifica Opus a 8, 12, 16, 24 o 48 kHz
+
+# Silencios: antes de separar se mide el RMS por tramas y solo pasan por Demucs
+# los tramos con sonido (intros, finales y huecos largos quedan a cero). Los
+# stems cuyo RMS no supera STEM_SILENCE_DB en ninguna trama no se escriben.
+# SILENCE_SKIP=0 desactiva las dos cosas.
+SILENCE_SKIP = os.getenv("SILENCE_SKIP", "1") == "1"
+SILENCE_THRESHOLD_DB = float(os.getenv("SILENCE_THRESHOLD_DB", "-60"))  # dBFS por trama
+SILENCE_MIN_DURATION = float(os.getenv("SILENCE_MIN_DURATION", "1.0"))  # segundos; huecos más cortos se separan
+SILENCE_PADDING = 0.25                                                  # segundos de margen alrededor del sonido
+SILENCE_FRAME = 1024                                                    # muestras por trama
+STEM_SILENCE_DB = float(os.getenv("STEM_SILENCE_DB", "-60"))            # dBFS (pico del RMS por trama)
+
+# Caché de stems: la misma canción (mismo audio decodificado) no se separa dos veces
+STEM_CACHE_ENABLED = os.getenv("STEM_CACHE_ENABLED", "1") == "1"
+STEM_CACHE_DIR = os.getenv("STEM_CACHE_DIR", os.path.join("cache", "stems"))
+STEM_CACHE_MAX_BYTES = int(os.getenv("STEM_CACHE_MAX_BYTES", str(5 * 1024 ** 3)))
+
+# Audio decodificado: cada archivo subido (mp3, flac...) se decodifica una sola
+# vez a un WAV float32 que después se lee por memmap; cada frecuencia que se pide
+# (44.1 kHz para Demucs, 32 kHz para MusicGen...) se remuestrea una sola vez
+DECODED_CACHE_DIR = os.getenv("DECODED_CACHE_DIR", os.path.join("cache", "decoded"))
+DECODED_CACHE_MAX_BYTES = int(os.getenv("DECODED_CACHE_MAX_BYTES", str(5 * 1024 ** 3)))
+
+# MusicGen: con semilla la generación es determinista y se guarda en caché
+# (modelo, prompt, duración, semilla, parámetros). Sin semilla no se cachea.
+MUSICGEN_SEED = int(os.environ["MUSICGEN_SEED"]) if os.getenv("MUSICGEN_SEED") else None
+MUSICGEN_GEN_PARAMS = {"do_sample": True, "guidance_scale": 3.0}
+MUSICGEN_CACHE_DIR = os.getenv("MUSICGEN_CACHE_DIR", os.path.join("cache", "musicgen"))
+MUSICGEN_CACHE_MAX_BYTES = int(os.getenv("MUSICGEN_CACHE_MAX_BYTES", str(1024 ** 3)))
+
+# Micro-batching: peticiones concurrentes de MusicGen que llegan dentro de la
+# ventana se agrupan en una sola llamada a generate()
+MUSICGEN_BATCHING = os.getenv("MUSICGEN_BATCHING", "1") == "1"
+MUSICGEN_BATCH_WINDOW = float(os.getenv("MUSICGEN_BATCH_WINDOW", "0.05"))  # segundos
+MUSICGEN_MAX_BATCH = int(os.getenv("MUSICGEN_MAX_BATCH", "8"))
+
+# Acompañamientos más largos que una ventana de MusicGen (~30 s, lo que vio en
+# entrenamiento) se generan por continuación: cada ventana nueva recibe como
+# prompt de audio los últimos MUSICGEN_CONTEXT segundos de la anterior, genera
+# solo los segundos que faltan y se funde con ella en MUSICGEN_CROSSFADE segundos
+MUSICGEN_WINDOW = float(os.getenv("MUSICGEN_WINDOW", "30"))     # segundos por llamada a generate()
+MUSICGEN_CONTEXT = float(os.getenv("MUSICGEN_CONTEXT", "10"))   # segundos de prompt de audio
+MUSICGEN_CROSSFADE = 0.5                                        # segundos de fundido entre ventanas
+MUSICGEN_MAX_DURATION = float(os.getenv("MUSICGEN_MAX_DURATION", "600"))
+
+# Generación en streaming: cada cuántos segundos de tokens se decodifica y se
+# entrega un bloque de audio (menos = antes suena, más decodificaciones)
+MUSICGEN_STREAM_CHUNK = float(os.getenv("MUSICGEN_STREAM_CHUNK", "1.0"))
+
+# Los modelos NO se cargan al importar: get_demucs_model() / get_musicgen()
+# los cargan la primera vez que se usan y después quedan en memoria.
+
+stem_cache = CacheAudio(STEM_CACHE_DIR, STEM_CACHE_MAX_BYTES, nombre="stems") if STEM_CACHE_ENABLED else None
+musicgen_cache = CacheAudio(MUSICGEN_CACHE_DIR, MUSICGEN_CACHE_MAX_BYTES, nombre="musicgen")
+decoded_cache = CacheAudio(DECODED_CACHE_DIR, DECODED_CACHE_MAX_BYTES, nombre="decoded")
+
+# Codificación de stems fuera del hilo que separa (los hilos se crean al primer uso)
+stem_writer = ThreadPoolExecutor(max_workers=STEM_WRITER_THREADS, thread_name_prefix="stems")
+
+# generate() muestrea del RNG global de torch: ninguna generación (con semilla
+# o sin ella) puede solaparse con una que tiene semilla, o la consumiría a
+# mitad. Se toma alrededor de cada generate(); es reentrante para que una
+# generación con semilla lo retenga desde manual_seed hasta su última ventana.
+_musicgen_rng_lock = threading.RLock()
+
+# El log se escribe desde un hilo de fondo (el archivo se abre una sola vez)
+_log_writer = EscritorAsincrono("remix.log")
 
 
 # =========================
 # UTILS
 # =========================
 def log(msg: str):
-    """Print to console and write to remix.log"""
+    """Print to console and write to remix.log (buffered, non-blocking)"""
     print(msg, flush=True)
-    try:
-        with open("remix.log", "a", encoding="utf-8") as f:
-            f.write(msg + "\n")
-    except Exception as e:
-        print(f"No se pudo escribir en log: {e}")
+    _log_writer.escribir(msg)
 
 
 def ensure_dir(path):
     Path(path).mkdir(parents=True, exist_ok=True)
 
 
-def load_audio(path, sr=SAMPLE_RATE, mono=False):
-    """Carga un archivo de audio con librosa"""
+def audio_duration(path):
+    """Duración en segundos sin decodificar el archivo completo"""
+    try:
+        return sf.info(path).duration
+    except Exception:
+        # soundfile no lee el formato: se decodifica (una vez) y se mide esa versión
+        with decoded(path) as ruta:
+            return MappedAudio(ruta).duration
+
+
+def fix_length(audio, size):
+    """Recorta o rellena con ceros el último eje hasta `size` muestras"""
+    if audio.shape[-1] >= size:
+        return audio[..., :size]
+    pad = [(0, 0)] * (audio.ndim - 1) + [(0, size - audio.shape[-1])]
+    return np.pad(audio, pad)
+
+
+def frame_rms_db(audio, frame=SILENCE_FRAME):
+    """
+    RMS en dBFS por tramas de `frame` muestras, sumando la energía de todos
+    los canales: (..., canales, muestras) → (..., tramas). Sin copiar el audio.
+    """
+    channels, length = audio.shape[-2], audio.shape[-1]
+    full = length // frame * frame
+    blocks = audio[..., :full].reshape(*audio.shape[:-1], full // frame, frame)
+    power = np.einsum("...cnf,...cnf->...n", blocks, blocks) / (channels * frame)
+    if full < length:
+        rest = audio[..., full:]
+        tail = np.einsum("...cf,...cf->...", rest, rest) / (channels * rest.shape[-1])
+        power = np.concatenate([power, tail[..., None]], axis=-1)
+    return 10.0 * np.log10(power + 1e-12)
+
+
+def active_spans(audio, sr, threshold_db=SILENCE_THRESHOLD_DB, min_silence=SILENCE_MIN_DURATION,
+                 padding=SILENCE_PADDING, frame=SILENCE_FRAME):
+    """
+    Tramos [(inicio, fin), ...] en muestras con sonido en `audio` (canales, muestras).
+    Solo se descartan los silencios de al menos `min_silence` segundos, y se
+    deja `padding` de margen a cada lado para no cortar ataques ni colas.
+    """
+    length = audio.shape[-1]
+    silent = frame_rms_db(audio, frame) < threshold_db
+    n = len(silent)
+
+    # Rachas de tramas silenciosas [inicio, fin)
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], silent.astype(np.int8), [0]))))
+    starts, ends = edges[::2], edges[1::2]
+    long_enough = ends - starts >= math.ceil(min_silence * sr / frame)
+    starts, ends = starts[long_enough], ends[long_enough]
+
+    # Margen: los huecos se estrechan salvo en los extremos del archivo
+    margin = round(padding * sr / frame)
+    starts = np.where(starts > 0, starts + margin, 0)
+    ends = np.where(ends < n, ends - margin, n)
+    keep = ends > starts
+    starts, ends = starts[keep] * frame, np.minimum(ends[keep] * frame, length)
+
+    bounds = np.concatenate(([0], np.stack([starts, ends], axis=1).ravel(), [length])).reshape(-1, 2)
+    return [(int(a), int(b)) for a, b in bounds if b > a]
+
+
+def decode_once(path, sr=None):
+    """
+    Devuelve la ruta de un WAV con el audio de `path` a `sr` (None = su
+    frecuencia original) que se puede leer por memmap sin decodificar.
+
+    - Un WAV PCM/float que ya está a esa frecuencia se usa tal cual.
+    - Cualquier otro archivo se decodifica una vez (por bloques, memoria
+      acotada; ffmpeg para lo que soundfile no abre) a float32 y se guarda en
+      decoded_cache, con el tamaño y la fecha del original en la clave.
+    - Otra frecuencia se obtiene remuestreando esa versión una sola vez,
+      y también queda en la caché.
+
+    La ruta devuelta puede estar dentro de la caché y desaparecer con un
+    desalojo: para leerla, usar decoded(), que la fija mientras se usa.
+    """
     if not os.path.exists(path):
         raise FileNotFoundError(f"Archivo no encontrado: {path}")
+    try:
+        info = sf.info(path)
+    except Exception:
+        info = None  # formato que soundfile no abre (se decodifica con ffmpeg)
+    if info is not None and mappable(info) and sr in (None, info.samplerate):
+        return str(path)
+
+    st = os.stat(path)
+    clave = clave_cache("decoded", os.path.abspath(path), st.st_size, st.st_mtime_ns, sr)
+    en_cache = decoded_cache.obtener(clave)
+    if en_cache is not None:
+        return en_cache["audio"]
+
+    if sr is not None:
+        with decoded(path) as canonical:
+            reader = MappedAudio(canonical)  # memmap: sigue legible aunque se borre el enlace
+            if reader.samplerate == sr:
+                return decode_once(path)
+
+    with tempfile.TemporaryDirectory(prefix=".tmp-", dir=DECODED_CACHE_DIR) as carpeta:
+        tmp = os.path.join(carpeta, "audio.wav")
+        if sr is not None:
+            log(f"Remuestreando {os.path.basename(path)}: {reader.samplerate} Hz → {sr} Hz")
+            sf.write(tmp, resample(reader.read(), reader.samplerate, sr).T, sr, subtype="FLOAT")
+        elif info is not None:
+            log(f"Decodificando {os.path.basename(path)} ({info.format}/{info.subtype})")
+            with sf.SoundFile(tmp, "w", samplerate=info.samplerate, channels=info.channels,
+                              subtype="FLOAT") as out:
+                for block in sf.blocks(path, blocksize=STREAM_BLOCK, dtype="float32", always_2d=True):
+                    out.write(block)
+        else:
+            log(f"Decodificando {os.path.basename(path)} con ffmpeg")
+            command = ["ffmpeg", "-y", "-loglevel", "error", "-i", path, "-vn", "-c:a", "pcm_f32le", "-f", "wav", tmp]
+            try:
+                result = subprocess.run(command, capture_output=True, text=True)
+            except FileNotFoundError:
+                raise RuntimeError(f"No se puede decodificar {path}: soundfile no lo abre y ffmpeg no está instalado")
+            if result.returncode != 0:
+                raise RuntimeError(f"ffmpeg no pudo convertir {path}:\n{result.stderr}")
+        entrada = decoded_cache.guardar(clave, {"audio": tmp}, extra={"origen": os.path.basename(path), "sr": sr})
+    return entrada["audio"]
+
+
+@contextmanager
+def decoded(path, sr=None):
+    """
+    decode_once() con la ruta fijada durante el bloque `with`:
+
+        with decoded(path, sr) as ruta:
+            reader = MappedAudio(ruta)
+
+    Si la versión decodificada está en decoded_cache se enlaza (o copia) en
+    una carpeta propia, igual que restaurar() con los stems, así un desalojo
+    (de este u otro proceso) no la borra mientras se lee.
+    """
+    carpeta = None
+    try:
+        while True:
+            ruta = decode_once(path, sr)
+            if os.path.commonpath([os.path.abspath(ruta), os.path.abspath(DECODED_CACHE_DIR)]) != \
+                    os.path.abspath(DECODED_CACHE_DIR):
+                break  # el original se lee tal cual
+            carpeta = carpeta or tempfile.mkdtemp(prefix=".tmp-", dir=DECODED_CACHE_DIR)
+            fijada = os.path.join(carpeta, os.path.basename(ruta))
+            try:
+                enlazar_o_copiar(ruta, fijada)
+            except FileNotFoundError:
+                continue  # desalojada justo ahora: se vuelve a decodificar
+            ruta = fijada
+            break
+        yield ruta
+    finally:
+        if carpeta is not None:
+            shutil.rmtree(carpeta, ignore_errors=True)
+
+
+def stream_stats(path):
+    """
+    Recorre el archivo por bloques y devuelve (hash, media, desviación) de la
+    referencia mono, que es lo que Demucs usa para normalizar.
+    """
+    h = hashlib.sha256()
+    n, s1, s2 = 0, 0.0, 0.0
+    for block in sf.blocks(path, blocksize=STREAM_BLOCK, dtype="float32", always_2d=True):
+        h.update(block.tobytes())
+        ref = block.mean(axis=1, dtype=np.float64)
+        n += len(ref)
+        s1 += ref.sum()
+        s2 += np.dot(ref, ref)
+    mean = s1 / max(n, 1)
+    std = float(np.sqrt(max(s2 / max(n, 1) - mean * mean, 0.0)))
+    return h.hexdigest(), mean, std
 
-    y, r = librosa.load(path, sr=sr, mono=mono)
-    if y.ndim == 1:
-        y = np.expand_dims(y, 0)
+
+def load_audio(path, sr=SAMPLE_RATE, mono=False):
+    """
+    Carga un archivo de audio como float32 (canales, muestras) a `sr`
+    (None = frecuencia original). La decodificación y el remuestreo se hacen
+    una sola vez por archivo y frecuencia (ver decode_once); lo demás es memmap.
+    """
+    with metricas.etapa("load") as m:
+        with decoded(path, sr) as ruta:
+            y, r = read_audio(ruta, mono=mono)
+        m.audio_seg = y.shape[-1] / r
     return y, r
 
 
-def save_audio(path, audio, sr=SAMPLE_RATE):
-    """Guarda audio en formato WAV"""
+def save_audio(path, audio, sr=SAMPLE_RATE, stem_format=None):
+    """Guarda audio en formato WAV (PCM 16), o en uno de STEM_FORMATS"""
+    options = {}
+    if stem_format is not None:
+        _, options["format"], options["subtype"] = STEM_FORMATS[stem_format]
+        if stem_format == "opus" and sr != OPUS_SAMPLERATE:
+            audio, sr = resample(audio, sr, OPUS_SAMPLERATE), OPUS_SAMPLERATE
     if audio.ndim > 1:
         audio = audio.T
-    sf.write(path, audio, sr)
+    with metricas.etapa("save", audio_seg=audio.shape[0] / sr):
+        # Si el archivo previo es un enlace a la caché, sobrescribirlo la corrompería
+        if os.path.exists(path):
+            os.remove(path)
+        sf.write(path, audio, sr, **options)
     log(f"Audio guardado: {path}")
 
 
+def get_stem_format(stem_format=None):
+    """Valida un nombre de STEM_FORMATS (por defecto STEM_FORMAT)."""
+    stem_format = stem_format or STEM_FORMAT
+    if stem_format not in STEM_FORMATS:
+        raise ValueError(f"Formato de stems desconocido: {stem_format} (opciones: {', '.join(STEM_FORMATS)})")
+    return stem_format
+
+
+def stem_path(out_dir, name, stem_format=None):
+    return str(Path(out_dir) / f"{name}{STEM_FORMATS[get_stem_format(stem_format)][0]}")
+
+
+def write_stems(paths, sources, sr, stem_format=None, on_stem=None):
+    """
+    Codifica los stems en paralelo en el pool stem_writer (libsndfile suelta
+    el GIL mientras codifica, así FLAC y Opus no se hacen uno detrás de otro).
+    paths: {nombre: ruta}; sources: un array (canales, muestras) por stem, en
+    el mismo orden. on_stem(nombre, ruta) se llama en cuanto cada uno está en disco.
+    """
+    stem_format = get_stem_format(stem_format)
+    futures = {stem_writer.submit(save_audio, path, audio, sr, stem_format): name
+               for (name, path), audio in zip(paths.items(), sources)}
+    _wait_stems(futures, paths, on_stem)
+    return paths
+
+
+def transcode_stem(src, dst, stem_format):
+    """Convierte un stem ya escrito a `stem_format` leyéndolo por bloques (memoria acotada)."""
+    reader = MappedAudio(src)
+    _, fmt, subtype = STEM_FORMATS[stem_format]
+    sr = OPUS_SAMPLERATE if stem_format == "opus" else reader.samplerate
+    with metricas.etapa("save", audio_seg=reader.duration):
+        if os.path.exists(dst):
+            os.remove(dst)
+        with sf.SoundFile(dst, "w", samplerate=sr, channels=reader.channels, format=fmt, subtype=subtype) as f:
+            for block in resample_blocks(reader, sr):
+                f.write(block.T)
+    log(f"Audio guardado: {dst}")
+    return dst
+
+
+def transcode_stems(paths, stem_format, on_stem=None):
+    """Convierte en paralelo stems escritos en otro formato y borra los originales."""
+    out = {name: os.path.splitext(path)[0] + STEM_FORMATS[stem_format][0] for name, path in paths.items()}
+    futures = {stem_writer.submit(transcode_stem, paths[name], out[name], stem_format): name for name in paths}
+    _wait_stems(futures, out, on_stem)
+    for name, path in paths.items():
+        if path != out[name]:
+            os.remove(path)
+    return out
+
+
+def _wait_stems(futures, paths, on_stem):
+    for future in as_completed(futures):
+        name = futures[future]
+        future.result()
+        if on_stem is not None:
+            on_stem(name, paths[name])
+
+
+def wav_stream_header(sr, channels=1, bits=16):
+    """
+    Cabecera WAV para enviar audio de longitud desconocida por streaming
+    (tamaños al máximo, como hacen los servidores de radio por HTTP).
+    """
+    block_align = channels * bits // 8
+    return (
+        b"RIFF" + struct.pack("<I", 0xFFFFFFFF) + b"WAVE"
+        + b"fmt " + struct.pack("<IHHIIHH", 16, 1, channels, sr, sr * block_align, block_align, bits)
+        + b"data" + struct.pack("<I", 0xFFFFFFFF)
+    )
+
+
+def pcm16_bytes(audio):
+    """float32 (muestras,) o (canales, muestras) → bytes PCM de 16 bits intercalados."""
+    audio = np.clip(np.asarray(audio, dtype=np.float32), -1.0, 1.0)
+    if audio.ndim > 1:
+        audio = audio.T
+    return (audio * 32767.0).astype("<i2").tobytes()
+
+
+def get_profile(profile=None):
+    """Devuelve el perfil de separación (por nombre o dict) con su nombre incluido."""
+    if isinstance(profile, dict):
+        return profile
+    name = profile or DEMUCS_PROFILE
+    if name not in DEMUCS_PROFILES:
+        raise ValueError(f"Perfil de separación desconocido: {name} (opciones: {', '.join(DEMUCS_PROFILES)})")
+    return {"name": name, **DEMUCS_PROFILES[name]}
+
+
+def stem_names(stems="all", sources=("drums", "bass", "other", "vocals")):
+    """Nombres de los stems que se escriben en cada modo."""
+    if stems not in STEM_MODES:
+        raise ValueError(f"Modo de stems desconocido: {stems} (opciones: {', '.join(STEM_MODES)})")
+    if stems == "vocals":
+        return ["vocals"]
+    if stems == "two":
+        return ["vocals", "no_vocals"]
+    return list(sources)
+
+
+def pick_stems(separated, sources, stems="all"):
+    """
+    Selecciona (o combina) los stems de la salida de Demucs según el modo.
+    separated: (stems, canales, muestras) en el orden de `sources`.
+    Devuelve (nombres, array (k, canales, muestras)).
+    """
+    names = stem_names(stems, sources)
+    if stems == "all":
+        return names, separated
+    vocals = list(sources).index("vocals")
+    if stems == "vocals":
+        return names, separated[vocals:vocals + 1]
+    rest = np.delete(separated, vocals, axis=0).sum(axis=0)
+    return names, np.stack([separated[vocals], rest])
+
+
+# =========================
+# PROGRESO
+# Los callbacks de progreso tienen la forma progress(hecho, total, mensaje)
+# (ver trabajos.ProgresoEtapa); None = sin informar.
+# =========================
+def demucs_chunk_count(model, length, profile):
+    """
+    Cuántas veces llamará apply_model() al modelo para `length` muestras:
+    un segmento por cada paso de (1 - overlap) * segment, por desplazamiento
+    y por cada modelo de la bolsa (htdemucs_ft son 4). Es una estimación:
+    con shifts la longitud crece en un desplazamiento aleatorio.
+    """
+    total = 0
+    for sub in getattr(model, "models", [model]):
+        segment = profile["segment"] or float(sub.segment)
+        stride = max(1, int((1 - profile["overlap"]) * int(sub.samplerate * segment)))
+        padded = length + (int(0.5 * sub.samplerate) // 2 if profile["shifts"] else 0)
+        total += math.ceil(padded / stride) * max(1, profile["shifts"])
+    return total
+
+
+def demucs_forward_seconds(model, length, profile):
+    """
+    Segundos de audio que pasan por el modelo para separar `length` muestras,
+    por segundo de audio (1.0 = cada muestra una sola vez). Con use_train_segment
+    cada trozo cuesta como mínimo el segmento de entrenamiento del modelo.
+    """
+    forward = 0.0
+    for sub in getattr(model, "models", [model]):
+        segment = profile["segment"] or float(sub.segment)
+        cost = max(segment, float(sub.segment)) if getattr(sub, "use_train_segment", False) else segment
+        forward += demucs_chunk_count(sub, length, profile) * cost
+    return forward / (length / model.samplerate) if length else 0.0
+
+
+@contextmanager
+def demucs_progress(model, total, progress, message="Demucs"):
+    """Cuenta las pasadas del modelo (un forward por segmento) con forward hooks."""
+    if progress is None:
+        yield
+        return
+    done = [0]
+
+    def hook(*_):
+        done[0] += 1
+        progress(min(done[0], total), total, f"{message}: segmento {min(done[0], total)}/{total}")
+
+    handles = [sub.register_forward_hook(hook) for sub in getattr(model, "models", [model])]
+    try:
+        yield
+    finally:
+        for handle in handles:
+            handle.remove()
+
+
+def musicgen_tokens(model, duration):
+    """Tokens que hay que pedir a generate() para `duration` segundos de audio nuevo."""
+    return math.ceil(duration * model.audio_encoder.config.frame_rate) + model.decoder.num_codebooks - 1
+
+
+def musicgen_streamer(progress, total, every=5):
+    """
+    Streamer de transformers que solo cuenta tokens generados.
+    generate() llama a put() una vez con el prompt del decoder y luego una vez por paso.
+    """
+    from transformers.generation.streamers import BaseStreamer
+
+    class TokenProgress(BaseStreamer):
+        def __init__(self):
+            self.steps = -1
+
+        def put(self, value):
+            self.steps += 1
+            if self.steps > 0 and (self.steps % every == 0 or self.steps == total):
+                progress(self.steps, total, f"MusicGen: token {self.steps}/{total}")
+
+        def end(self):
+            progress(total, total, "MusicGen: decodificando audio")
+
+    return TokenProgress()
+
+
+def _read_tqdm_progress(stream, progress):
+    """Lee la salida de error de un proceso con barras tqdm e informa su porcentaje."""
+    parts = []
+    for chunk in iter(lambda: stream.read(512), ""):
+        parts.append(chunk)
+        found = re.findall(r"(\d{1,3})%\|", chunk)
+        if progress is not None and found:
+            progress(int(found[-1]), 100, f"Demucs (CLI): {found[-1]}%")
+    return "".join(parts)
+
+
 # =========================
 # CLASE BASE
 # =========================
@@ -83,43 +601,243 @@ class AudioProcessor(ABC):
 class DemucsSeparator(AudioProcessor):
     """Separa un audio en stems usando Demucs"""
 
-    def process(self, input_audio, out_dir):
-        log(f"Separando stems de: {input_audio}")
+    def __init__(self):
+        # Stems de la última separación que no se escribieron por no tener energía
+        self.silent_stems = []
+
+    def process(self, input_audio, out_dir, sr=None, wav=None, profile=None, stems="all", progress=None,
+                stem_format=None, on_stem=None):
+        """
+        Separa input_audio y escribe un archivo por stem en out_dir.
+        sr es la frecuencia de `wav` y de los stems; por defecto la nativa del
+        modelo (44.1 kHz en htdemucs), que es a la que Demucs separa bien.
+        stem_format es uno de STEM_FORMATS; on_stem(nombre, ruta) avisa de
+        cada stem en cuanto está escrito (se codifican en paralelo).
+        """
+        profile = get_profile(profile)
+        stem_format = get_stem_format(stem_format)
+        sr = sr or get_demucs_model(profile["model"]).samplerate
+        log(f"Separando stems de: {input_audio} (perfil {profile.get('name', 'personalizado')}, stems {stems})")
         ensure_dir(out_dir)
 
         # Verificar que el archivo existe
         if not os.path.exists(input_audio):
             raise FileNotFoundError(f"Archivo no encontrado: {input_audio}")
 
-        # Cargar audio
-        log("Cargando audio...")
-        wav, _ = load_audio(input_audio, sr=SAMPLE_RATE, mono=False)
-        wav_t = torch.tensor(wav, dtype=torch.float32).unsqueeze(0).to(DEVICE)
+        # Cargar audio (salvo que ya venga decodificado a `sr`)
+        if wav is None:
+            log("Cargando audio...")
+            wav, _ = load_audio(input_audio, sr=sr, mono=False)
 
-        # Aplicar modelo Demucs
+        # Aplicar modelo Demucs (solo a los tramos con sonido)
         log("Procesando con Demucs (esto puede tardar)...")
-        with torch.no_grad():
+        sources = self.separate_active(wav, profile=profile, progress=progress)
+
+        # Guardar solo los stems pedidos, y de esos solo los que tienen energía
+        names, sources = pick_stems(sources, get_demucs_model(profile["model"]).sources, stems)
+        self.silent_stems = silent_stem_names(names, sources)
+        paths, audios = {}, []
+
+        for i, name in enumerate(names):
+            out_path = stem_path(out_dir, name, stem_format)
+            if name in self.silent_stems:
+                log(f"🔇 {name}: sin energía (< {STEM_SILENCE_DB:.0f} dBFS), no se escribe")
+                if os.path.exists(out_path):
+                    os.remove(out_path)
+                continue
+            paths[name] = out_path
+            audios.append(sources[i])
+
+        log(f"Guardando {len(paths)} stems ({stem_format})...")
+        write_stems(paths, audios, sr, stem_format, on_stem=on_stem)
+
+        log("Separación completada exitosamente")
+        return paths
+
+    def separate(self, wav, mean=None, std=None, model=None, precision=None, profile=None, progress=None):
+        """
+        Separa un array (canales, muestras) con el modelo ya cargado.
+        Normaliza igual que el CLI de Demucs y devuelve (stems, canales, muestras).
+        Si se pasan mean/std (de toda la canción) se usan en lugar de los del fragmento.
+        model/precision permiten usar otro modelo (p. ej. al comparar precisiones).
+        profile fija variante, segmento, overlap y shifts (ver DEMUCS_PROFILES).
+        progress(hecho, total, mensaje) se llama tras cada segmento procesado.
+        """
+        import torch
+        from demucs.apply import apply_model
+
+        profile = get_profile(profile)
+        model = model or get_demucs_model(profile["model"])
+        device = get_device()
+
+        # Demucs espera tantos canales como el modelo (htdemucs = estéreo)
+        channels = model.audio_channels
+        if wav.shape[0] == 1 and channels > 1:
+            wav = np.repeat(wav, channels, axis=0)
+        elif wav.shape[0] > channels:
+            wav = wav[:channels]
+
+        wav_t = torch.tensor(wav, dtype=torch.float32).to(device)
+        if mean is None or std is None:
+            ref = wav_t.mean(0)
+            mean, std = ref.mean(), ref.std()
+        std = std + 1e-8
+        wav_t = (wav_t - mean) / std
+
+        total = demucs_chunk_count(model, wav.shape[-1], profile)
+        with metricas.etapa("separation", audio_seg=wav.shape[-1] / model.samplerate), \
+                torch.no_grad(), contexto_inferencia(precision), demucs_progress(model, total, progress):
             sources = apply_model(
-                demucs_model,
-                wav_t,
-                device=DEVICE,
+                model,
+                wav_t.unsqueeze(0),
+                device=device,
                 split=True,
-                overlap=0.25,
-                shifts=1
+                segment=profile["segment"],
+                overlap=profile["overlap"],
+                shifts=profile["shifts"]
             )[0]
 
-        # Guardar cada stem
-        stems = demucs_model.sources
-        paths = {}
-
-        log(f"Guardando {len(stems)} stems...")
-        for i, name in enumerate(stems):
-            out_path = Path(out_dir) / f"{name}.wav"
-            save_audio(out_path, sources[i].cpu().numpy(), SAMPLE_RATE)
-            log(f"{name} → {out_path}")
-            paths[name] = str(out_path)
-
-        log("Separación completada exitosamente")
+        sources = sources.float() * std + mean
+        return sources.cpu().numpy()
+
+    def separate_active(self, wav, mean=None, std=None, profile=None, progress=None):
+        """
+        Como separate(), pero solo pasa por Demucs los tramos con sonido (ver
+        active_spans); en el resto los stems quedan a cero. Se normaliza con la
+        media y la desviación de todo `wav` (o las dadas), igual que al separarlo entero.
+        """
+        profile = get_profile(profile)
+        model = get_demucs_model(profile["model"])
+        length = wav.shape[-1]
+        spans = active_spans(wav, model.samplerate) if SILENCE_SKIP else [(0, length)]
+        if spans == [(0, length)]:
+            return self.separate(wav, mean=mean, std=std, profile=profile, progress=progress)
+
+        if mean is None or std is None:
+            ref = wav[:model.audio_channels].mean(axis=0, dtype=np.float64)
+            mean, std = float(ref.mean()), float(ref.std())
+        active = sum(b - a for a, b in spans)
+        log(f"🔇 Silencios: se separan {active / model.samplerate:.1f}s de {length / model.samplerate:.1f}s "
+            f"en {len(spans)} tramos")
+
+        sources = np.zeros((len(model.sources), model.audio_channels, length), dtype=np.float32)
+        counts = [demucs_chunk_count(model, b - a, profile) for a, b in spans]
+        total, done = sum(counts), 0
+        for (a, b), count in zip(spans, counts):
+            span_progress = None
+            if progress is not None:
+                def span_progress(hecho, _total, _msg=None, done=done):
+                    progress(done + hecho, total, f"Demucs: segmento {done + hecho}/{total}")
+            sources[..., a:b] = self.separate(wav[..., a:b], mean=mean, std=std, profile=profile,
+                                              progress=span_progress)
+            done += count
+        return sources
+
+    def process_streaming(self, input_audio, out_dir, stats=None,
+                          window=DEMUCS_STREAM_WINDOW, overlap=DEMUCS_STREAM_OVERLAP,
+                          profile=None, stems="all", progress=None, stem_format=None, on_stem=None):
+        """
+        Separa por ventanas solapadas y va escribiendo los stems a disco.
+
+        Cada ventana dura `window` + `overlap` segundos; la zona solapada se
+        funde linealmente con la ventana anterior. Así la memoria pico no
+        depende de la duración del archivo.
+        """
+        log(f"Separando stems por ventanas de: {input_audio}")
+        ensure_dir(out_dir)
+        profile = get_profile(profile)
+        # Versión decodificada a su frecuencia original; cada ventana se remuestrea a la del modelo
+        with decoded(input_audio) as path:
+            if stats is None:
+                stats = stream_stats(path)
+            _, mean, std = stats
+            return self._separate_windows(path, out_dir, mean, std, window, overlap, profile, stems, progress,
+                                          get_stem_format(stem_format), on_stem)
+
+    def _separate_windows(self, path, out_dir, mean, std, window, overlap, profile, stems, progress=None,
+                          stem_format="pcm16", on_stem=None):
+        model = get_demucs_model(profile["model"])
+        sr = model.samplerate
+        names = stem_names(stems, model.sources)
+        # Opus no admite la frecuencia del modelo: se escribe FLAC y se convierte al final
+        direct = "flac" if stem_format == "opus" else stem_format
+        _, fmt, subtype = STEM_FORMATS[direct]
+        paths = {name: stem_path(out_dir, name, direct) for name in names}
+        writers = {}
+
+        with sf.SoundFile(path) as f:
+            sr_in, total = f.samplerate, f.frames
+            ratio = sr / sr_in
+            hop = int(window * sr_in)
+            extra = int(overlap * sr_in)
+
+            try:
+                for name, out_path in paths.items():
+                    # Puede ser un enlace a la caché: borrar en lugar de truncar
+                    if os.path.exists(out_path):
+                        os.remove(out_path)
+                    writers[name] = sf.SoundFile(out_path, "w", samplerate=sr, channels=model.audio_channels,
+                                                 format=fmt, subtype=subtype)
+
+                tail = None
+                start = 0
+                peaks = np.full(len(names), -np.inf)
+                n_windows = max(1, int(np.ceil(max(total - extra, 1) / hop)))
+                for k in range(n_windows):
+                    end = min(start + hop + extra, total)
+                    f.seek(start)
+                    chunk = f.read(end - start, dtype="float32", always_2d=True).T
+                    out_start, out_end = round(start * ratio), round(end * ratio)
+                    chunk = fix_length(resample(chunk, sr_in, sr), out_end - out_start)
+
+                    log(f"Ventana {k + 1}/{n_windows} ({start / sr_in:.0f}s - {end / sr_in:.0f}s)")
+                    window_progress = None
+                    if progress is not None:
+                        def window_progress(done, total, _msg=None, k=k):
+                            progress(k + done / total, n_windows,
+                                     f"Demucs: ventana {k + 1}/{n_windows}, segmento {done}/{total}")
+                    separated = self.separate_active(chunk, mean=mean, std=std, profile=profile,
+                                                     progress=window_progress)
+                    _, sources = pick_stems(separated, model.sources, stems)
+
+                    # Fundido con la cola de la ventana anterior
+                    if tail is not None:
+                        n = tail.shape[-1]
+                        fade = np.linspace(0.0, 1.0, n, dtype=np.float32)
+                        sources[..., :n] = tail * (1.0 - fade) + sources[..., :n] * fade
+
+                    last = end >= total
+                    if last:
+                        emit, tail = sources, None
+                    else:
+                        next_start = round((start + hop) * ratio) - out_start
+                        emit, tail = sources[..., :next_start], sources[..., next_start:].copy()
+
+                    # Los stems de la ventana se codifican a la vez en stem_writer
+                    list(stem_writer.map(lambda i: writers[names[i]].write(emit[i].T), range(len(names))))
+                    if emit.shape[-1]:
+                        peaks = np.maximum(peaks, frame_rms_db(emit).max(axis=-1))
+
+                    if last:
+                        break
+                    start += hop
+            finally:
+                for writer in writers.values():
+                    writer.close()
+
+        # Aquí los stems ya están escritos: los que no tienen energía se borran
+        self.silent_stems = [name for name, peak in zip(names, peaks) if SILENCE_SKIP and peak < STEM_SILENCE_DB]
+        for name in self.silent_stems:
+            log(f"🔇 {name}: sin energía (< {STEM_SILENCE_DB:.0f} dBFS), se descarta")
+            os.remove(paths.pop(name))
+
+        if stem_format != direct:
+            paths = transcode_stems(paths, stem_format, on_stem=on_stem)
+        elif on_stem is not None:
+            for name, out_path in paths.items():
+                on_stem(name, out_path)
+
+        log("Separación por ventanas completada")
         return paths
 
 
@@ -129,68 +847,474 @@ class DemucsSeparator(AudioProcessor):
 class MusicGenGenerator(AudioProcessor):
     """Genera acompañamiento musical con MusicGen"""
 
-    def process(self, style_prompt, out_path, duration=30):
+    def process(self, style_prompt, out_path, duration=30, seed=MUSICGEN_SEED, progress=None):
+        """
+        Genera `duration` segundos exactos de acompañamiento. Hasta
+        MUSICGEN_WINDOW segundos es una sola llamada a generate(); más allá,
+        ventanas encadenadas por continuación (ver _generate_windows).
+        """
         prompt = f"background music in {style_prompt} style"
-        log(f"Generando acompañamiento: {prompt}")
+        log(f"Generando acompañamiento: {prompt} ({duration:.1f}s)")
 
-        inputs = musicgen_processor(
-            text=prompt,
-            return_tensors="pt",
-            padding=True
-        ).to(DEVICE)
+        # Solo las generaciones con semilla son reproducibles y por tanto cacheables
+        clave = None
+        if seed is not None:
+            clave = clave_cache(MODEL_MUSICGEN, precision_efectiva(), prompt, duration, seed,
+                                sorted(MUSICGEN_GEN_PARAMS.items()), MUSICGEN_WINDOW, MUSICGEN_CONTEXT)
+            en_cache = musicgen_cache.obtener(clave)
+            if en_cache is not None:
+                enlazar_o_copiar(en_cache["audio"], str(out_path))
+                log(f"⚡ Acompañamiento encontrado en caché ({clave[:12]}) → {out_path}")
+                return out_path
+
+        import torch
 
         log("Generando audio con MusicGen...")
         with torch.no_grad():
-            audio = musicgen_model.generate(
-                **inputs,
-                max_new_tokens=int(duration * SAMPLE_RATE / 256)
-            )
+            if seed is not None:
+                with _musicgen_rng_lock:
+                    torch.manual_seed(seed)
+                    arr = self._generate_windows(prompt, duration, progress=progress)
+            else:
+                arr = self._generate_windows(prompt, duration, progress=progress)
 
         # Normalizar y guardar
-        arr = audio[0, 0].cpu().numpy()
         arr = arr / (np.max(np.abs(arr)) + 1e-9)
         save_audio(out_path, arr, SAMPLE_RATE)
+
+        if clave is not None:
+            musicgen_cache.guardar(clave, {"audio": str(out_path)}, extra={"prompt": prompt, "seed": seed})
+
         log(f"Acompañamiento generado → {out_path}")
         return out_path
 
+    def stream(self, style_prompt, duration=30, seed=MUSICGEN_SEED, out_path=None,
+               chunk_seconds=MUSICGEN_STREAM_CHUNK):
+        """
+        Genera en streaming: devuelve un iterador de bloques float32 (mono, a
+        SAMPLE_RATE) que se van entregando mientras generate() sigue corriendo.
+        Con semilla y en caché se lee el archivo guardado por bloques.
+        Si se pasa out_path, al terminar se guarda ahí el audio completo.
+        """
+        prompt = f"background music in {style_prompt} style"
+        total = int(duration * SAMPLE_RATE)
+        if duration > MUSICGEN_WINDOW:
+            raise ValueError(f"El streaming admite hasta {MUSICGEN_WINDOW:.0f}s (una ventana de MusicGen)")
+
+        clave = None
+        if seed is not None:
+            clave = clave_cache(MODEL_MUSICGEN, precision_efectiva(), prompt, duration, seed,
+                                sorted(MUSICGEN_GEN_PARAMS.items()), "stream")
+            en_cache = musicgen_cache.obtener(clave)
+            if en_cache is not None:
+                log(f"⚡ Acompañamiento encontrado en caché ({clave[:12]})")
+                audio, _ = read_audio(en_cache["audio"], sr=SAMPLE_RATE, mono=True)
+                step = int(chunk_seconds * SAMPLE_RATE)
+                for start in range(0, audio.shape[-1], step):
+                    yield audio[0, start:start + step]
+                if out_path is not None:
+                    enlazar_o_copiar(en_cache["audio"], str(out_path))
+                return
+
+        import torch
+
+        processor, model = get_musicgen()
+        inputs = processor(text=prompt, return_tensors="pt", padding=True).to(get_device())
+        frame_rate = model.audio_encoder.config.frame_rate
+        # Con el patrón de retardo, el audio va num_codebooks - 1 pasos por detrás de los tokens
+        max_new_tokens = musicgen_tokens(model, duration)
+
+        blocks = queue.Queue()
+        fin = object()
+        cancelled = threading.Event()
+        streamer = MusicGenStreamer(model, max(1, int(chunk_seconds * frame_rate)), blocks.put, cancelled)
+
+        def generar():
+            try:
+                with torch.no_grad(), _musicgen_rng_lock, metricas.etapa("generation", audio_seg=duration), \
+                        contexto_inferencia():
+                    if seed is not None:
+                        torch.manual_seed(seed)
+                    model.generate(**inputs, max_new_tokens=max_new_tokens, streamer=streamer,
+                                   **MUSICGEN_GEN_PARAMS)
+            except Exception as e:
+                blocks.put(e)
+            finally:
+                blocks.put(fin)
+
+        log(f"Generando acompañamiento en streaming: {prompt}")
+        threading.Thread(target=generar, name="musicgen-stream", daemon=True).start()
+
+        emitted, parts = 0, []
+        try:
+            while True:
+                block = blocks.get()
+                if block is fin:
+                    break
+                if isinstance(block, Exception):
+                    raise block
+                block = block[:max(0, total - emitted)]
+                if len(block):
+                    emitted += len(block)
+                    parts.append(block)
+                    yield block
+        finally:
+            # Si quien consume deja de iterar (cliente desconectado), parar generate()
+            cancelled.set()
+
+        if out_path is not None and parts:
+            save_audio(out_path, np.concatenate(parts), SAMPLE_RATE)
+            if clave is not None:
+                musicgen_cache.guardar(clave, {"audio": str(out_path)}, extra={"prompt": prompt, "seed": seed})
+        log(f"Streaming de MusicGen completado ({emitted / SAMPLE_RATE:.1f}s)")
+
+    def process_batch(self, style_prompts, out_paths, durations, progress=None):
+        """
+        Genera varios acompañamientos en una sola pasada de generate().
+        Se generan tokens para la duración más larga y cada salida se recorta
+        a la suya. Sin semilla: el lote no es reproducible ni se cachea.
+        Si alguno pasa de una ventana de MusicGen se generan uno a uno.
+        """
+        if not (len(style_prompts) == len(out_paths) == len(durations)):
+            raise ValueError("style_prompts, out_paths y durations deben tener la misma longitud")
+        if max(durations) > MUSICGEN_WINDOW:
+            return [self.process(p, o, d, seed=None, progress=progress)
+                    for p, o, d in zip(style_prompts, out_paths, durations)]
+
+        prompts = [f"background music in {p} style" for p in style_prompts]
+        log(f"Generando {len(prompts)} acompañamientos en lote: {prompts}")
+
+        import torch
+
+        processor, _ = get_musicgen()
+        inputs = processor(
+            text=prompts,
+            return_tensors="pt",
+            padding=True
+        ).to(get_device())
+
+        with torch.no_grad():
+            audio = self._generate(inputs, max(durations), progress=progress)
+
+        audio = audio[:, 0].float().cpu().numpy()
+        for arr, out_path, duration in zip(audio, out_paths, durations):
+            arr = fix_length(arr, int(round(duration * SAMPLE_RATE)))
+            arr = arr / (np.max(np.abs(arr)) + 1e-9)
+            save_audio(out_path, arr, SAMPLE_RATE)
+            log(f"Acompañamiento generado → {out_path}")
+        return list(out_paths)
+
+    def _generate(self, inputs, duration, model=None, precision=None, progress=None):
+        """
+        Llama a generate() con los tokens justos para `duration` segundos nuevos:
+        frame_rate (50 Hz) por segundo más num_codebooks - 1 pasos del patrón de
+        retardo. Con un prompt de audio, la salida incluye también ese prompt.
+        """
+        model = model or get_musicgen()[1]
+        batch = inputs["input_ids"].shape[0]
+        max_new_tokens = musicgen_tokens(model, duration)
+        streamer = musicgen_streamer(progress, max_new_tokens) if progress is not None else None
+        with _musicgen_rng_lock, metricas.etapa("generation", audio_seg=duration * batch), \
+                contexto_inferencia(precision):
+            return model.generate(
+                **inputs,
+                max_new_tokens=max_new_tokens,
+                streamer=streamer,
+                **MUSICGEN_GEN_PARAMS
+            )
+
+    def _generate_windows(self, prompt, duration, progress=None):
+        """
+        Genera `duration` segundos (mono, SAMPLE_RATE) por ventanas.
+
+        La primera ventana sale solo del texto. Cada siguiente recibe como
+        prompt de audio los últimos MUSICGEN_CONTEXT segundos ya generados y
+        pide tokens solo para lo que falta (como mucho MUSICGEN_WINDOW menos el
+        contexto); la parte del prompt que devuelve el modelo se usa para el
+        fundido con la ventana anterior. Ningún token generado se descarta.
+        """
+        processor, model = get_musicgen()
+        hop = SAMPLE_RATE // model.audio_encoder.config.frame_rate      # muestras por frame
+        total = int(round(duration * SAMPLE_RATE))
+        context = min(int(MUSICGEN_CONTEXT * SAMPLE_RATE) // hop * hop, int(MUSICGEN_WINDOW * SAMPLE_RATE) // 2)
+        step = int(MUSICGEN_WINDOW * SAMPLE_RATE) - context                # muestras nuevas por continuación
+        first = min(total, int(MUSICGEN_WINDOW * SAMPLE_RATE))
+        n_windows = 1 + max(0, math.ceil((total - first) / step))
+        fade = min(int(MUSICGEN_CROSSFADE * SAMPLE_RATE), context)
+
+        def window_progress(k):
+            if progress is None:
+                return None
+            return lambda done, n, _msg=None: progress(k + done / n, n_windows,
+                                                       f"MusicGen: ventana {k + 1}/{n_windows}, token {done}/{n}")
+
+        out = np.zeros(total, dtype=np.float32)
+        inputs = processor(text=[prompt], return_tensors="pt", padding=True).to(get_device())
+        audio = self._generate(inputs, first / SAMPLE_RATE, progress=window_progress(0))
+        out[:first] = fix_length(audio[0, 0].float().cpu().numpy(), first)
+        pos = first
+
+        for k in range(1, n_windows):
+            new = min(step, total - pos)
+            log(f"Continuación {k + 1}/{n_windows} ({pos / SAMPLE_RATE:.1f}s - {(pos + new) / SAMPLE_RATE:.1f}s)")
+            inputs = processor(audio=out[pos - context:pos], sampling_rate=SAMPLE_RATE, text=[prompt],
+                               return_tensors="pt", padding=True).to(get_device())
+            audio = self._generate(inputs, new / SAMPLE_RATE, progress=window_progress(k))
+            audio = fix_length(audio[0, 0].float().cpu().numpy(), context + new)
+
+            # La reconstrucción del prompt se funde con lo que ya había y lo nuevo va detrás
+            ramp = np.linspace(0.0, 1.0, fade, dtype=np.float32)
+            out[pos - fade:pos] = out[pos - fade:pos] * (1.0 - ramp) + audio[context - fade:context] * ramp
+            out[pos:pos + new] = audio[context:]
+            pos += new
+        return out
+
+
+class MusicGenBatcher:
+    """
+    Agrupa peticiones concurrentes de MusicGen en lotes.
+
+    enviar() devuelve un Future; un hilo de fondo espera hasta `ventana` segundos
+    (o hasta juntar `max_lote` peticiones) y lanza un único process_batch().
+    """
+
+    def __init__(self, ventana=MUSICGEN_BATCH_WINDOW, max_lote=MUSICGEN_MAX_BATCH):
+        self.ventana = ventana
+        self.max_lote = max_lote
+        self._pendientes = []
+        self._cond = threading.Condition()
+        self._hilo = None
+
+    def enviar(self, style_prompt, out_path, duration=30, progress=None) -> Future:
+        futuro = Future()
+        with self._cond:
+            self._pendientes.append((style_prompt, out_path, duration, progress, futuro))
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(target=self._bucle, name="musicgen-batcher", daemon=True)
+                self._hilo.start()
+            self._cond.notify_all()
+        return futuro
+
+    def _bucle(self):
+        while True:
+            with self._cond:
+                if not self._cond.wait_for(lambda: self._pendientes, timeout=60):
+                    self._hilo = None
+                    return
+                # Esperar a que lleguen más peticiones dentro de la ventana
+                limite = time.monotonic() + self.ventana
+                while len(self._pendientes) < self.max_lote:
+                    restante = limite - time.monotonic()
+                    if restante <= 0:
+                        break
+                    self._cond.wait(restante)
+                lote = self._pendientes[:self.max_lote]
+                self._pendientes = self._pendientes[self.max_lote:]
+
+            self._ejecutar(lote)
+
+    def _ejecutar(self, lote):
+        prompts, out_paths, durations, callbacks, futuros = zip(*lote)
+
+        # Todas las peticiones del lote avanzan al mismo ritmo (mismos pasos de generate())
+        callbacks = [c for c in callbacks if c is not None]
+        progress = None
+        if callbacks:
+            def progress(done, total, message=None):
+                for callback in callbacks:
+                    callback(done, total, message)
+
+        try:
+            if len(lote) == 1:
+                resultados = [MusicGenGenerator().process(prompts[0], out_paths[0], durations[0], seed=None,
+                                                          progress=progress)]
+            else:
+                resultados = MusicGenGenerator().process_batch(list(prompts), list(out_paths), list(durations),
+                                                               progress=progress)
+        except Exception as e:
+            for futuro in futuros:
+                futuro.set_exception(e)
+            return
+        for futuro, resultado in zip(futuros, resultados):
+            futuro.set_result(resultado)
+
+
+class MusicGenStreamer:
+    """
+    Streamer para MusicGen.generate() que decodifica el audio por bloques.
+
+    Cada `play_steps` tokens aplica el patrón de retardo de los codebooks,
+    decodifica con EnCodec todo lo generado hasta ahora y entrega solo la
+    parte nueva (menos un margen `stride`, que puede cambiar al llegar más
+    tokens). generate() solo llama a put() y end(), así que no hace falta
+    heredar de transformers.BaseStreamer (y este módulo no lo importa).
+    Si se activa `cancelled`, el siguiente put() lanza una excepción y
+    generate() se detiene (p. ej. cuando el cliente HTTP se desconecta).
+    """
+
+    def __init__(self, model, play_steps, on_audio, cancelled=None):
+        self.decoder = model.decoder
+        self.audio_encoder = model.audio_encoder
+        self.generation_config = model.generation_config
+        self.play_steps = play_steps
+        self.on_audio = on_audio
+        self.cancelled = cancelled
+        hop_length = int(np.prod(self.audio_encoder.config.upsampling_ratios))
+        self.stride = hop_length * max(1, play_steps - self.decoder.num_codebooks) // 6
+        self.token_cache = None
+        self.emitted = 0
+
+    def _decode(self, input_ids):
+        _, delay_mask = self.decoder.build_delay_pattern_mask(
+            input_ids[:, :1],
+            pad_token_id=self.generation_config.decoder_start_token_id,
+            max_length=input_ids.shape[-1],
+        )
+        input_ids = self.decoder.apply_delay_pattern_mask(input_ids, delay_mask)
+        # Quitar los tokens de relleno del patrón de retardo
+        input_ids = input_ids[input_ids != self.generation_config.pad_token_id]
+        input_ids = input_ids.reshape(1, 1, self.decoder.num_codebooks, -1).to(self.audio_encoder.device)
+        audio = self.audio_encoder.decode(input_ids, audio_scales=[None]).audio_values
+        return audio[0, 0].float().cpu().numpy()
+
+    def put(self, value):
+        if self.cancelled is not None and self.cancelled.is_set():
+            raise RuntimeError("Generación en streaming cancelada")
+        if value.shape[0] // self.decoder.num_codebooks > 1:
+            raise ValueError("La generación en streaming solo admite un prompt")
+        if self.token_cache is None:
+            self.token_cache = value
+        else:
+            import torch
+            self.token_cache = torch.cat([self.token_cache, value[:, None]], dim=-1)
+
+        if self.token_cache.shape[-1] % self.play_steps == 0:
+            audio = self._decode(self.token_cache)
+            end = len(audio) - self.stride
+            if end > self.emitted:
+                self.on_audio(audio[self.emitted:end])
+                self.emitted = end
+
+    def end(self):
+        if self.token_cache is not None:
+            audio = self._decode(self.token_cache)
+            if len(audio) > self.emitted:
+                self.on_audio(audio[self.emitted:])
+
 
 # =========================
 # SUBCLASE 3: MEZCLA
 # =========================
 class Mixer(AudioProcessor):
-    """Mezcla vocal con acompañamiento"""
+    """Mezcla cualquier número de pistas (stems) con ganancia y paneo por pista"""
 
     def process(self, vocal_wav, accomp_wav, out_path):
         log("Mezclando vocal + acompañamiento...")
-
-        # Cargar pistas
-        v, _ = librosa.load(vocal_wav, sr=SAMPLE_RATE, mono=True)
-        a, _ = librosa.load(accomp_wav, sr=SAMPLE_RATE, mono=True)
-
-        # Igualar longitudes
-        L = min(len(v), len(a))
-        mix = VOCAL_GAIN * v[:L] + ACC_GAIN * a[:L]
-
-        # Normalizar
-        mix = mix / (np.max(np.abs(mix)) + 1e-9)
-        save_audio(out_path, mix, SAMPLE_RATE)
+        return self.mix([vocal_wav, accomp_wav], out_path, gains=[VOCAL_GAIN, ACC_GAIN])
+
+    def mix(self, tracks, out_path, gains=None, pans=None, sr=None):
+        """
+        Mezcla N pistas en estéreo.
+
+        Args:
+            tracks: lista de rutas de audio
+            out_path: dónde guardar la mezcla
+            gains: ganancia lineal por pista (por defecto 1.0)
+            pans: paneo por pista entre -1 (izquierda) y 1 (derecha), 0 = centro
+            sr: frecuencia de la mezcla (por defecto la más común entre las pistas)
+
+        Las pistas más cortas se rellenan con silencio (no se recorta la mezcla).
+        """
+        n = len(tracks)
+        if n == 0:
+            raise ValueError("No hay pistas para mezclar")
+        gains = np.ones(n, dtype=np.float32) if gains is None else np.asarray(gains, dtype=np.float32)
+        pans = np.zeros(n, dtype=np.float32) if pans is None else np.clip(np.asarray(pans, dtype=np.float32), -1, 1)
+        if gains.shape != (n,) or pans.shape != (n,):
+            raise ValueError("Debe haber una ganancia y un paneo por pista")
+
+        log(f"Mezclando {n} pistas...")
+        # Las versiones decodificadas quedan fijadas hasta terminar la mezcla
+        with ExitStack() as pila:
+            mix, sr = self._mix_sources(self._open_sources(tracks, sr, pila), gains, pans)
+        save_audio(out_path, mix, sr)
         log(f"Mezcla final → {out_path}")
         return out_path
 
+    def _mix_sources(self, sources, gains, pans):
+        n, sr = len(sources), sources[0][1]
+
+        # Paneo de potencia constante; sqrt(2) deja ganancia 1 en el centro
+        theta = (pans + 1) * (np.pi / 4)
+        weights = (np.sqrt(2) * gains[:, None] * np.stack([np.cos(theta), np.sin(theta)], axis=1)).astype(np.float32)
+
+        # Por bloques: se apilan todas las pistas en un buffer (pistas, 2, bloque)
+        # reutilizado y se hace la suma ponderada en una sola operación
+        length = max(self._length(src) for src, _ in sources)
+        with metricas.etapa("mix", audio_seg=length / sr):
+            mix = np.zeros((2, length), dtype=np.float32)
+            stack = np.empty((n, 2, min(MIX_BLOCK, length)), dtype=np.float32)
+            for start in range(0, length, MIX_BLOCK):
+                stop = min(start + MIX_BLOCK, length)
+                block = stack[:, :, :stop - start]
+                block.fill(0.0)
+                for i, (src, _) in enumerate(sources):
+                    data = src.read(start, stop) if isinstance(src, MappedAudio) else src[:, start:stop]
+                    block[i, :, :data.shape[-1]] = data[:2]  # mono se duplica en ambos canales
+                np.einsum("nc,ncl->cl", weights, block, out=mix[:, start:stop])
+
+            # Normalizar
+            mix /= np.max(np.abs(mix)) + 1e-9
+        return mix, sr
+
+    @staticmethod
+    def _open_sources(tracks, sr, pila):
+        """
+        Abre las pistas sin decodificarlas enteras: todas se leen por bloques
+        (memmap). Las que no están a `sr` (p. ej. el acompañamiento de MusicGen
+        a 32 kHz junto a stems de Demucs a 44.1 kHz) se remuestrean una sola
+        vez con decode_once y la versión remuestreada queda en caché.
+        Las rutas se fijan en `pila` (ver decoded). Devuelve [(fuente, sr)].
+        """
+        readers = [MappedAudio(pila.enter_context(decoded(t))) for t in tracks]
+        if sr is None:
+            sr = Counter(r.samplerate for r in readers).most_common(1)[0][0]
+        return [(r if r.samplerate == sr else MappedAudio(pila.enter_context(decoded(t, sr))), sr)
+                for t, r in zip(tracks, readers)]
+
+    @staticmethod
+    def _length(src):
+        return src.frames if isinstance(src, MappedAudio) else src.shape[-1]
+
+
+musicgen_batcher = MusicGenBatcher() if MUSICGEN_BATCHING else None
+
 
 # =========================
 # FUNCIONES PÚBLICAS (para compatibilidad con app.py)
 # =========================
-def separate_stems(input_audio, out_dir):
+def separate_stems(input_audio, out_dir, engine=None, profile=None, stems="all", progress=None,
+                   stem_format=None, on_stem=None):
     """
-    Separa un audio en stems usando Demucs CLI (bloqueante y confiable).
+    Separa un audio en stems usando Demucs (bloqueante y confiable).
+
+    Por defecto usa el modelo ya cargado en memoria; si falla, o si se pide
+    engine="cli", recurre al comando `demucs`. Ambos caminos escriben en
+    out_dir/<modelo>/<cancion>/<stem>.wav.
 
     Args:
         input_audio (str): ruta del archivo de audio
         out_dir (str): carpeta donde guardar los stems
+        engine (str): "inprocess" o "cli" (por defecto DEMUCS_ENGINE)
+        profile (str): "fast", "balanced" o "best" (por defecto DEMUCS_PROFILE)
+        stems (str): "all", "vocals" o "two" (vocals + no_vocals)
+        progress (callable): progress(hecho, total, mensaje) por segmento de Demucs
+        stem_format (str): "pcm16", "pcm24", "float32", "flac" u "opus" (por defecto STEM_FORMAT)
+        on_stem (callable): on_stem(nombre, ruta) en cuanto cada stem está escrito
 
     Returns:
         dict: {'drums': path, 'bass': path, 'other': path, 'vocals': path}
+              (o solo los stems del modo pedido)
     """
 
     if not os.path.exists(input_audio):
@@ -198,69 +1322,209 @@ def separate_stems(input_audio, out_dir):
 
     os.makedirs(out_dir, exist_ok=True)
 
-    # Ruta del comando demucs
-    # Usa el modelo htdemucs que da mejor calidad
-    command = [
-        "demucs",
-        "-n", "htdemucs",
-        "-o", out_dir,
-        input_audio
-    ]
+    profile = get_profile(profile)
+    names = stem_names(stems)
+    stem_format = get_stem_format(stem_format)
 
-    print("Ejecutando Demucs...")
-    print("Comando:", " ".join(command))
+    # Cada stem se anuncia una sola vez (aunque la separación en proceso falle y se use el CLI)
+    anunciados = set()
 
-    # Ejecutar bloqueante y CAPTURAR tudo
-    process = subprocess.Popen(
-        command,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True
-    )
-
-    stdout, stderr = process.communicate()
+    def anunciar(name, path):
+        if on_stem is not None and name not in anunciados:
+            anunciados.add(name)
+            on_stem(name, path)
 
-    print("📤 STDOUT:")
-    print(stdout)
-    print("📥 STDERR:")
-    print(stderr)
-
-    if process.returncode != 0:
-        raise RuntimeError(f"Demucs falló con código {process.returncode}:\n{stderr}")
-
-    # Buscar carpeta generada por Demucs
+    # Misma carpeta que genera el CLI de Demucs
     song_name = os.path.splitext(os.path.basename(input_audio))[0]
-    demucs_output_dir = os.path.join(out_dir, "htdemucs", song_name)
+    demucs_output_dir = os.path.join(out_dir, profile["model"], song_name)
+
+    engine = engine or DEMUCS_ENGINE
+    if engine not in ("inprocess", "cli"):
+        raise ValueError(f"Motor de separación desconocido: {engine}")
+
+    # Archivos largos: separación por ventanas con memoria acotada
+    streaming = engine == "inprocess" and audio_duration(input_audio) > DEMUCS_STREAM_THRESHOLD
+    # Buscar en la caché por el hash del audio decodificado
+    # (la precisión forma parte de la clave: int8/bf16 dan stems algo distintos)
+    wav = clave = stats = None
+    precision = precision_efectiva() if engine == "inprocess" else "fp32"
+    ajustes = (profile["model"], precision, profile["segment"], profile["overlap"], profile["shifts"],
+               stems, DEMUCS_SAMPLERATE, stem_format)
+    if SILENCE_SKIP:
+        ajustes += ("silence", SILENCE_THRESHOLD_DB, SILENCE_MIN_DURATION, SILENCE_PADDING, STEM_SILENCE_DB)
+    if streaming:
+        # Los archivos que no son WAV se decodifican una sola vez (versión en caché)
+        with decoded(input_audio) as source_path:
+            stats = stream_stats(source_path)
+        if stem_cache is not None:
+            clave = clave_cache(stats[0], "stream", *ajustes)
+    elif stem_cache is not None:
+        wav, _ = load_audio(input_audio, sr=DEMUCS_SAMPLERATE, mono=False)
+        clave = clave_cache(wav, *ajustes)
+
+    # Los archivos previos pueden ser enlaces a la caché: no escribir encima de ellos.
+    # También con acierto de caché: los stems de otra separación (otro formato,
+    # o uno que ahora sale en silencio) no deben quedarse junto a los restaurados.
+    _limpiar_stems(demucs_output_dir)
+
+    if clave is not None:
+        en_cache = stem_cache.obtener(clave)
+        if en_cache is not None:
+            log(f"⚡ Stems encontrados en caché ({clave[:12]})")
+            try:
+                rutas = restaurar(en_cache, demucs_output_dir)
+            except FileNotFoundError:
+                # Desalojada entre obtener() y el enlace (otro hilo u otro proceso): se separa de nuevo
+                log(f"⚠️ Entrada de caché {clave[:12]} desalojada al restaurarla, separando de nuevo")
+                _limpiar_stems(demucs_output_dir)
+            else:
+                for name, path in rutas.items():
+                    anunciar(name, path)
+                return rutas
+
+    separator = DemucsSeparator()
+    if engine == "inprocess":
+        try:
+            if streaming:
+                separator.process_streaming(input_audio, demucs_output_dir, stats=stats, profile=profile,
+                                            stems=stems, progress=progress, stem_format=stem_format,
+                                            on_stem=anunciar)
+            else:
+                _separate_stems_inprocess(input_audio, demucs_output_dir, wav=wav, profile=profile,
+                                          stems=stems, progress=progress, separator=separator,
+                                          stem_format=stem_format, on_stem=anunciar)
+        except Exception as e:
+            log(f"⚠️ Separación en proceso falló ({e}), usando el CLI de Demucs")
+            _separate_stems_cli(input_audio, out_dir, profile, stems, progress, stem_format, anunciar)
+    else:
+        _separate_stems_cli(input_audio, out_dir, profile, stems, progress, stem_format, anunciar)
 
     print(f"📂 Carpeta generada: {demucs_output_dir}")
 
     if not os.path.exists(demucs_output_dir):
         raise RuntimeError("Demucs terminó, pero no generó la carpeta esperada.")
 
-    stems = {
-        "drums": os.path.join(demucs_output_dir, "drums.wav"),
-        "bass": os.path.join(demucs_output_dir, "bass.wav"),
-        "other": os.path.join(demucs_output_dir, "other.wav"),
-        "vocals": os.path.join(demucs_output_dir, "vocals.wav")
-    }
+    esperados = {name: stem_path(demucs_output_dir, name, stem_format) for name in names}
 
     # Validar cada archivo
     stems_validos = {}
 
-    for name, path in stems.items():
+    for name, path in esperados.items():
+        if name in separator.silent_stems:
+            continue  # sin energía: ni se escribió ni se registra
         if os.path.exists(path) and os.path.getsize(path) > 1000:
             stems_validos[name] = path
+            anunciar(name, path)  # el CLI no avisa stem a stem
         else:
             print(f"⚠️ WARNING: '{name}' está vacío o no existe ({path})")
 
     if not stems_validos:
         raise RuntimeError("Demucs ejecutó pero todos los stems salieron vacíos.")
 
+    if clave is not None:
+        stem_cache.guardar(clave, stems_validos, extra={"origen": os.path.basename(input_audio)})
+        log(f"Stems guardados en caché ({clave[:12]}): {stem_cache.stats()}")
+
     print("🎉 Separación completada correctamente")
     return stems_validos
 
 
-def generate_accompaniment(style_prompt, out_path, duration=30):
+def silent_stem_names(names, sources, threshold_db=STEM_SILENCE_DB):
+    """Nombres de los stems (stems, canales, muestras) cuyo RMS no supera threshold_db en ninguna trama."""
+    if not SILENCE_SKIP or sources.shape[-1] == 0:
+        return []
+    peaks = frame_rms_db(sources).max(axis=-1)
+    return [name for name, peak in zip(names, peaks) if peak < threshold_db]
+
+
+def _limpiar_stems(demucs_output_dir):
+    """Borra los stems (en cualquier formato) de una separación anterior en la carpeta de salida."""
+    if not os.path.isdir(demucs_output_dir):
+        return
+    for nombre in os.listdir(demucs_output_dir):
+        if nombre.endswith(STEM_EXTENSIONS):
+            os.remove(os.path.join(demucs_output_dir, nombre))
+
+
+def _separate_stems_inprocess(input_audio, demucs_output_dir, wav=None, profile=None, stems="all",
+                              progress=None, separator=None, stem_format=None, on_stem=None):
+    """Separa con el modelo Demucs precargado, a su frecuencia nativa (como el CLI)."""
+    print("Ejecutando Demucs en proceso (modelo precargado)...")
+    return (separator or DemucsSeparator()).process(input_audio, demucs_output_dir, sr=DEMUCS_SAMPLERATE, wav=wav,
+                                                    profile=profile, stems=stems, progress=progress,
+                                                    stem_format=stem_format, on_stem=on_stem)
+
+
+# Opciones del CLI de Demucs para cada formato (Opus se convierte desde FLAC)
+DEMUCS_CLI_FORMATS = {"pcm16": [], "pcm24": ["--int24"], "float32": ["--float32"], "flac": ["--flac"],
+                      "opus": ["--flac"]}
+
+
+def _separate_stems_cli(input_audio, out_dir, profile=None, stems="all", progress=None, stem_format=None,
+                        on_stem=None):
+    """Separa lanzando el comando `demucs` en un subproceso."""
+    profile = get_profile(profile)
+    stem_format = get_stem_format(stem_format)
+    # Ruta del comando demucs, con los ajustes del perfil
+    command = [
+        "demucs",
+        "-n", profile["model"],
+        "--overlap", str(profile["overlap"]),
+        "--shifts", str(profile["shifts"]),
+        "-o", out_dir,
+    ]
+    if profile["segment"] is not None:
+        command += ["--segment", str(int(profile["segment"]))]
+    if stems != "all":
+        command += ["--two-stems", "vocals"]
+    command += DEMUCS_CLI_FORMATS[stem_format]
+    command.append(input_audio)
+
+    print("Ejecutando Demucs...")
+    print("Comando:", " ".join(command))
+
+    # Ejecutar bloqueante y CAPTURAR tudo; las barras de tqdm (stderr) se leen
+    # sobre la marcha para informar progreso, stdout se vacía en otro hilo
+    with metricas.etapa("separation", audio_seg=audio_duration(input_audio)):
+        process = subprocess.Popen(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True
+        )
+
+        stdout_parts = []
+        reader = threading.Thread(target=lambda: stdout_parts.append(process.stdout.read()), daemon=True)
+        reader.start()
+        stderr = _read_tqdm_progress(process.stderr, progress)
+        process.wait()
+        reader.join()
+        stdout = "".join(stdout_parts)
+
+    print("📤 STDOUT:")
+    print(stdout)
+    print("📥 STDERR:")
+    print(stderr)
+
+    if process.returncode != 0:
+        raise RuntimeError(f"Demucs falló con código {process.returncode}:\n{stderr}")
+
+    # El CLI solo sabe hacer dos stems: en modo "vocals" se descarta el resto
+    song_name = os.path.splitext(os.path.basename(input_audio))[0]
+    song_dir = os.path.join(out_dir, profile["model"], song_name)
+    cli_format = "flac" if stem_format == "opus" else stem_format
+    if stems == "vocals":
+        no_vocals = stem_path(song_dir, "no_vocals", cli_format)
+        if os.path.exists(no_vocals):
+            os.remove(no_vocals)
+
+    if stem_format != cli_format:
+        written = {name: stem_path(song_dir, name, cli_format) for name in stem_names(stems)}
+        transcode_stems({name: path for name, path in written.items() if os.path.exists(path)},
+                        stem_format, on_stem=on_stem)
+
+
+def generate_accompaniment(style_prompt, out_path, duration=30, seed=MUSICGEN_SEED, progress=None):
     """
     Genera un acompañamiento musical
 
@@ -268,17 +1532,62 @@ def generate_accompaniment(style_prompt, out_path, duration=30):
         style_prompt: estilo musical (ej: "electronic", "lo-fi")
         out_path: dónde guardar el audio
         duration: duración en segundos
+        seed: semilla para generación determinista (y cacheable); None = aleatorio
+        progress: progress(hecho, total, mensaje) por tokens generados
 
     Returns:
         str: ruta al archivo generado
     """
     try:
-        return MusicGenGenerator().process(style_prompt, out_path, duration)
+        # Sin semilla, las peticiones concurrentes se agrupan en un solo generate()
+        # (las que necesitan varias ventanas van por separado)
+        if seed is None and musicgen_batcher is not None and duration <= MUSICGEN_WINDOW:
+            return musicgen_batcher.enviar(style_prompt, out_path, duration, progress=progress).result()
+        return MusicGenGenerator().process(style_prompt, out_path, duration, seed=seed, progress=progress)
     except Exception as e:
         log(f"❌ Error en generación: {e}")
         raise
 
 
+def accompaniment_duration(reference):
+    """
+    Duración de acompañamiento para acompañar `reference` (normalmente el
+    stem de voz): la suya, limitada a MUSICGEN_MAX_DURATION.
+    """
+    duration = audio_duration(reference)
+    if duration > MUSICGEN_MAX_DURATION:
+        log(f"⚠️ {os.path.basename(reference)} dura {duration:.0f}s; se generan {MUSICGEN_MAX_DURATION:.0f}s")
+    return min(duration, MUSICGEN_MAX_DURATION)
+
+
+def generate_accompaniments(prompts, durations, out_dir):
+    """
+    Genera varios acompañamientos en una sola pasada de MusicGen
+
+    Args:
+        prompts: lista de estilos musicales
+        durations: lista de duraciones en segundos (una por prompt) o un único número
+        out_dir: carpeta donde guardar los audios
+
+    Returns:
+        list: rutas a los archivos generados, en el mismo orden que prompts
+    """
+    if isinstance(durations, (int, float)):
+        durations = [durations] * len(prompts)
+    ensure_dir(out_dir)
+    out_paths = [os.path.join(out_dir, f"accompaniment_{i:03d}.wav") for i in range(len(prompts))]
+    try:
+        generator = MusicGenGenerator()
+        resultados = []
+        for inicio in range(0, len(prompts), MUSICGEN_MAX_BATCH):
+            fin = inicio + MUSICGEN_MAX_BATCH
+            resultados += generator.process_batch(prompts[inicio:fin], out_paths[inicio:fin], durations[inicio:fin])
+        return resultados
+    except Exception as e:
+        log(f"❌ Error en generación por lotes: {e}")
+        raise
+
+
 def mix_tracks(vocal_wav, accomp_wav, out_path):
     """
     Mezcla dos pistas de audio
@@ -298,6 +1607,26 @@ def mix_tracks(vocal_wav, accomp_wav, out_path):
         raise
 
 
+def mix_stems(tracks, out_path, gains=None, pans=None):
+    """
+    Mezcla cualquier número de pistas en estéreo
+
+    Args:
+        tracks: lista de rutas de audio
+        out_path: dónde guardar la mezcla
+        gains: ganancia por pista (opcional)
+        pans: paneo por pista entre -1 y 1 (opcional)
+
+    Returns:
+        str: ruta al archivo mezclado
+    """
+    try:
+        return Mixer().mix(tracks, out_path, gains=gains, pans=pans)
+    except Exception as e:
+        log(f"❌ Error en mezcla: {e}")
+        raise
+
+
 # =========================
 # MAIN PIPELINE (para uso desde línea de comandos)
 # =========================
@@ -305,37 +1634,111 @@ def main():
     parser = argparse.ArgumentParser(description="🎛️ AI Remix: Demucs + MusicGen")
     parser.add_argument("--input", required=True, help="Input audio file (.mp3 or .wav)")
     parser.add_argument("--style", required=True, help="Style prompt for MusicGen")
-    parser.add_argument("--duration", type=int, default=30, help="Duration in seconds")
+    parser.add_argument("--duration", type=float, default=None,
+                        help="Accompaniment duration in seconds (default: length of the vocal stem)")
+    parser.add_argument("--seed", type=int, default=MUSICGEN_SEED, help="Seed for deterministic (cached) MusicGen output")
     parser.add_argument("--output_dir", default="output_remix", help="Output directory")
+    parser.add_argument("--profile", default=DEMUCS_PROFILE, choices=list(DEMUCS_PROFILES),
+                        help="Separation quality profile")
+    parser.add_argument("--stems", default="all", choices=STEM_MODES,
+                        help="Stems to write: all, vocals (only vocals) or two (vocals + no_vocals)")
+    parser.add_argument("--stem_format", default=STEM_FORMAT, choices=list(STEM_FORMATS),
+                        help="Stem encoding: pcm16, pcm24, float32, flac or opus")
     args = parser.parse_args()
 
     log("=" * 50)
     log("🎛️ Iniciando AI Remix Pipeline")
-    log(f"🎚 Device: {DEVICE}")
+    log(f"🎚 Device: {get_device()}")
+    log("=" * 50)
+
+    final_mix = remix_file(args.input, args.style, args.output_dir, duration=args.duration, seed=args.seed,
+                           profile=args.profile, stems=args.stems, stem_format=args.stem_format)
+
+    log("=" * 50)
+    log(f"✅ ¡Remix completado! → {final_mix}")
     log("=" * 50)
 
-    ensure_dir(args.output_dir)
 
-    # Pipeline completo
+def remix_file(input_audio, style, output_dir, duration=None, seed=MUSICGEN_SEED, profile=None, stems="all",
+               hilos_torch=None, stem_format=None):
+    """
+    Pipeline completo para un archivo: separar → generar → mezclar.
+    La generación solo necesita el estilo y la duración, así que corre a la
+    vez que la separación (ver etapas.py) y las dos se unen en la mezcla.
+    Con duration=None el acompañamiento dura lo mismo que la canción (Demucs
+    devuelve stems de la misma longitud que la entrada, así que coincide con la voz).
+    hilos_torch: núcleos para este remix, repartidos entre las etapas que
+    corren a la vez (por defecto todos).
+
+    Returns:
+        str: ruta a final_remix.wav dentro de output_dir
+    """
+    from etapas import GrafoEtapas
+
+    ensure_dir(output_dir)
+
     separator = DemucsSeparator()
     generator = MusicGenGenerator()
     mixer = Mixer()
 
-    # 1. Separar stems
-    stems = separator.process(args.input, args.output_dir)
-    vocal_path = stems.get("vocals")
+    if duration is None:
+        duration = accompaniment_duration(input_audio)
+    accomp_path = os.path.join(output_dir, "accompaniment_generated.wav")
+    final_mix = os.path.join(output_dir, "final_remix.wav")
 
-    # 2. Generar acompañamiento
-    accomp_path = os.path.join(args.output_dir, "accompaniment_generated.wav")
-    generator.process(args.style, accomp_path, duration=args.duration)
+    def mix(separation, generation):
+        if "vocals" not in separation:
+            raise RuntimeError(f"{os.path.basename(input_audio)} no tiene voz que remezclar")
+        return mixer.process(separation["vocals"], generation, final_mix)
 
-    # 3. Mezclar
-    final_mix = os.path.join(args.output_dir, "final_remix.wav")
-    mixer.process(vocal_path, accomp_path, final_mix)
+    grafo = GrafoEtapas(hilos_torch=hilos_torch, log=log)
+    grafo.etapa("separation", lambda: separator.process(input_audio, output_dir, profile=profile, stems=stems,
+                                                        stem_format=stem_format))
+    grafo.etapa("generation", lambda: generator.process(style, accomp_path, duration=duration, seed=seed))
+    grafo.etapa("mix", mix, depende=("separation", "generation"))
+    grafo.ejecutar()
 
-    log("=" * 50)
-    log(f"✅ ¡Remix completado! → {final_mix}")
-    log("=" * 50)
+    t = grafo.tiempos
+    log(f"⏱ Separación {t['separation']['seg']:.1f}s ∥ generación {t['generation']['seg']:.1f}s, "
+        f"mezcla {t['mix']['seg']:.1f}s → total {t['total']['seg']:.1f}s")
+    return final_mix
+
+
+def benchmark_main(argv=None):
+    """
+    Benchmarks de separación, generación, mezcla y pipeline completo.
+    Uso: python procesamiento_audio.py benchmark --lengths 10 30 --out bench.json [--baseline old.json]
+    """
+    from benchmark import benchmark_main as run_benchmark
+    return run_benchmark(argv)
+
+
+def batch_main(argv=None):
+    """
+    Remix de un directorio o manifiesto completo, en paralelo y reanudable.
+    Uso: python procesamiento_audio.py batch --input canciones/ --style lo-fi --jobs 2 --output_dir lote
+    """
+    from lote_remix import batch_main as run_batch
+    return run_batch(argv)
+
+
+def compare_main(argv=None):
+    """
+    Calidad (SDR, distancia espectral) y velocidad de int8/bf16 frente a fp32.
+    Uso: python procesamiento_audio.py compare --precision int8 --input referencia.wav [--min-sdr 20]
+    """
+    from comparar_precision import compare_main as run_compare
+    return run_compare(argv)
+
+
+if __name__ == "__main__" and sys.argv[1:2] == ["benchmark"]:
+    sys.exit(benchmark_main(sys.argv[2:]))
+
+if __name__ == "__main__" and sys.argv[1:2] == ["batch"]:
+    sys.exit(batch_main(sys.argv[2:]))
+
+if __name__ == "__main__" and sys.argv[1:2] == ["compare"]:
+    sys.exit(compare_main(sys.argv[2:]))
 
 # Evitar ejecución automática cuando Flask recarga
 if __name__ == "__main__" and os.getenv("WERKZEUG_RUN_MAIN") == "true":
@@ -0,0 +1,319 @@
+# subidas.py
+# Subida de archivos grandes por trozos y reanudable.
+#
+#   POST    /upload/sesiones                  {"filename", "size"} → sesión nueva
+#   GET     /upload/sesiones/<id>             offset confirmado (para reanudar)
+#   PUT     /upload/sesiones/<id>?offset=N    cuerpo = bytes del trozo
+#   POST    /upload/sesiones/<id>/finalizar   mueve el archivo a uploads/
+#   DELETE  /upload/sesiones/<id>             cancela
+#
+# Cada trozo se copia del socket al archivo parcial por bloques (nada se guarda
+# entero en memoria) y alimenta un sha256 incremental. En cuanto llegan los
+# primeros bytes se sondea la cabecera del audio: un archivo que no se puede
+# decodificar se rechaza ahí, antes de subir el resto y de encolar nada.
+# Los contenedores MP4 (m4a, mov...) pueden llevar el índice (átomo moov) al
+# final: para ellos un sondeo fallido del principio no es concluyente y la
+# decisión se toma en finalizar(), con el archivo completo.
+# Las sesiones viven en uploads/.sesiones/ y sobreviven a un reinicio.
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+import uuid
+
+import soundfile as sf
+
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(8 * 1024 ** 2)))       # trozo sugerido
+UPLOAD_CHUNK_MAX_BYTES = int(os.getenv("UPLOAD_CHUNK_MAX_BYTES", str(64 * 1024 ** 2)))
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(2 * 1024 ** 3)))
+UPLOAD_SESSION_TTL = float(os.getenv("UPLOAD_SESSION_TTL", str(24 * 3600)))       # segundos sin actividad
+UPLOAD_PROBE_BYTES = 64 * 1024   # bytes necesarios para sondear la cabecera
+COPY_BLOCK = 1024 ** 2
+# Contenedores ISO-BMFF: sin el átomo moov (a menudo al final) no se pueden sondear
+EXTENSIONES_INDICE_AL_FINAL = (".m4a", ".m4b", ".mp4", ".mov", ".3gp", ".3g2")
+
+
+class SubidaError(Exception):
+    """Error de una subida que se devuelve al cliente con un código HTTP."""
+    def __init__(self, mensaje, status=400, **extra):
+        super().__init__(mensaje)
+        self.status = status
+        self.extra = extra
+
+
+# =========================
+# SONDEO DE CABECERAS
+# =========================
+def sondear_audio(ruta):
+    """
+    Lee solo la cabecera del archivo y devuelve {samplerate, canales, duracion, formato}.
+    Con un archivo a medio subir la duración puede ser aproximada o None.
+    Lanza ValueError si ni soundfile ni ffprobe reconocen un audio.
+    """
+    try:
+        info = sf.info(ruta)
+        if info.samplerate > 0 and info.channels > 0:
+            duracion = info.frames / info.samplerate if info.frames > 0 else None
+            return {"samplerate": info.samplerate, "canales": info.channels,
+                    "duracion": duracion, "formato": info.format}
+    except Exception as e:
+        error = e
+    else:
+        error = "cabecera sin canales o sin frecuencia de muestreo"
+
+    # Formatos que soundfile no lee (m4a, aac...) se decodifican luego con ffmpeg
+    try:
+        result = subprocess.run(
+            ["ffprobe", "-v", "error", "-select_streams", "a:0", "-show_entries",
+             "stream=sample_rate,channels:format=duration,format_name", "-of", "json", ruta],
+            capture_output=True, text=True, timeout=30,
+        )
+    except (FileNotFoundError, subprocess.TimeoutExpired):
+        raise ValueError(f"No se reconoce como audio: {error}")
+    datos = json.loads(result.stdout or "{}") if result.returncode == 0 else {}
+    if not datos.get("streams"):
+        raise ValueError(f"No se reconoce como audio: {error}")
+    stream, formato = datos["streams"][0], datos.get("format", {})
+    return {
+        "samplerate": int(stream.get("sample_rate", 0)),
+        "canales": int(stream.get("channels", 0)),
+        "duracion": float(formato["duration"]) if formato.get("duration") else None,
+        "formato": formato.get("format_name"),
+    }
+
+
+def indice_al_final(ruta, filename):
+    """True si el archivo es un contenedor MP4 (por extensión o por su caja ftyp inicial)."""
+    if os.path.splitext(filename)[1].lower() in EXTENSIONES_INDICE_AL_FINAL:
+        return True
+    with open(ruta, "rb") as f:
+        return f.read(8)[4:8] == b"ftyp"
+
+
+def validar_audio(ruta):
+    """Sondea un archivo completo: además exige que tenga algo de audio."""
+    if os.path.getsize(ruta) == 0:
+        raise ValueError("El archivo está vacío")
+    info = sondear_audio(ruta)
+    if not info["duracion"]:
+        raise ValueError("El archivo no contiene audio")
+    return info
+
+
+def sha256_archivo(ruta):
+    h = hashlib.sha256()
+    with open(ruta, "rb") as f:
+        for bloque in iter(lambda: f.read(COPY_BLOCK), b""):
+            h.update(bloque)
+    return h.hexdigest()
+
+
+# =========================
+# SESIONES
+# =========================
+class SesionSubida:
+    """Una subida en curso: archivo parcial + metadatos (offset confirmado, hash, sondeo)."""
+
+    def __init__(self, carpeta, datos):
+        self.carpeta = carpeta
+        self.datos = datos
+        self.lock = threading.Lock()
+        self._hash = None   # sha256 incremental (se reconstruye del parcial tras un reinicio)
+
+    @property
+    def id(self):
+        return self.datos["id"]
+
+    @property
+    def ruta_parcial(self):
+        return os.path.join(self.carpeta, "datos.part")
+
+    @property
+    def offset(self):
+        return self.datos["offset"]
+
+    def guardar(self):
+        self.datos["actualizado"] = time.time()
+        tmp = os.path.join(self.carpeta, "sesion.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.datos, f, ensure_ascii=False)
+        os.replace(tmp, os.path.join(self.carpeta, "sesion.json"))
+
+    def hasher(self):
+        if self._hash is None:
+            self._hash = hashlib.sha256()
+            with open(self.ruta_parcial, "rb") as f:
+                restante = self.offset
+                while restante:
+                    bloque = f.read(min(COPY_BLOCK, restante))
+                    if not bloque:
+                        break
+                    self._hash.update(bloque)
+                    restante -= len(bloque)
+        return self._hash
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "filename": self.datos["filename"],
+            "size": self.datos["size"],
+            "offset": self.offset,
+            "chunk_size": UPLOAD_CHUNK_SIZE,
+            "audio": self.datos.get("audio"),
+        }
+
+
+class GestorSubidas:
+    """Crea, reanuda y finaliza sesiones de subida dentro de `directorio`/.sesiones."""
+
+    def __init__(self, directorio):
+        self.directorio = directorio
+        self.raiz = os.path.join(directorio, ".sesiones")
+        self._sesiones = {}
+        self._lock = threading.Lock()
+        os.makedirs(self.raiz, exist_ok=True)
+
+    def _carpeta(self, sesion_id):
+        if not re.fullmatch(r"[0-9a-f]{32}", sesion_id or ""):
+            raise SubidaError("Sesión de subida no encontrada", status=404)
+        return os.path.join(self.raiz, sesion_id)
+
+    def crear(self, filename, size):
+        if size is None or size < 0:
+            raise SubidaError("Falta el tamaño total del archivo ('size')")
+        if size == 0:
+            raise SubidaError("El archivo está vacío")
+        if size > UPLOAD_MAX_BYTES:
+            raise SubidaError(f"El archivo supera el máximo de {UPLOAD_MAX_BYTES} bytes", status=413)
+
+        self.purgar()
+        sesion_id = uuid.uuid4().hex
+        carpeta = os.path.join(self.raiz, sesion_id)
+        os.makedirs(carpeta)
+        sesion = SesionSubida(carpeta, {"id": sesion_id, "filename": filename, "size": size,
+                                        "offset": 0, "creado": time.time()})
+        open(sesion.ruta_parcial, "wb").close()
+        sesion.guardar()
+        with self._lock:
+            self._sesiones[sesion_id] = sesion
+        print(f"📤 Sesión de subida {sesion_id}: {filename} ({size} bytes)")
+        return sesion
+
+    def obtener(self, sesion_id):
+        """Sesión en memoria o, tras un reinicio, la que quedó en disco."""
+        with self._lock:
+            sesion = self._sesiones.get(sesion_id)
+            if sesion is not None:
+                return sesion
+            carpeta = self._carpeta(sesion_id)
+            try:
+                with open(os.path.join(carpeta, "sesion.json"), "r", encoding="utf-8") as f:
+                    sesion = SesionSubida(carpeta, json.load(f))
+            except (OSError, json.JSONDecodeError):
+                raise SubidaError("Sesión de subida no encontrada", status=404)
+            # Lo escrito tras el último offset confirmado se descarta
+            with open(sesion.ruta_parcial, "r+b") as f:
+                f.truncate(sesion.offset)
+            self._sesiones[sesion_id] = sesion
+            return sesion
+
+    def escribir(self, sesion_id, offset, stream, longitud=None):
+        """
+        Añade un trozo leído de `stream` en la posición `offset`.
+        Solo se acepta el offset confirmado (409 con el correcto si no coincide),
+        así un cliente que reintenta sabe desde dónde seguir.
+        """
+        sesion = self.obtener(sesion_id)
+        if not sesion.lock.acquire(blocking=False):
+            raise SubidaError("Ya se está escribiendo un trozo en esta sesión", status=409,
+                              offset=sesion.offset)
+        try:
+            if offset != sesion.offset:
+                raise SubidaError(f"Offset {offset} inesperado, se esperaba {sesion.offset}",
+                                  status=409, offset=sesion.offset)
+            maximo = min(UPLOAD_CHUNK_MAX_BYTES, sesion.datos["size"] - offset)
+            if longitud is not None and longitud > maximo:
+                raise SubidaError(f"El trozo supera el máximo permitido ({maximo} bytes)", status=413)
+
+            hasher = sesion.hasher()
+            escritos = 0
+            with open(sesion.ruta_parcial, "r+b") as f:
+                f.seek(offset)
+                while True:
+                    bloque = stream.read(min(COPY_BLOCK, maximo - escritos + 1))
+                    if not bloque:
+                        break
+                    escritos += len(bloque)
+                    if escritos > maximo:
+                        f.truncate(offset)
+                        sesion._hash = None
+                        raise SubidaError(f"El trozo supera el máximo permitido ({maximo} bytes)",
+                                          status=413)
+                    f.write(bloque)
+                    hasher.update(bloque)
+                f.flush()
+                os.fsync(f.fileno())
+
+            sesion.datos["offset"] = offset + escritos
+            if "audio" not in sesion.datos and (sesion.offset >= UPLOAD_PROBE_BYTES
+                                                or sesion.offset == sesion.datos["size"]):
+                self._sondear(sesion)
+            sesion.guardar()
+            return sesion
+        finally:
+            sesion.lock.release()
+
+    def _sondear(self, sesion):
+        try:
+            sesion.datos["audio"] = sondear_audio(sesion.ruta_parcial)
+        except ValueError as e:
+            completo = sesion.offset == sesion.datos["size"]
+            if not completo and indice_al_final(sesion.ruta_parcial, sesion.datos["filename"]):
+                # Sin el final del archivo no se sabe: lo decide finalizar()
+                sesion.datos["audio"] = None
+                print(f"📤 Sesión {sesion.id}: cabecera MP4 sin índice todavía, se valida al finalizar")
+                return
+            self.cancelar(sesion.id)
+            raise SubidaError(f"{sesion.datos['filename']} no parece un archivo de audio válido: {e}",
+                              status=415)
+
+    def finalizar(self, sesion_id, destino):
+        """
+        Comprueba que el archivo está completo y se puede decodificar, lo mueve
+        a `destino` y devuelve (sha256, info de audio).
+        """
+        sesion = self.obtener(sesion_id)
+        with sesion.lock:
+            if sesion.offset != sesion.datos["size"]:
+                raise SubidaError(f"Subida incompleta: {sesion.offset} de {sesion.datos['size']} bytes",
+                                  status=409, offset=sesion.offset)
+            try:
+                info = validar_audio(sesion.ruta_parcial)
+            except ValueError as e:
+                self.cancelar(sesion_id)
+                raise SubidaError(f"{sesion.datos['filename']}: {e}", status=415)
+            sha256 = sesion.hasher().hexdigest()
+            os.replace(sesion.ruta_parcial, destino)
+        self.cancelar(sesion_id)
+        return sha256, info
+
+    def cancelar(self, sesion_id):
+        with self._lock:
+            self._sesiones.pop(sesion_id, None)
+        shutil.rmtree(self._carpeta(sesion_id), ignore_errors=True)
+
+    def purgar(self):
+        """Borra las sesiones sin actividad desde hace más de UPLOAD_SESSION_TTL."""
+        limite = time.time() - UPLOAD_SESSION_TTL
+        for nombre in os.listdir(self.raiz):
+            try:
+                if os.path.getmtime(os.path.join(self.raiz, nombre, "sesion.json")) < limite:
+                    print(f"🧹 Sesión de subida caducada: {nombre}")
+                    self.cancelar(nombre)
+            except (OSError, SubidaError):
+                continue
@@ -0,0 +1,214 @@
+# trabajos.py
+# Cola de trabajos en segundo plano para las tareas pesadas (separar, mezclar).
+# Objetivo: que las rutas de Flask respondan al instante con un id de trabajo
+# y que el trabajo real corra en un pool de hilos acotado.
+
+import json
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, Optional
+
+# Estados posibles de un trabajo
+PENDIENTE = "pendiente"
+EN_CURSO = "en_curso"
+COMPLETADO = "completado"
+ERROR = "error"
+
+ESTADOS_FINALES = (COMPLETADO, ERROR)
+
+
+class ColaLlenaError(RuntimeError):
+    """Se lanza cuando ya hay demasiados trabajos esperando en la cola."""
+
+
+class Trabajo:
+    """
+    Representa una tarea encolada (por ejemplo una separación con Demucs).
+    Guarda su estado, el progreso (0.0 - 1.0) y el resultado o el error.
+    """
+    def __init__(self, tipo: str):
+        self.id = uuid.uuid4().hex
+        self.tipo = tipo
+        self.estado = PENDIENTE
+        self.progreso = 0.0
+        self.mensaje = "En cola"
+        self.eta_seg: Optional[float] = None  # segundos estimados hasta terminar
+        self.resultado = None
+        self.parcial: dict = {}              # resultados intermedios (p. ej. stems ya escritos)
+        self.error: Optional[str] = None
+        self.creado = datetime.now()
+        self.iniciado: Optional[datetime] = None
+        self.terminado: Optional[datetime] = None
+        self.version = 0                     # aumenta con cada cambio (para SSE)
+        self._cambio = threading.Condition()
+
+    def actualizar(self, progreso: Optional[float] = None, mensaje: Optional[str] = None,
+                   eta_seg: Optional[float] = None):
+        """Actualiza el progreso, el mensaje y/o la ETA y avisa a quien esté esperando."""
+        with self._cambio:
+            if progreso is not None:
+                self.progreso = max(0.0, min(1.0, float(progreso)))
+            if mensaje is not None:
+                self.mensaje = mensaje
+            if eta_seg is not None:
+                self.eta_seg = max(0.0, float(eta_seg))
+            self.version += 1
+            self._cambio.notify_all()
+
+    def publicar(self, clave: str, valor):
+        """Añade un resultado intermedio, visible en to_dict() antes de que el trabajo termine."""
+        with self._cambio:
+            self.parcial = dict(self.parcial, **{clave: valor})
+            self.version += 1
+            self._cambio.notify_all()
+
+    def _marcar(self, estado: str, **campos):
+        with self._cambio:
+            self.estado = estado
+            for nombre, valor in campos.items():
+                setattr(self, nombre, valor)
+            self.version += 1
+            self._cambio.notify_all()
+
+    def esperar_cambio(self, version: int, timeout: float = 15.0) -> bool:
+        """Bloquea hasta que la versión cambie o pase el timeout. Devuelve True si hubo cambio."""
+        with self._cambio:
+            return self._cambio.wait_for(lambda: self.version != version, timeout=timeout)
+
+    def to_dict(self) -> dict:
+        """Devuelve el estado del trabajo en un formato apto para JSON."""
+        return {
+            "id": self.id,
+            "tipo": self.tipo,
+            "estado": self.estado,
+            "progreso": round(self.progreso, 4),
+            "mensaje": self.mensaje,
+            "eta_seg": round(self.eta_seg, 1) if self.eta_seg is not None and self.estado == EN_CURSO else None,
+            "resultado": self.resultado,
+            "parcial": self.parcial,
+            "error": self.error,
+            "creado": self.creado.isoformat(),
+            "iniciado": self.iniciado.isoformat() if self.iniciado else None,
+            "terminado": self.terminado.isoformat() if self.terminado else None,
+        }
+
+    def __repr__(self):
+        return f"Trabajo(id={self.id}, tipo={self.tipo}, estado={self.estado})"
+
+
+class ProgresoEtapa:
+    """
+    Callback de progreso para una etapa larga dentro de un trabajo.
+
+    Se llama como progreso(hecho, total, mensaje) desde el bucle de la etapa
+    (segmentos de Demucs, tokens de MusicGen...) y lo traduce al rango
+    [inicio, fin] del progreso del trabajo.
+
+    ETA: antes de tener avances se estima con el real-time factor medido
+    (rtf * audio_seg); a medida que avanza pesa más el ritmo observado.
+    La ETA cubre solo esta etapa (lo que venga después no se conoce).
+    """
+    def __init__(self, trabajo: Trabajo, inicio: float, fin: float,
+                 audio_seg: Optional[float] = None, rtf: Optional[float] = None):
+        self.trabajo = trabajo
+        self.inicio = inicio
+        self.fin = fin
+        self.esperado = rtf * audio_seg if rtf and audio_seg else None
+        self._t0 = time.perf_counter()
+
+    def __call__(self, hecho: float, total: float, mensaje: Optional[str] = None):
+        fraccion = min(1.0, hecho / total) if total else 0.0
+        transcurrido = time.perf_counter() - self._t0
+
+        estimado = self.esperado
+        if fraccion > 0:
+            medido = transcurrido / fraccion
+            estimado = medido if estimado is None else fraccion * medido + (1 - fraccion) * estimado
+        eta = None if estimado is None else max(0.0, estimado - transcurrido)
+        self.trabajo.actualizar(self.inicio + (self.fin - self.inicio) * fraccion, mensaje, eta_seg=eta)
+
+
+class GestorTrabajos:
+    """
+    Pool acotado de hilos que ejecuta trabajos y mantiene su estado en memoria.
+
+    - max_workers: cuántos trabajos corren a la vez.
+    - max_pendientes: cuántos pueden esperar en cola antes de rechazar nuevos.
+    - retencion_seg: cuánto tiempo se conservan los trabajos ya terminados.
+    """
+    def __init__(self, max_workers: int = 2, max_pendientes: int = 16, retencion_seg: float = 3600):
+        self.max_workers = max_workers
+        self.max_pendientes = max_pendientes
+        self.retencion_seg = retencion_seg
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="trabajo")
+        self._trabajos: Dict[str, Trabajo] = {}
+        self._lock = threading.Lock()
+
+    def enviar(self, tipo: str, funcion: Callable, *args, **kwargs) -> Trabajo:
+        """
+        Encola `funcion(trabajo, *args, **kwargs)` y devuelve el Trabajo al instante.
+        La función recibe el propio Trabajo para poder informar progreso.
+        """
+        with self._lock:
+            self._purgar()
+            pendientes = sum(1 for t in self._trabajos.values() if t.estado == PENDIENTE)
+            if pendientes >= self.max_pendientes:
+                raise ColaLlenaError(f"Hay {pendientes} trabajos en cola, inténtalo más tarde")
+            trabajo = Trabajo(tipo)
+            self._trabajos[trabajo.id] = trabajo
+
+        self._executor.submit(self._ejecutar, trabajo, funcion, args, kwargs)
+        print(f"Trabajo encolado: {trabajo}")
+        return trabajo
+
+    def obtener(self, trabajo_id: str) -> Optional[Trabajo]:
+        with self._lock:
+            return self._trabajos.get(trabajo_id)
+
+    def listar(self) -> list:
+        with self._lock:
+            return [t.to_dict() for t in self._trabajos.values()]
+
+    def apagar(self, esperar: bool = True):
+        self._executor.shutdown(wait=esperar)
+
+    def _ejecutar(self, trabajo: Trabajo, funcion: Callable, args, kwargs):
+        trabajo._marcar(EN_CURSO, iniciado=datetime.now(), mensaje="En curso")
+        try:
+            resultado = funcion(trabajo, *args, **kwargs)
+            trabajo._marcar(COMPLETADO, resultado=resultado, progreso=1.0,
+                            mensaje="Completado", terminado=datetime.now())
+        except Exception as e:
+            print(f"ERROR EN TRABAJO {trabajo.id}:")
+            print(traceback.format_exc())
+            trabajo._marcar(ERROR, error=str(e), mensaje="Error", terminado=datetime.now())
+
+    def _purgar(self):
+        """Elimina trabajos terminados hace más de `retencion_seg` (llamar con el lock tomado)."""
+        limite = time.time() - self.retencion_seg
+        viejos = [
+            tid for tid, t in self._trabajos.items()
+            if t.estado in ESTADOS_FINALES and t.terminado and t.terminado.timestamp() < limite
+        ]
+        for tid in viejos:
+            del self._trabajos[tid]
+
+
+def eventos_sse(trabajo: Trabajo, timeout: float = 15.0):
+    """
+    Generador de eventos Server-Sent Events con el estado del trabajo.
+    Emite un evento por cada cambio y un comentario de keep-alive si no hay cambios.
+    """
+    version = -1
+    while True:
+        if trabajo.version != version:
+            version = trabajo.version
+            yield f"data: {json.dumps(trabajo.to_dict(), ensure_ascii=False)}\n\n"
+            if trabajo.estado in ESTADOS_FINALES:
+                return
+        elif not trabajo.esperar_cambio(version, timeout=timeout):
+            yield ": keep-alive\n\n"